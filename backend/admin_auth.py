@@ -0,0 +1,18 @@
+from fastapi import Header, HTTPException
+from typing import Optional
+import hmac
+import os
+
+# Bearer token for operational admin endpoints. Without ADMIN_TOKEN set they are
+# disabled rather than open.
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+
+async def require_admin(authorization: Optional[str] = Header(None)):
+    """FastAPI dependency: 403 unless the request carries `Authorization: Bearer <ADMIN_TOKEN>`"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
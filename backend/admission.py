@@ -0,0 +1,263 @@
+from collections import OrderedDict
+from pymongo import monitoring
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Admission control for write endpoints.
+#
+# Each limited route has three gates, checked in order:
+#   1. a token bucket per client, which answers 429 once a client exceeds its rate;
+#   2. adaptive shedding, which answers 503 for a growing share of requests as the
+#      observed MongoDB latency rises past ADMISSION_LATENCY_MS;
+#   3. a concurrency limit with a short wait queue. A request that would queue
+#      past max_queue, or waits longer than ADMISSION_QUEUE_TIMEOUT, gets a 503.
+# Rejections are immediate and carry Retry-After, so a flood is turned away in
+# microseconds instead of piling work onto MongoDB. Routes without a limit,
+# which includes all browse traffic, pass straight through.
+#
+# A client is its IP address. Behind an ingress, set FORWARDED_ALLOW_IPS to the
+# ingress addresses, the same setting uvicorn and serve.py use: the client is
+# then the last X-Forwarded-For entry that is not one of them. A request that
+# carries X-Forwarded-For from a proxy that is not listed cannot be told apart
+# from other shoppers behind it, so it takes a token from one site-wide bucket
+# per route, ADMISSION_SITE_SCALE times the per-client rate, instead.
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_CLIENT_RATE = float(os.environ.get('ADMISSION_CLIENT_RATE', 2))  # requests/second per client
+ADMISSION_CLIENT_BURST = float(os.environ.get('ADMISSION_CLIENT_BURST', 10))
+ADMISSION_LATENCY_MS = float(os.environ.get('ADMISSION_LATENCY_MS', 250))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))
+ADMISSION_MAX_CLIENTS = int(os.environ.get('ADMISSION_MAX_CLIENTS', 100000))
+ADMISSION_SITE_SCALE = float(os.environ.get('ADMISSION_SITE_SCALE', 50))
+# Proxies whose X-Forwarded-For is trusted; "*" trusts any sender, so it is ignored here
+TRUSTED_PROXIES = {
+    address.strip() for address in os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1').split(',')
+    if address.strip() and address.strip() != '*'
+}
+# Commands the limited routes issue; the shedding signal is the slowest of them
+ADMISSION_LATENCY_COMMANDS = [
+    name.strip() for name in os.environ.get(
+        'ADMISSION_LATENCY_COMMANDS', 'find,insert,update,delete,findAndModify'
+    ).split(',') if name.strip()
+]
+
+
+class MongoLatencyTracker(monitoring.CommandListener):
+    """
+    Exponentially weighted moving average of MongoDB round trips, per command name.
+
+    Only single-statement commands of the tracked kinds are counted: an
+    aggregation or a bulk insert from a background job takes long because of its
+    size, not because MongoDB is struggling, and must not shed checkout traffic.
+    """
+
+    # Statement lists of the write commands; more than one entry is a bulk write
+    STATEMENTS = {"insert": "documents", "update": "updates", "delete": "deletes"}
+
+    def __init__(self, alpha: float = 0.1, half_life_seconds: float = 2.0,
+                 commands: List[str] = ADMISSION_LATENCY_COMMANDS):
+        self.alpha = alpha
+        self.half_life_seconds = half_life_seconds
+        self.commands = set(commands)
+        # command name -> (average ms, monotonic time of the last observation)
+        self._averages: Dict[str, Tuple[float, float]] = {}
+        self._bulk: set = set()
+
+    def _observe(self, event):
+        if event.command_name not in self.commands:
+            return
+        if event.request_id in self._bulk:
+            self._bulk.discard(event.request_id)
+            return
+        average, _ = self._averages.get(event.command_name, (0.0, 0.0))
+        average += self.alpha * (event.duration_micros / 1000 - average)
+        self._averages[event.command_name] = (average, time.monotonic())
+
+    def averages(self) -> Dict[str, float]:
+        # Each decays while no commands complete, so shedding cannot keep itself
+        # going once the requests that would have updated it are all turned away
+        now = time.monotonic()
+        return {
+            name: average * 0.5 ** ((now - observed_at) / self.half_life_seconds)
+            for name, (average, observed_at) in self._averages.items()
+        }
+
+    @property
+    def average_ms(self) -> float:
+        return max(self.averages().values(), default=0.0)
+
+    def started(self, event):
+        statements = self.STATEMENTS.get(event.command_name)
+        if statements and len(event.command.get(statements) or ()) > 1:
+            self._bulk.add(event.request_id)
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        self._observe(event)
+
+
+# Registered on the MongoDB client in database.py
+mongo_latency = MongoLatencyTracker()
+
+
+class TokenBuckets:
+    """Per-client token buckets, keeping only the most recently seen clients"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, client: str, now: Optional[float] = None) -> float:
+        """Take a token; returns 0 if one was available, else the seconds until one is"""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RouteLimit:
+    def __init__(self, method: str, path: str, max_concurrent: int, max_queue: int,
+                 rate: float = ADMISSION_CLIENT_RATE, burst: float = ADMISSION_CLIENT_BURST):
+        self.method = method
+        self.pattern = re.compile(path)
+        self.name = f"{method} {path}"
+        self.max_queue = max_queue
+        self.buckets = TokenBuckets(rate, burst)
+        # Shared by every request whose client cannot be identified
+        self.site_bucket = TokenBuckets(rate * ADMISSION_SITE_SCALE, burst * ADMISSION_SITE_SCALE, max_clients=1)
+        self.waiting = 0
+        self.slots = asyncio.Semaphore(max_concurrent)
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and self.pattern.fullmatch(path) is not None
+
+
+def client_address(scope, trusted_proxies=TRUSTED_PROXIES) -> Optional[str]:
+    """The client's IP address; None when it sits behind a proxy that is not trusted"""
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    forwarded = None
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            forwarded = [entry.strip() for entry in value.decode("latin-1").split(",")]
+            break
+    if not forwarded:
+        return peer
+    # Entries before the last untrusted one were supplied by the client itself
+    resolved = next((entry for entry in reversed(forwarded) if entry not in trusted_proxies), None)
+    if peer in trusted_proxies:
+        return resolved
+    if peer == resolved:
+        # uvicorn's proxy middleware already replaced the peer with the client
+        return peer
+    return None
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, limits: List[RouteLimit], latency: MongoLatencyTracker = mongo_latency,
+                 latency_threshold_ms: float = ADMISSION_LATENCY_MS, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.app = app
+        self.limits = limits
+        self.latency = latency
+        self.latency_threshold_ms = latency_threshold_ms
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.stats: Dict[str, int] = {"admitted": 0, "rate_limited": 0, "shed_latency": 0, "shed_queue": 0}
+        self._warned_untrusted = False
+
+    def _route(self, scope) -> Optional[RouteLimit]:
+        for limit in self.limits:
+            if limit.matches(scope["method"], scope["path"]):
+                return limit
+        return None
+
+    def _shed_for_latency(self) -> bool:
+        # Shed nothing at the threshold, rising linearly to almost everything at twice the
+        # threshold; the requests still let through keep measuring the latency
+        overshoot = (self.latency.average_ms - self.latency_threshold_ms) / self.latency_threshold_ms
+        return overshoot > 0 and random.random() < min(overshoot, 0.95)
+
+    async def _reject(self, send, status: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        limit = self._route(scope) if self.enabled and scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_address(scope)
+        if client is None:
+            if not self._warned_untrusted:
+                self._warned_untrusted = True
+                logger.warning(
+                    "Requests carry X-Forwarded-For from a proxy not in FORWARDED_ALLOW_IPS; "
+                    "rate limiting them site-wide"
+                )
+            wait = limit.site_bucket.take("site")
+        else:
+            wait = limit.buckets.take(client)
+        if wait > 0:
+            self.stats["rate_limited"] += 1
+            await self._reject(send, 429, "Too many requests", wait)
+            return
+
+        if self._shed_for_latency():
+            self.stats["shed_latency"] += 1
+            await self._reject(send, 503, "Service is busy, please retry shortly", 1)
+            return
+
+        if limit.slots.locked():
+            if limit.waiting >= limit.max_queue:
+                self.stats["shed_queue"] += 1
+                await self._reject(send, 503, "Service is busy, please retry shortly", 1)
+                return
+            limit.waiting += 1
+            try:
+                await asyncio.wait_for(limit.slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["shed_queue"] += 1
+                await self._reject(send, 503, "Service is busy, please retry shortly", self.queue_timeout)
+                return
+            finally:
+                limit.waiting -= 1
+        else:
+            await limit.slots.acquire()
+
+        self.stats["admitted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.slots.release()
@@ -0,0 +1,129 @@
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Hot/cold tiering of finished orders and payment transactions.
+#
+# Documents in a terminal state older than ARCHIVE_AFTER_DAYS are copied in small
+# batches into an archive collection and then deleted from the hot one. Archive
+# collections use a stronger WiredTiger block compressor (zstd by default), so old
+# data is cheap to keep, and the hot collections and their indexes stay small
+# enough to remain in cache. A batch is copied before it is deleted, and
+# documents already archived are skipped, so a move interrupted at any point is
+# completed by the next run. A pause between batches keeps the job from
+# competing with live traffic.
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 6 * 60 * 60))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.environ.get('ARCHIVE_BATCH_PAUSE_SECONDS', 0.5))
+ARCHIVE_BLOCK_COMPRESSOR = os.environ.get('ARCHIVE_BLOCK_COMPRESSOR', 'zstd')
+
+DUPLICATE_KEY = 11000
+
+
+class ArchiveTier(NamedTuple):
+    name: str
+    hot: Any
+    archive: Any
+    key: str  # unique business key, indexed in the archive
+    statuses: List[str]  # only documents in these terminal states move
+    indexes: tuple = ()  # further index keys the archive is queried by
+
+
+async def create_archive_collection(db, name: str, compressor: str = ARCHIVE_BLOCK_COMPRESSOR):
+    """Create a collection with the archive block compressor unless it exists already"""
+    try:
+        await db.create_collection(
+            name, storageEngine={"wiredTiger": {"configString": f"block_compressor={compressor}"}}
+        )
+        logger.info(f"Created archive collection {name} ({compressor})")
+    except CollectionInvalid:
+        pass
+
+
+class ArchiveJob:
+    def __init__(self, db, tiers: List[ArchiveTier], after_days: float = ARCHIVE_AFTER_DAYS,
+                 interval_seconds: float = ARCHIVE_INTERVAL_SECONDS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                 pause_seconds: float = ARCHIVE_BATCH_PAUSE_SECONDS):
+        self.db = db
+        self.tiers = tiers
+        self.after_days = after_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        for tier in self.tiers:
+            await create_archive_collection(self.db, tier.archive.name)
+            await tier.hot.create_index([("status", 1), ("created_at", 1)])
+            await tier.archive.create_index(tier.key, unique=True)
+            for keys in tier.indexes:
+                await tier.archive.create_index(keys)
+
+    async def _copy(self, tier: ArchiveTier, documents: List[Dict[str, Any]]):
+        try:
+            await tier.archive.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Left over from an interrupted run; anything else is a real failure
+            if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def archive_tier(self, tier: ArchiveTier, now: Optional[datetime] = None) -> int:
+        """Move every eligible document of one tier; returns how many moved"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        query = {"status": {"$in": tier.statuses}, "created_at": {"$lt": cutoff}}
+        moved = 0
+        while True:
+            batch = await tier.hot.find(query).sort("created_at", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            await self._copy(tier, batch)
+            # Re-check the status so a document changed since it was read stays hot
+            result = await tier.hot.delete_many(
+                {"_id": {"$in": [document["_id"] for document in batch]}, "status": {"$in": tier.statuses}}
+            )
+            moved += result.deleted_count
+            if len(batch) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause_seconds)
+        return moved
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        stats = {}
+        for tier in self.tiers:
+            stats[tier.name] = await self.archive_tier(tier, now)
+        if any(stats.values()):
+            logger.info(f"Archived documents: {stats}")
+        return stats
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Archive job failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self.interval_seconds <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
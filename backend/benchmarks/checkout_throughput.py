@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Checkout throughput benchmark
+
+Drives POST /api/orders -> POST /api/checkout/create-session ->
+GET /api/checkout/status/{session_id} end to end against the in-process app,
+with the fake payment provider standing in for Stripe. Only a MongoDB
+instance (MONGO_URL / DB_NAME) is required.
+
+    PAYMENT_PROVIDER=fake FAKE_PAYMENT_LATENCY_MS=80 \\
+        python benchmarks/checkout_throughput.py --checkouts 2000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('PAYMENT_PROVIDER', 'fake')
+# Every request comes from the one in-process client, which the per-client rate
+# limits would otherwise turn away after the first few checkouts
+os.environ.setdefault('ADMISSION_ENABLED', '0')
+
+import httpx
+
+ORDER = {
+    "items": [{"product_id": 1, "name": "Urban Essential Tee", "price": 28, "quantity": 2, "image": ""}],
+    "total": 56,
+    "customer_email": "bench@example.com",
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def checkout(client: httpx.AsyncClient, latencies: dict):
+    started = time.perf_counter()
+    response = await client.post("/api/orders", json=ORDER)
+    response.raise_for_status()
+    order_id = response.json()["id"]
+    latencies["order"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    response = await client.post("/api/checkout/create-session", json={
+        "order_id": order_id,
+        "customer_email": ORDER["customer_email"],
+        "origin_url": "http://localhost:3000",
+    })
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    latencies["session"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    response = await client.get(f"/api/checkout/status/{session_id}")
+    response.raise_for_status()
+    latencies["status"].append(time.perf_counter() - started)
+
+
+async def run(args):
+    from server import app, startup_event, shutdown_db_client
+
+    await startup_event()
+    transport = httpx.ASGITransport(app=app)
+    latencies = {"order": [], "session": [], "status": []}
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            nonlocal failures
+            async with semaphore:
+                try:
+                    await checkout(client, latencies)
+                except httpx.HTTPError:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.checkouts)])
+        elapsed = time.perf_counter() - started
+
+    await shutdown_db_client()
+
+    completed = args.checkouts - failures
+    print(f"checkouts: {completed} ok, {failures} failed in {elapsed:.2f}s "
+          f"({completed / elapsed:.1f} checkouts/s, concurrency {args.concurrency})")
+    for step, values in latencies.items():
+        if values:
+            print(f"  {step:<8} p50 {statistics.median(values) * 1000:7.2f} ms   "
+                  f"p95 {percentile(values, 95) * 1000:7.2f} ms   "
+                  f"p99 {percentile(values, 99) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark
+
+Times, per endpoint shape, the serialization work done for one response (or
+request body) on the previous path and on the current one. No database or
+server is needed; documents are built in memory to look like MongoDB results.
+
+  before  FastAPI's default: validate the returned data against the
+          response_model, jsonable_encoder, then json.dumps (JSONResponse)
+  after   the documents as read, projected to the model's fields, written by
+          orjson (ORJSONResponse)
+
+For POST /api/orders the request side is included: the order built from the
+parsed body and dumped for the insert.
+
+    python benchmarks/serialization.py --products 1000 --repeat 200
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+import warnings
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from models import Order, OrderCreate, Product
+
+
+def make_products(count: int) -> List[dict]:
+    return [
+        {
+            "id": index + 1,
+            "name": f"Urban Piece {index + 1}",
+            "price": 20 + index % 80 + 0.99,
+            "category": ("tees", "hoodies", "pants", "accessories")[index % 4],
+            "image": f"https://images.example.com/products/{index + 1}.jpg",
+            "description": "Heavyweight cotton, relaxed fit, garment dyed. " * 2,
+            "sku": f"UT-{index + 1:06d}",
+        }
+        for index in range(count)
+    ]
+
+
+def make_order(items: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "items": [
+            {"product_id": index + 1, "name": f"Urban Piece {index + 1}", "price": 28.0,
+             "quantity": 1 + index % 3, "image": f"https://images.example.com/products/{index + 1}.jpg"}
+            for index in range(items)
+        ],
+        "total": 28.0 * items,
+        "customer_email": "bench@example.com",
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+    }
+
+
+def default_response(adapter: TypeAdapter, data) -> bytes:
+    validated = adapter.validate_python(data)
+    return json.dumps(
+        jsonable_encoder(adapter.dump_python(validated, mode="json")),
+        ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def fast_response(data) -> bytes:
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def create_order_before(body: dict, adapter: TypeAdapter) -> bytes:
+    order_data = OrderCreate.model_validate(body)
+    with warnings.catch_warnings():
+        # The v1-style dict() the previous code used
+        warnings.simplefilter("ignore", DeprecationWarning)
+        order = Order(**order_data.dict())
+        order.dict()  # document inserted
+    return default_response(adapter, order)
+
+
+def create_order_after(body: dict) -> bytes:
+    order_data = OrderCreate.model_validate(body)
+    order = Order(**dict(order_data))
+    return fast_response(order.model_dump())
+
+
+def timed(function, repeat: int) -> float:
+    """Median seconds per call"""
+    function()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000, help="products in a list response")
+    parser.add_argument("--order-items", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    products = make_products(args.products)
+    order = make_order(args.order_items)
+    body = {key: order[key] for key in ("items", "total", "customer_email")}
+    product_list = TypeAdapter(List[Product])
+    product_one = TypeAdapter(Product)
+    order_one = TypeAdapter(Order)
+
+    cases = [
+        (f"GET /api/products ({args.products})",
+         lambda: default_response(product_list, products), lambda: fast_response(products)),
+        ("GET /api/products/{id}",
+         lambda: default_response(product_one, products[0]), lambda: fast_response(products[0])),
+        ("GET /api/orders/{id}",
+         lambda: default_response(order_one, order), lambda: fast_response(order)),
+        ("POST /api/orders",
+         lambda: create_order_before(body, order_one), lambda: create_order_after(body)),
+    ]
+
+    print(f"{'endpoint':<28} {'before':>12} {'after':>12} {'speedup':>9}")
+    for name, before, after in cases:
+        slow, fast = timed(before, args.repeat), timed(after, args.repeat)
+        print(f"{name:<28} {slow * 1e6:9.1f} µs {fast * 1e6:9.1f} µs {slow / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark
+
+Measures, in fresh interpreter processes:
+  import   time to `import server`
+  ready    time from launching uvicorn until GET /api/ first answers 200,
+           which includes interpreter start, imports and the startup event
+
+Requires the MongoDB configured in .env (MONGO_URL / DB_NAME).
+
+    python benchmarks/startup.py --runs 5
+    python -X importtime -c "import server" 2>&1 | sort -t'|' -k2 -n | tail -20
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+IMPORT_PROBE = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_ready(timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/api/").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+        raise RuntimeError(f"Server did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def report(name: str, values):
+    print(f"  {name:<7} median {statistics.median(values) * 1000:8.1f} ms   "
+          f"min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    os.environ.setdefault('PAYMENT_PROVIDER', 'fake')
+    imports = [measure_import() for _ in range(args.runs)]
+    ready = [measure_ready(args.timeout) for _ in range(args.runs)]
+    print(f"cold start over {args.runs} runs:")
+    report("import", imports)
+    report("ready", ready)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+from bson import ObjectId
+from pymongo import ReturnDocument
+from email.message import EmailMessage
+from email_service import SmtpSettings, open_smtp_connection
+from datetime import datetime, timedelta
+from string import Template
+from typing import Any, Dict, Optional
+import asyncio
+import heapq
+import logging
+import os
+import smtplib
+import socket
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Newsletter campaign delivery.
+#
+# A producer walks newsletter_subscribers in _id order with a cursor, renders the
+# campaign template (compiled once) per recipient and feeds a bounded queue. A
+# fixed pool of workers, each owning one SMTP connection, drains it under a shared
+# rate limit. The highest _id below which every delivery has settled is
+# checkpointed periodically, so a restarted campaign resumes from there; at most
+# the in-flight window is sent twice.
+#
+# A campaign is delivered under a lease on its document, renewed at every
+# checkpoint, so that only one process sends it however many workers are asked
+# to start or resume it. A process that finds the lease held waits for it to
+# lapse, which also hands an interrupted campaign over once its sender is gone.
+
+CAMPAIGN_SMTP_CONNECTIONS = int(os.environ.get('CAMPAIGN_SMTP_CONNECTIONS', 4))
+CAMPAIGN_RATE_PER_SECOND = float(os.environ.get('CAMPAIGN_RATE_PER_SECOND', 50))
+CHECKPOINT_EVERY = 200
+CHECKPOINT_INTERVAL_SECONDS = 2.0
+CURSOR_BATCH_SIZE = 1000
+CAMPAIGN_LEASE_SECONDS = float(os.environ.get('CAMPAIGN_LEASE_SECONDS', 60))
+
+
+class CampaignLeaseLost(Exception):
+    """Another process took over the campaign; this one must stop sending"""
+    pass
+
+
+class RateLimiter:
+    """Spaces out acquisitions so that at most `rate` happen per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class _Progress:
+    """Tracks settled deliveries and the contiguous watermark used as checkpoint"""
+
+    def __init__(self, sent: int, failed: int):
+        self.sent = sent
+        self.failed = failed
+        self.session_sent = 0
+        self.watermark_seq = 0
+        self.watermark_id: Optional[ObjectId] = None
+        self._settled: list = []  # heap of (seq, subscriber _id)
+
+    def settle(self, seq: int, subscriber_id: ObjectId, ok: bool):
+        if ok:
+            self.sent += 1
+            self.session_sent += 1
+        else:
+            self.failed += 1
+        heapq.heappush(self._settled, (seq, subscriber_id))
+        while self._settled and self._settled[0][0] == self.watermark_seq + 1:
+            self.watermark_seq, self.watermark_id = heapq.heappop(self._settled)
+
+
+class CampaignRunner:
+    def __init__(self, campaigns_collection, subscribers_collection,
+                 settings: Optional[SmtpSettings] = None,
+                 connections: int = CAMPAIGN_SMTP_CONNECTIONS,
+                 rate_per_second: float = CAMPAIGN_RATE_PER_SECOND):
+        self.campaigns = campaigns_collection
+        self.subscribers = subscribers_collection
+        self._settings = settings
+        self.connections = connections
+        self.rate_per_second = rate_per_second
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def settings(self) -> SmtpSettings:
+        # Read from the environment when the first campaign is sent, not at import
+        if self._settings is None:
+            self._settings = SmtpSettings.from_env()
+        return self._settings
+
+    async def ensure_indexes(self):
+        await self.campaigns.create_index("id", unique=True)
+        await self.campaigns.create_index("status")
+
+    def start(self, campaign_id: str) -> bool:
+        """Run (or resume) a campaign in the background; False if it is already running here"""
+        task = self._tasks.get(campaign_id)
+        if task is not None and not task.done():
+            return False
+        task = asyncio.create_task(self.deliver(campaign_id))
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(campaign_id, None))
+        return True
+
+    async def resume_interrupted(self):
+        """Restart campaigns that were running when the process stopped"""
+        async for campaign in self.campaigns.find({"status": "running"}, {"id": 1}):
+            logger.info(f"Resuming campaign {campaign['id']}")
+            self.start(campaign["id"])
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _render(self, subject: Template, body: Template, email: str) -> EmailMessage:
+        values = {"email": email}
+        message = EmailMessage()
+        message["From"] = self.settings.sender
+        message["To"] = email
+        message["Subject"] = subject.safe_substitute(values)
+        message.set_content(body.safe_substitute(values))
+        return message
+
+    async def _checkpoint(self, campaign_id: str, progress: _Progress, started: float, **fields):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        update: Dict[str, Any] = {
+            "sent": progress.sent,
+            "failed": progress.failed,
+            "sends_per_second": round(progress.session_sent / elapsed, 2),
+            **fields,
+        }
+        if progress.watermark_id is not None:
+            update["checkpoint"] = str(progress.watermark_id)
+        update["lease_until"] = datetime.utcnow() + timedelta(seconds=CAMPAIGN_LEASE_SECONDS)
+        result = await self.campaigns.update_one({"id": campaign_id, "lease_owner": self.owner}, {"$set": update})
+        if result.matched_count == 0:
+            raise CampaignLeaseLost(f"Campaign {campaign_id} lease was taken over by another process")
+
+    async def _claim(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Take the campaign's delivery lease, waiting while another process holds it; None once completed"""
+        while True:
+            now = datetime.utcnow()
+            campaign = await self.campaigns.find_one_and_update(
+                {
+                    "id": campaign_id,
+                    "status": {"$ne": "completed"},
+                    "$or": [
+                        {"lease_until": None},
+                        {"lease_until": {"$lt": now}},
+                        {"lease_owner": self.owner},
+                    ],
+                },
+                {"$set": {
+                    "status": "running",
+                    "lease_owner": self.owner,
+                    "lease_until": now + timedelta(seconds=CAMPAIGN_LEASE_SECONDS),
+                }},
+                projection={"_id": 0}, return_document=ReturnDocument.AFTER
+            )
+            if campaign is not None:
+                return campaign
+            current = await self.campaigns.find_one({"id": campaign_id}, {"status": 1, "lease_until": 1})
+            if current is None:
+                raise ValueError(f"Campaign {campaign_id} not found")
+            if current["status"] == "completed":
+                return None
+            logger.info(f"Campaign {campaign_id} is being delivered by another process; waiting for its lease")
+            wait = (current["lease_until"] - now).total_seconds() if current.get("lease_until") else 0
+            await asyncio.sleep(min(max(wait, 1.0), CAMPAIGN_LEASE_SECONDS))
+
+    async def _release(self, campaign_id: str):
+        await self.campaigns.update_one(
+            {"id": campaign_id, "lease_owner": self.owner},
+            {"$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+
+    async def _worker(self, queue: asyncio.Queue, limiter: RateLimiter, progress: _Progress):
+        connection: Optional[smtplib.SMTP] = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                seq, subscriber_id, message = item
+                await limiter.acquire()
+                ok = False
+                for attempt in range(2):
+                    try:
+                        if connection is None:
+                            connection = await asyncio.to_thread(open_smtp_connection, self.settings)
+                        await asyncio.to_thread(connection.send_message, message)
+                        ok = True
+                        break
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                        logger.warning(f"Campaign delivery to {message['To']} rejected: {str(e)}")
+                        break
+                    except (smtplib.SMTPException, OSError) as e:
+                        # Broken connection: reconnect once before giving up on this recipient
+                        logger.warning(f"SMTP connection failed, reconnecting: {str(e)}")
+                        if connection is not None:
+                            await asyncio.to_thread(connection.close)
+                        connection = None
+                progress.settle(seq, subscriber_id, ok)
+        finally:
+            if connection is not None:
+                try:
+                    await asyncio.to_thread(connection.quit)
+                except (smtplib.SMTPException, OSError):
+                    pass
+
+    async def deliver(self, campaign_id: str) -> Dict[str, Any]:
+        """Send a campaign to every subscriber after its checkpoint"""
+        campaign = await self._claim(campaign_id)
+        if campaign is None:
+            return await self.campaigns.find_one({"id": campaign_id}, {"_id": 0})
+
+        subject = Template(campaign["subject"])
+        body = Template(campaign["body_template"])
+        progress = _Progress(campaign.get("sent", 0), campaign.get("failed", 0))
+        started = time.monotonic()
+        if not campaign.get("started_at"):
+            await self.campaigns.update_one({"id": campaign_id}, {"$set": {"started_at": datetime.utcnow()}})
+
+        query: Dict[str, Any] = {}
+        if campaign.get("checkpoint"):
+            query["_id"] = {"$gt": ObjectId(campaign["checkpoint"])}
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.connections * 4)
+        limiter = RateLimiter(self.rate_per_second)
+        workers = [
+            asyncio.create_task(self._worker(queue, limiter, progress))
+            for _ in range(self.connections)
+        ]
+        try:
+            cursor = self.subscribers.find(query, {"_id": 1, "email": 1}).sort("_id", 1).batch_size(CURSOR_BATCH_SIZE)
+            seq = 0
+            last_checkpoint = time.monotonic()
+            async for subscriber in cursor:
+                seq += 1
+                await queue.put((seq, subscriber["_id"], self._render(subject, body, subscriber["email"])))
+                if seq % CHECKPOINT_EVERY == 0 or time.monotonic() - last_checkpoint > CHECKPOINT_INTERVAL_SECONDS:
+                    await self._checkpoint(campaign_id, progress, started)
+                    last_checkpoint = time.monotonic()
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException as e:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if isinstance(e, CampaignLeaseLost):
+                # The new owner checkpoints from here on
+                logger.error(str(e))
+                raise
+            if isinstance(e, asyncio.CancelledError):
+                # Leave the campaign "running" so that it is resumed on the next start
+                await self._checkpoint(campaign_id, progress, started)
+            else:
+                logger.error(f"Campaign {campaign_id} failed: {str(e)}")
+                await self._checkpoint(campaign_id, progress, started, status="failed")
+            await self._release(campaign_id)
+            raise
+
+        await self._checkpoint(
+            campaign_id, progress, started, status="completed", finished_at=datetime.utcnow()
+        )
+        await self._release(campaign_id)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Campaign {campaign_id} completed: {progress.sent} sent, {progress.failed} failed, "
+            f"{progress.session_sent / max(elapsed, 1e-6):.1f} sends/sec"
+        )
+        return await self.campaigns.find_one({"id": campaign_id}, {"_id": 0})
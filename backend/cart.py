@@ -0,0 +1,126 @@
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Server-side carts.
+#
+# Each cart is one document keyed by its id, with items stored in a sub-document
+# keyed by "<product_id>:<size>" so that every change is a single atomic
+# $set/$inc/$unset upsert rather than a read-modify-write. Every write pushes
+# expires_at forward; a TTL index on it lets MongoDB delete abandoned carts.
+
+CART_TTL_SECONDS = int(os.environ.get('CART_TTL_SECONDS', 14 * 24 * 60 * 60))
+
+
+def item_key(product_id: int, size: Optional[str]) -> str:
+    return f"{product_id}:{size or ''}"
+
+
+def to_cart(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a cart document for the API"""
+    items = sorted(document.get("items", {}).values(), key=lambda item: (item["product_id"], item.get("size") or ""))
+    return {
+        "id": document["_id"],
+        "items": items,
+        "total": round(sum(item["price"] * item["quantity"] for item in items), 2),
+        "updated_at": document.get("updated_at"),
+        "expires_at": document.get("expires_at"),
+    }
+
+
+class CartService:
+    def __init__(self, collection, products_collection, ttl_seconds: int = CART_TTL_SECONDS):
+        self.collection = collection
+        self.products = products_collection
+        self.ttl_seconds = ttl_seconds
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _touch(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        return {"updated_at": now, "expires_at": now + timedelta(seconds=self.ttl_seconds)}
+
+    async def _update(self, cart_id: str, update: Dict[str, Any], upsert: bool = True) -> Optional[Dict[str, Any]]:
+        update.setdefault("$set", {}).update(self._touch())
+        return await self.collection.find_one_and_update(
+            {"_id": cart_id}, update, upsert=upsert, return_document=ReturnDocument.AFTER
+        )
+
+    async def get(self, cart_id: str) -> Optional[Dict[str, Any]]:
+        document = await self.collection.find_one({"_id": cart_id})
+        return to_cart(document) if document else None
+
+    async def add_item(self, cart_id: str, product_id: int, size: Optional[str], quantity: int) -> Optional[Dict[str, Any]]:
+        """Add to an item's quantity, pricing it from the catalog; None if the product does not exist"""
+        product = await self.products.find_one(
+            {"id": product_id}, {"_id": 0, "name": 1, "price": 1, "image": 1}
+        )
+        if not product:
+            return None
+        prefix = f"items.{item_key(product_id, size)}"
+        document = await self._update(cart_id, {
+            "$inc": {f"{prefix}.quantity": quantity},
+            "$set": {
+                f"{prefix}.product_id": product_id,
+                f"{prefix}.size": size,
+                f"{prefix}.name": product["name"],
+                f"{prefix}.price": product["price"],
+                f"{prefix}.image": product["image"],
+            },
+        })
+        return to_cart(document)
+
+    async def set_quantity(self, cart_id: str, product_id: int, size: Optional[str], quantity: int) -> Optional[Dict[str, Any]]:
+        """Set an item's quantity; zero removes it. None if the item is not in the cart"""
+        key = f"items.{item_key(product_id, size)}"
+        update = {"$unset": {key: ""}} if quantity <= 0 else {"$set": {f"{key}.quantity": quantity}}
+        document = await self.collection.find_one_and_update(
+            {"_id": cart_id, key: {"$exists": True}},
+            {**update, "$set": {**update.get("$set", {}), **self._touch()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return to_cart(document) if document else None
+
+    async def remove_item(self, cart_id: str, product_id: int, size: Optional[str]) -> Optional[Dict[str, Any]]:
+        document = await self._update(
+            cart_id, {"$unset": {f"items.{item_key(product_id, size)}": ""}}, upsert=False
+        )
+        return to_cart(document) if document else None
+
+    async def delete(self, cart_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": cart_id})
+        return result.deleted_count > 0
+
+    async def validate(self, cart_id: str) -> Optional[Dict[str, Any]]:
+        """Re-price the cart against the catalog before checkout and report what changed"""
+        document = await self.collection.find_one({"_id": cart_id})
+        if not document:
+            return None
+        items = document.get("items", {})
+        product_ids = list({item["product_id"] for item in items.values()})
+        products = {
+            product["id"]: product
+            async for product in self.products.find(
+                {"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "price": 1, "name": 1}
+            )
+        }
+
+        issues: List[str] = []
+        update: Dict[str, Any] = {}
+        for key, item in items.items():
+            product = products.get(item["product_id"])
+            if product is None:
+                issues.append(f"{item['name']} is no longer available")
+                update.setdefault("$unset", {})[f"items.{key}"] = ""
+            elif product["price"] != item["price"]:
+                issues.append(f"{item['name']} price changed from {item['price']} to {product['price']}")
+                update.setdefault("$set", {})[f"items.{key}.price"] = product["price"]
+
+        if update:
+            document = await self._update(cart_id, update, upsert=False) or document
+        return {"valid": not issues, "issues": issues, "cart": to_cart(document)}
@@ -0,0 +1,197 @@
+from pymongo import ReturnDocument, UpdateOne, InsertOne
+from pymongo.errors import BulkWriteError
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Catalog writes.
+#
+# Product ids come from a counter document incremented atomically, reserving a
+# whole range at once for bulk loads. Every change bumps a catalog version in
+# a meta document; caches of catalog data key on it, so they can never serve a
+# catalog older than the version they were built for. A bulk upsert is a
+# single unordered bulk_write that pymongo splits into wire-size batches, so a
+# large supplier feed costs a few round trips, not one per product.
+#
+# Snapshot stores are republished after changes by one task per store. A burst
+# of changes while a publish runs is folded into a single publish of the latest
+# version, so a bulk edit costs at most two full writes, not one per product.
+
+PRODUCT_ID_COUNTER = "product_id"
+CATALOG_META_ID = "catalog"
+SEED_META_ID = "seed"
+# {"version": n, "products": [...]}; bump the version to re-apply the seed
+SEED_PRODUCTS_PATH = Path(__file__).parent / 'seed_data' / 'products.json'
+
+
+class CatalogService:
+    def __init__(self, products_collection, counters_collection, meta_collection):
+        self.products = products_collection
+        self.counters = counters_collection
+        self.meta = meta_collection
+        self._listeners: List[Callable[[int], Any]] = []
+
+    async def ensure_indexes(self):
+        await self.products.create_index("id", unique=True)
+        await self.products.create_index(
+            "sku", unique=True, partialFilterExpression={"sku": {"$type": "string"}}
+        )
+        # Keep the id counter ahead of products that were inserted with explicit ids
+        highest = await self.products.find_one({}, {"id": 1, "_id": 0}, sort=[("id", -1)])
+        await self.counters.update_one(
+            {"_id": PRODUCT_ID_COUNTER}, {"$max": {"seq": highest["id"] if highest else 0}}, upsert=True
+        )
+
+    async def apply_seed(self, path: Path = SEED_PRODUCTS_PATH) -> bool:
+        """Upsert the seed products if their seed version has not been applied yet"""
+        with open(path, encoding='utf-8') as seed_file:
+            seed = json.load(seed_file)
+        applied = await self.meta.find_one({"_id": SEED_META_ID}, {"version": 1})
+        if applied and applied.get("version", 0) >= seed["version"]:
+            return False
+
+        # Idempotent, so workers booting at the same time may both apply it
+        await self.products.bulk_write([
+            UpdateOne({"id": product["id"]}, {"$set": product}, upsert=True)
+            for product in seed["products"]
+        ], ordered=False)
+        await self.meta.update_one({"_id": SEED_META_ID}, {"$max": {"version": seed["version"]}}, upsert=True)
+        await self._bump_version()
+        logger.info(f"Applied product seed version {seed['version']} ({len(seed['products'])} products)")
+        return True
+
+    def on_change(self, listener: Callable[[int], Any]):
+        """Register a callback run with the new catalog version after every change"""
+        self._listeners.append(listener)
+
+    async def get_version(self) -> int:
+        document = await self.meta.find_one({"_id": CATALOG_META_ID}, {"version": 1})
+        return document["version"] if document else 0
+
+    async def _bump_version(self) -> int:
+        document = await self.meta.find_one_and_update(
+            {"_id": CATALOG_META_ID}, {"$inc": {"version": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        version = document["version"]
+        for listener in self._listeners:
+            try:
+                listener(version)
+            except Exception as e:
+                logger.error(f"Catalog change listener failed: {str(e)}")
+        return version
+
+    def publish_on_change(self, store):
+        """Keep a snapshot store current: at most one publish in flight, always of the latest version"""
+        state: Dict[str, Any] = {"latest": 0, "task": None}
+
+        async def drain():
+            published = 0
+            while state["latest"] > published:
+                published = state["latest"]
+                # Another worker may have published this version or a newer one meanwhile
+                if published <= await asyncio.to_thread(store.published_version):
+                    continue
+                await self.publish_snapshot(store, published)
+
+        def changed(version: int):
+            state["latest"] = max(state["latest"], version)
+            if state["task"] is None or state["task"].done():
+                state["task"] = asyncio.get_running_loop().create_task(drain())
+
+        self.on_change(changed)
+
+    async def publish_snapshot(self, store, version: int):
+        """Publish the catalog to a snapshot store: shared memory, or static files"""
+        try:
+            products = await self.products.find({}, {"_id": 0}).to_list(None)
+            if await asyncio.to_thread(store.publish, products, version):
+                logger.info(f"Published catalog snapshot version {version} ({len(products)} products)")
+        except Exception as e:
+            logger.error(f"Failed to publish catalog snapshot: {str(e)}")
+
+    async def _reserve_ids(self, count: int) -> range:
+        """Atomically take `count` consecutive product ids"""
+        document = await self.counters.find_one_and_update(
+            {"_id": PRODUCT_ID_COUNTER}, {"$inc": {"seq": count}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return range(document["seq"] - count + 1, document["seq"] + 1)
+
+    async def create(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        product_id = (await self._reserve_ids(1))[0]
+        product = {"id": product_id, **fields}
+        await self.products.insert_one(dict(product))
+        await self._bump_version()
+        return product
+
+    async def update(self, product_id: int, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Apply a partial update; None if the product does not exist"""
+        if not fields:
+            return await self.products.find_one({"id": product_id}, {"_id": 0})
+        product = await self.products.find_one_and_update(
+            {"id": product_id}, {"$set": fields},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if product is not None:
+            await self._bump_version()
+        return product
+
+    async def delete(self, product_id: int) -> bool:
+        result = await self.products.delete_one({"id": product_id})
+        if result.deleted_count:
+            await self._bump_version()
+        return result.deleted_count > 0
+
+    async def bulk_upsert(self, products: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Insert or update many products in one bulk write"""
+        if not products:
+            return {"inserted": 0, "updated": 0, "version": await self.get_version()}
+
+        # Only products with an unknown sku or no key at all need new ids
+        skus = [p["sku"] for p in products if p.get("sku")]
+        known_skus = set()
+        if skus:
+            known_skus = {
+                p["sku"] async for p in self.products.find({"sku": {"$in": skus}}, {"sku": 1, "_id": 0})
+            }
+        needs_id = sum(
+            1 for p in products
+            if p.get("id") is None and (not p.get("sku") or p["sku"] not in known_skus)
+        )
+        new_ids = iter(await self._reserve_ids(needs_id)) if needs_id else iter(())
+        explicit_ids = [p["id"] for p in products if p.get("id") is not None]
+        if explicit_ids:
+            await self.counters.update_one(
+                {"_id": PRODUCT_ID_COUNTER}, {"$max": {"seq": max(explicit_ids)}}, upsert=True
+            )
+
+        operations = []
+        for product in products:
+            fields = {k: v for k, v in product.items() if k != "id" and not (k == "sku" and v is None)}
+            if product.get("sku") and (product["sku"] in known_skus or product.get("id") is None):
+                update = {"$set": fields}
+                if product["sku"] not in known_skus:
+                    update["$setOnInsert"] = {"id": next(new_ids)}
+                operations.append(UpdateOne({"sku": product["sku"]}, update, upsert=True))
+            elif product.get("id") is not None:
+                # Includes a new sku for an existing product, which is attached to it
+
+                operations.append(UpdateOne({"id": product["id"]}, {"$set": fields}, upsert=True))
+            else:
+                operations.append(InsertOne({"id": next(new_ids), **fields}))
+
+        try:
+            result = await self.products.bulk_write(operations, ordered=False)
+        except BulkWriteError:
+            # Unordered: the operations that did not fail were applied
+            await self._bump_version()
+            raise
+        inserted = result.upserted_count + result.inserted_count
+        version = await self._bump_version()
+        logger.info(f"Catalog bulk upsert: {inserted} inserted, {result.matched_count} updated, version {version}")
+        return {"inserted": inserted, "updated": result.matched_count, "version": version}
@@ -0,0 +1,216 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+
+# Catalog snapshot shared between worker processes.
+#
+# The catalog is serialized into one immutable file per catalog version, in the
+# binary layout below, and memory-mapped read-only by every worker. The pages
+# live once in the page cache whatever the number of workers. A tiny control
+# file holds the version that is currently published. Readers check it on every
+# access, which is an 8-byte read from a shared mapping, and remap when it
+# changes. A publish is visible to all workers as soon as the control file is
+# updated.
+#
+# Layout (little endian):
+#   header      magic "UTCS", layout version u16, reserved u16, catalog version u64,
+#               product count u32, category count u32, then the byte offsets of the
+#               id index, records, categories, category members and strings (u32 each)
+#   id index    product ids (i64), sorted, for binary search
+#   records     one RECORD per product in id order: price f64 and an
+#               (offset, length) pair into the string table per text field
+#   categories  (name offset, name length, first member, member count) per category
+#   members     record numbers (u32) grouped by category, in id order
+#   strings     utf-8 text
+
+MAGIC = b"UTCS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sHHQII5I")
+RECORD = struct.Struct("<d10I")
+CATEGORY = struct.Struct("<4I")
+CONTROL = struct.Struct("<Q")
+TEXT_FIELDS = ("category", "name", "image", "description", "sku")
+NO_VALUE = 0xFFFFFFFF
+
+CATALOG_SNAPSHOT_DIR = os.environ.get('CATALOG_SNAPSHOT_DIR')
+
+
+def _default_dir() -> str:
+    # Prefer tmpfs so that snapshots never touch the disk
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def encode_snapshot(products: List[Dict[str, Any]], catalog_version: int) -> bytes:
+    products = sorted(products, key=lambda p: p["id"])
+    strings = bytearray()
+    string_offsets: Dict[str, Tuple[int, int]] = {}
+
+    def intern(value: Optional[str]) -> Tuple[int, int]:
+        if value is None:
+            return NO_VALUE, 0
+        if value not in string_offsets:
+            encoded = str(value).encode("utf-8")
+            string_offsets[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    records = bytearray()
+    members_by_category: Dict[str, List[int]] = {}
+    for number, product in enumerate(products):
+        fields: List[int] = []
+        for field in TEXT_FIELDS:
+            fields.extend(intern(product.get(field)))
+        records.extend(RECORD.pack(float(product["price"]), *fields))
+        members_by_category.setdefault(product["category"], []).append(number)
+
+    categories = bytearray()
+    members: List[int] = []
+    for category in sorted(members_by_category):
+        offset, length = intern(category)
+        categories.extend(CATEGORY.pack(offset, length, len(members), len(members_by_category[category])))
+        members.extend(members_by_category[category])
+
+    ids = struct.pack(f"<{len(products)}q", *(p["id"] for p in products))
+    member_bytes = struct.pack(f"<{len(members)}I", *members)
+    ids_offset = HEADER.size
+    records_offset = ids_offset + len(ids)
+    categories_offset = records_offset + len(records)
+    members_offset = categories_offset + len(categories)
+    strings_offset = members_offset + len(member_bytes)
+    header = HEADER.pack(
+        MAGIC, LAYOUT_VERSION, 0, catalog_version, len(products), len(members_by_category),
+        ids_offset, records_offset, categories_offset, members_offset, strings_offset
+    )
+    return b"".join([header, ids, bytes(records), bytes(categories), member_bytes, bytes(strings)])
+
+
+class CatalogView:
+    """Read-only access to one mapped snapshot; strings are decoded on access"""
+
+    def __init__(self, buffer: mmap.mmap):
+        self._buffer = buffer
+        (magic, layout, _, self.version, self.count, self.category_count, self._ids, self._records,
+         self._categories, self._members, self._strings) = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            raise ValueError("Not a catalog snapshot")
+        self._ids_view = memoryview(buffer)[self._ids:self._records].cast("q")
+
+    def _text(self, offset: int, length: int) -> Optional[str]:
+        if offset == NO_VALUE:
+            return None
+        start = self._strings + offset
+        return self._buffer[start:start + length].decode("utf-8")
+
+    def _product(self, number: int) -> Dict[str, Any]:
+        price, *fields = RECORD.unpack_from(self._buffer, self._records + number * RECORD.size)
+        product: Dict[str, Any] = {"id": self._ids_view[number], "price": price}
+        for index, field in enumerate(TEXT_FIELDS):
+            product[field] = self._text(fields[2 * index], fields[2 * index + 1])
+        return product
+
+    def get(self, product_id: int) -> Optional[Dict[str, Any]]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._ids_view[middle] < product_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._ids_view[low] == product_id:
+            return self._product(low)
+        return None
+
+    def products(self) -> Iterator[Dict[str, Any]]:
+        for number in range(self.count):
+            yield self._product(number)
+
+    def category(self, name: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        for index in range(self.category_count):
+            offset, length, first, size = CATEGORY.unpack_from(self._buffer, self._categories + index * CATEGORY.size)
+            if self._text(offset, length) == name:
+                if limit is not None:
+                    size = min(size, limit)
+                members = struct.unpack_from(f"<{size}I", self._buffer, self._members + first * 4)
+                return [self._product(number) for number in members]
+        return []
+
+    def close(self):
+        self._ids_view.release()
+        self._buffer.close()
+
+
+class CatalogSnapshotStore:
+    """Publishes snapshots and hands out a view of the current one"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or _default_dir()
+        self._control_path = os.path.join(self.directory, "catalog.control")
+        self._control: Optional[mmap.mmap] = None
+        self._view: Optional[CatalogView] = None
+
+    def _path(self, version: int) -> str:
+        return os.path.join(self.directory, f"catalog-{version}.snapshot")
+
+    def _open_control(self) -> mmap.mmap:
+        if self._control is None:
+            fd = os.open(self._control_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < CONTROL.size:
+                    os.ftruncate(fd, CONTROL.size)
+                self._control = mmap.mmap(fd, CONTROL.size)
+            finally:
+                os.close(fd)
+        return self._control
+
+    def published_version(self) -> int:
+        return CONTROL.unpack_from(self._open_control(), 0)[0]
+
+    def publish(self, products: List[Dict[str, Any]], catalog_version: int) -> bool:
+        """Write a snapshot and make it current unless a newer one is already published"""
+        os.makedirs(self.directory, exist_ok=True)
+        data = encode_snapshot(products, catalog_version)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".catalog-")
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, self._path(catalog_version))
+
+        control = self._open_control()
+        with open(self._control_path, "rb") as lock:
+            # Serializes publishers in different workers
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = CONTROL.unpack_from(control, 0)[0]
+            if catalog_version < previous:
+                os.unlink(self._path(catalog_version))
+                return False
+            CONTROL.pack_into(control, 0, catalog_version)
+        # Workers still mapping older snapshots keep them until they remap
+        for name in os.listdir(self.directory):
+            if name.startswith("catalog-") and name.endswith(".snapshot"):
+                version = int(name[len("catalog-"):-len(".snapshot")])
+                if version < previous:
+                    os.unlink(os.path.join(self.directory, name))
+        return True
+
+    def view(self) -> Optional[CatalogView]:
+        """The current snapshot, remapped if a newer one was published; None before the first"""
+        version = self.published_version()
+        if self._view is not None and self._view.version == version:
+            return self._view
+        try:
+            with open(self._path(version), "rb") as snapshot:
+                view = CatalogView(mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, ValueError):
+            # Nothing published yet, or superseded and removed while we looked
+            return self._view
+        if self._view is not None:
+            self._view.close()
+        self._view = view
+        return view
+
+
+def store_from_env() -> Optional[CatalogSnapshotStore]:
+    """The shared snapshot store when running under serve.py, else None"""
+    return CatalogSnapshotStore(CATALOG_SNAPSHOT_DIR) if CATALOG_SNAPSHOT_DIR else None
@@ -0,0 +1,255 @@
+from fastapi import HTTPException, Request
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Streaming storage for custom design artwork.
+#
+# multipart/form-data bodies are parsed incrementally straight from the request
+# stream: file parts are hashed and written to a temporary file chunk by chunk, so
+# neither the request nor the file is ever held in memory, and the upload is
+# aborted as soon as it crosses the size limit. Finished files are stored under
+# their SHA-256, which deduplicates identical artwork for free. A file part with
+# an empty filename is what a browser sends for a file input left empty, and is
+# skipped.
+
+ROOT_DIR = Path(__file__).parent
+DESIGN_UPLOAD_DIR = Path(os.environ.get('DESIGN_UPLOAD_DIR', ROOT_DIR / 'uploads' / 'designs'))
+DESIGN_MAX_BYTES = int(os.environ.get('DESIGN_MAX_BYTES', 10 * 1024 * 1024))
+MAX_FIELD_BYTES = 64 * 1024
+ALLOWED_CONTENT_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/svg+xml"}
+
+
+class StoredFile:
+    def __init__(self, sha256: str, size: int, content_type: str, filename: Optional[str], deduplicated: bool):
+        self.sha256 = sha256
+        self.size = size
+        self.content_type = content_type
+        self.filename = filename
+        self.deduplicated = deduplicated
+
+
+class ContentAddressedStore:
+    def __init__(self, root: Path = DESIGN_UPLOAD_DIR):
+        self.root = Path(root)
+        self.tmp_dir = self.root / 'tmp'
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    def open_temp(self):
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        return path, open(path, 'wb')
+
+    def commit(self, temp_path: Path, sha256: str) -> bool:
+        """Move a finished upload into place; True if identical content was already stored"""
+        target = self.path_for(sha256)
+        if target.exists():
+            temp_path.unlink(missing_ok=True)
+            return True
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, target)
+        return False
+
+    def discard(self, stored: StoredFile):
+        """Remove an upload whose order was never saved, unless it was already stored before"""
+        if not stored.deduplicated:
+            self.path_for(stored.sha256).unlink(missing_ok=True)
+
+
+class _UploadSink:
+    """python-multipart callbacks that collect form fields and stream file parts to disk"""
+
+    def __init__(self, store: ContentAddressedStore, max_file_bytes: int):
+        self.store = store
+        self.max_file_bytes = max_file_bytes
+        self.fields: Dict[str, str] = {}
+        self.files: List[StoredFile] = []
+        self.error: Optional[HTTPException] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._name: Optional[str] = None
+        self._filename: Optional[str] = None
+        self._content_type = ""
+        self._field_value = bytearray()
+        self._size = 0
+        self._hash = None
+        self._temp_path: Optional[Path] = None
+        self._temp_file = None
+        self._file_seen = False
+        self._skipping = False
+        # File chunks and a final (filename, content_type, size, sha256) marker awaiting drain()
+        self._pending: List[object] = []
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _fail(self, status_code: int, detail: str):
+        if self.error is None:
+            self.error = HTTPException(status_code=status_code, detail=detail)
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._filename = None
+        self._skipping = False
+        self._field_value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name")
+        filename = options.get(b"filename")
+        self._name = name.decode('utf-8', 'replace') if name else None
+        self._filename = filename.decode('utf-8', 'replace') if filename is not None else None
+        if self._filename is None:
+            return
+        if not self._filename:
+            # An empty file input
+            self._skipping = True
+            return
+        if self._file_seen:
+            self._fail(400, "Only one design file may be uploaded")
+            return
+        self._file_seen = True
+        self._content_type = self._headers.get(b"content-type", b"application/octet-stream").decode('latin-1')
+        if self._content_type not in ALLOWED_CONTENT_TYPES:
+            self._fail(415, f"Unsupported design file type: {self._content_type}")
+            return
+        self._size = 0
+        self._hash = hashlib.sha256()
+        self._temp_path, self._temp_file = self.store.open_temp()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self.error is not None or self._skipping:
+            return
+        chunk = data[start:end]
+        if self._filename is not None and self._temp_file is None:
+            return
+        if self._filename is None:
+            self._field_value += chunk
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                self._fail(413, f"Form field {self._name} is too large")
+            return
+        self._size += len(chunk)
+        if self._size > self.max_file_bytes:
+            self._fail(413, f"Design file exceeds the limit of {self.max_file_bytes} bytes")
+            return
+        self._hash.update(chunk)
+        # Disk writes happen off the event loop in drain()
+        self._pending.append(chunk)
+
+    def _on_part_end(self):
+        if self.error is not None or self._skipping:
+            return
+        if self._filename is None:
+            if self._name:
+                self.fields[self._name] = self._field_value.decode('utf-8', 'replace')
+            return
+        if self._temp_file is not None:
+            # Capture the metadata now; later parts in the same chunk reset these attributes
+            self._pending.append((self._filename, self._content_type, self._size, self._hash.hexdigest()))
+
+    def _write_pending(self, pending: List[object]) -> Optional[tuple]:
+        finished = None
+        for item in pending:
+            if isinstance(item, tuple):
+                self._temp_file.close()
+                finished = item
+            else:
+                self._temp_file.write(item)
+        return finished
+
+    async def drain(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        finished = await asyncio.to_thread(self._write_pending, pending)
+        if finished is None:
+            return
+        filename, content_type, size, sha256 = finished
+        temp_path = self._temp_path
+        self._temp_file = None
+        self._temp_path = None
+        deduplicated = await asyncio.to_thread(self.store.commit, temp_path, sha256)
+        self.files.append(StoredFile(sha256, size, content_type, filename, deduplicated))
+
+    async def discard_files(self):
+        """Remove the files already stored for a request that failed after them"""
+        for stored in self.files:
+            await asyncio.to_thread(self.store.discard, stored)
+        self.files = []
+
+    def cleanup(self):
+        if self._temp_file is not None:
+            self._temp_file.close()
+            self._temp_path.unlink(missing_ok=True)
+
+
+async def receive_multipart(request: Request, store: ContentAddressedStore,
+                            max_file_bytes: int = DESIGN_MAX_BYTES) -> Tuple[Dict[str, str], Optional[StoredFile]]:
+    """Stream a multipart/form-data request into form fields and at most one stored file"""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    sink = _UploadSink(store, max_file_bytes)
+    parser = MultipartParser(boundary, sink.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if sink.error is not None:
+                raise sink.error
+            await sink.drain()
+        parser.finalize()
+        if sink.error is not None:
+            raise sink.error
+        await sink.drain()
+    except HTTPException:
+        await sink.discard_files()
+        raise
+    except Exception as e:
+        await sink.discard_files()
+        raise HTTPException(status_code=400, detail=f"Malformed multipart upload: {str(e)}")
+    finally:
+        sink.cleanup()
+
+    stored = sink.files[0] if sink.files else None
+    if stored is not None:
+        logger.info(
+            f"Stored design {stored.sha256} ({stored.size} bytes"
+            f"{', deduplicated' if stored.deduplicated else ''})"
+        )
+    return sink.fields, stored
@@ -1,12 +1,49 @@
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import logging
 import os
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 # For now, we'll mock email sending since we don't have SMTP credentials
 # In production, you would use services like SendGrid, AWS SES, etc.
 
+class SmtpSettings:
+    """SMTP connection settings; defaults point at a local sink such as `python -m aiosmtpd -n`"""
+
+    def __init__(self, host: str = "localhost", port: int = 8025, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = False,
+                 sender: str = "Urban Threads <newsletter@urbanthreads.local>", timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls) -> "SmtpSettings":
+        return cls(
+            host=os.environ.get('SMTP_HOST', 'localhost'),
+            port=int(os.environ.get('SMTP_PORT', 8025)),
+            username=os.environ.get('SMTP_USERNAME'),
+            password=os.environ.get('SMTP_PASSWORD'),
+            starttls=os.environ.get('SMTP_STARTTLS', '').lower() in ('1', 'true', 'yes'),
+            sender=os.environ.get('SMTP_FROM', 'Urban Threads <newsletter@urbanthreads.local>'),
+        )
+
+def open_smtp_connection(settings: SmtpSettings) -> smtplib.SMTP:
+    """Open an authenticated SMTP connection (blocking; call from a worker thread)"""
+    connection = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+    if settings.starttls:
+        connection.starttls()
+    if settings.username:
+        connection.login(settings.username, settings.password or "")
+    return connection
+
 async def send_custom_order_notification(custom_order: dict) -> bool:
     """
     Send email notification for custom order
@@ -28,15 +65,17 @@ async def send_custom_order_notification(custom_order: dict) -> bool:
         """
         
         # Log the email content (in production, send actual email)
-        print("📧 EMAIL NOTIFICATION:")
-        print(email_content)
-        print("=" * 50)
+        logger.info("Custom order notification email", extra={
+            "email_type": "custom_order_notification",
+            "order_id": custom_order.get('id'),
+            "body": email_content,
+        })
         
         # Mock successful sending
         return True
         
     except Exception as e:
-        print(f"❌ Failed to send email notification: {str(e)}")
+        logger.error(f"Failed to send email notification: {str(e)}")
         return False
 
 async def send_order_confirmation(order: dict) -> bool:
@@ -56,12 +95,14 @@ async def send_order_confirmation(order: dict) -> bool:
         Thank you for your order!
         """
         
-        print("📧 ORDER CONFIRMATION EMAIL:")
-        print(email_content)
-        print("=" * 50)
+        logger.info("Order confirmation email", extra={
+            "email_type": "order_confirmation",
+            "order_id": order.get('id'),
+            "body": email_content,
+        })
         
         return True
         
     except Exception as e:
-        print(f"❌ Failed to send order confirmation: {str(e)}")
+        logger.error(f"Failed to send order confirmation: {str(e)}")
         return False
\ No newline at end of file
@@ -0,0 +1,52 @@
+from fastapi import HTTPException
+from fastapi.responses import Response
+from functools import lru_cache
+from pydantic import BaseModel, TypeAdapter, create_model
+from typing import Any, Dict, FrozenSet, List, Optional, Type
+
+# Sparse fieldsets: ?fields=id,name,price returns only those fields.
+#
+# The requested fields become a MongoDB projection, so that unused fields are
+# never read or sent over the wire. Responses are validated and serialized with
+# a model holding just those fields. It is built with create_model and cached
+# per field set, and the JSON is written directly. "id" is always included so
+# that clients can still key the results.
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[FrozenSet[str]]:
+    """The requested subset of `model`'s fields, or None for all of them; 400 on unknown names"""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    if "id" in model.model_fields:
+        requested.add("id")
+    return frozenset(requested)
+
+
+def projection(fields: Optional[FrozenSet[str]]) -> Dict[str, int]:
+    if fields is None:
+        return {"_id": 0}
+    return {"_id": 0, **{name: 1 for name in fields}}
+
+
+def select(document: Dict[str, Any], fields: FrozenSet[str]) -> Dict[str, Any]:
+    """Apply a field set to data that did not come through a projection, e.g. a cache"""
+    return {name: document[name] for name in fields if name in document}
+
+
+@lru_cache(maxsize=256)
+def _adapter(model: Type[BaseModel], fields: FrozenSet[str], many: bool) -> TypeAdapter:
+    partial = create_model(
+        f"{model.__name__}Fields",
+        **{name: (info.annotation, info) for name, info in model.model_fields.items() if name in fields}
+    )
+    return TypeAdapter(List[partial] if many else partial)
+
+
+def sparse_response(model: Type[BaseModel], fields: FrozenSet[str], data: Any) -> Response:
+    """Validate and serialize a document, or a list of them, against the field subset of `model`"""
+    adapter = _adapter(model, fields, isinstance(data, list))
+    return Response(content=adapter.dump_json(adapter.validate_python(data)), media_type="application/json")
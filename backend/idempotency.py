@@ -0,0 +1,204 @@
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Idempotency-Key support for write endpoints.
+#
+# Keys are claimed in Mongo with a single upsert so that only one worker runs the
+# handler; the stored response is replayed for every retry until the TTL index
+# removes it. Completed responses are also kept in a small in-process LRU so that
+# retry storms against the same worker cost no database round trip at all.
+#
+# A claim is a lease: if the claiming process dies before finishing, a retry
+# takes the key over once the claim is IDEMPOTENCY_LEASE_SECONDS old. The
+# completion and the release of a claim only apply to the claim they came from.
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 30))
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 60))
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request body, used to reject key reuse with a different payload"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+                 cache_size: int = IDEMPOTENCY_CACHE_SIZE, wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+                 lease_seconds: float = IDEMPOTENCY_LEASE_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.wait_seconds = wait_seconds
+        self.lease_seconds = lease_seconds
+        # scope:key -> (expires_at, fingerprint, response)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # scope:key -> future resolved with the response of the in-flight execution
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def ensure_indexes(self):
+        """Create the TTL index that expires stored responses"""
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    def _cache_get(self, cache_key: str) -> Optional[tuple]:
+        entry = self._cache.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[cache_key]
+            return None
+        self._cache.move_to_end(cache_key)
+        return entry
+
+    def _cache_put(self, cache_key: str, fingerprint: str, response: Any):
+        self._cache[cache_key] = (time.monotonic() + self.ttl_seconds, fingerprint, response)
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _check_fingerprint(stored: str, fingerprint: str):
+        if stored != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request payload"
+            )
+
+    def _is_stale(self, record: Dict[str, Any]) -> bool:
+        claimed_at = record.get("claimed_at") or record["created_at"]
+        return claimed_at < datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+
+    async def _take_over(self, cache_key: str, record: Dict[str, Any], claim: str) -> bool:
+        """Claim a key whose lease has lapsed; only one retry can win it"""
+        if record.get("state") != "in_progress" or not self._is_stale(record):
+            return False
+        result = await self.collection.update_one(
+            {"_id": cache_key, "state": "in_progress", "claim": record.get("claim")},
+            {"$set": {"claim": claim, "claimed_at": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            logger.warning(f"Took over abandoned idempotency claim for {cache_key}")
+        return bool(result.modified_count)
+
+    async def _wait_for_remote(self, cache_key: str, fingerprint: str) -> Any:
+        """Poll for a key claimed by another worker until it completes, is released or its lease lapses"""
+        deadline = time.monotonic() + self.wait_seconds
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            record = await self.collection.find_one({"_id": cache_key})
+            if record is None or (record.get("state") == "in_progress" and self._is_stale(record)):
+                return None
+            if record.get("state") == "completed":
+                self._check_fingerprint(record["fingerprint"], fingerprint)
+                self._cache_put(cache_key, fingerprint, record["response"])
+                return record["response"]
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still being processed"
+        )
+
+    async def run(self, scope: str, key: Optional[str], payload: Any,
+                  handler: Callable[[], Awaitable[Any]]) -> Any:
+        """Execute handler at most once per (scope, key) and replay its response afterwards"""
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+        cache_key = f"{scope}:{key}"
+        fingerprint = request_fingerprint(payload)
+
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            self._check_fingerprint(cached[1], fingerprint)
+            return cached[2]
+
+        # Concurrent duplicates in this worker wait on the first execution
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            stored_fingerprint, response = await asyncio.shield(inflight)
+            self._check_fingerprint(stored_fingerprint, fingerprint)
+            return response
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            response = await self._claim_and_run(cache_key, fingerprint, handler)
+            future.set_result((fingerprint, response))
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be awaiting the future; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def _claim_and_run(self, cache_key: str, fingerprint: str,
+                             handler: Callable[[], Awaitable[Any]]) -> Any:
+        claim = uuid.uuid4().hex
+        while True:
+            # One round trip both claims a fresh key and returns an existing record
+            now = datetime.utcnow()
+            existing = await self.collection.find_one_and_update(
+                {"_id": cache_key},
+                {"$setOnInsert": {
+                    "fingerprint": fingerprint,
+                    "state": "in_progress",
+                    "claim": claim,
+                    "claimed_at": now,
+                    "created_at": now,
+                }},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            if existing is None:
+                break
+            self._check_fingerprint(existing["fingerprint"], fingerprint)
+            if existing.get("state") == "completed":
+                self._cache_put(cache_key, fingerprint, existing["response"])
+                return existing["response"]
+            if await self._take_over(cache_key, existing, claim):
+                break
+            response = await self._wait_for_remote(cache_key, fingerprint)
+            if response is not None:
+                return response
+            # The other worker failed and released the key, or died holding it;
+            # try to claim it ourselves
+
+        try:
+            result = await handler()
+        except BaseException:
+            # Failed executions are not recorded so that the client can retry
+            await self.collection.delete_one({"_id": cache_key, "state": "in_progress", "claim": claim})
+            raise
+
+        response = jsonable_encoder(result)
+        await self.collection.update_one(
+            {"_id": cache_key, "claim": claim},
+            {"$set": {"state": "completed", "response": response}}
+        )
+        self._cache_put(cache_key, fingerprint, response)
+        logger.info(f"Stored idempotent response for {cache_key}")
+        return response
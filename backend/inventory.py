@@ -0,0 +1,179 @@
+from pymongo import ReturnDocument, UpdateOne, DeleteMany
+from database import inventory_collection
+from typing import Any, Dict, List, Optional
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+# Per-product, per-size stock with atomic reservation.
+#
+# Stock for a SKU (product_id + size) lives in one or more counter documents
+# ("shards") holding part of the available quantity. A reservation is a single
+# find_one_and_update with a conditional $inc that only matches a shard holding
+# enough stock, so stock can never go negative. Hot SKUs can be spread over
+# several shards; each reservation starts at a random shard so concurrent
+# checkouts update different documents instead of queueing on one. Every shard
+# document carries the SKU's shard count, and each reservation refreshes the
+# worker's count from the shard it took, so a change made through another worker
+# is picked up after one reservation.
+#
+# Products without any inventory documents are not stock-tracked and always
+# reserve successfully. A tracked product must be ordered in one of its sizes.
+
+MAX_SHARDS = 64
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id: int, size: Optional[str], requested: int):
+        self.product_id = product_id
+        self.size = size
+        self.requested = requested
+        label = f"product {product_id}" + (f" size {size}" if size else "")
+        super().__init__(f"Not enough stock for {label}")
+
+
+class SizeRequiredError(Exception):
+    def __init__(self, product_id: int):
+        self.product_id = product_id
+        super().__init__(f"A size is required for product {product_id}")
+
+
+def _sku(product_id: int, size: Optional[str]) -> Dict[str, Any]:
+    return {"product_id": product_id, "size": size or None}
+
+
+class InventoryService:
+    def __init__(self, collection):
+        self.collection = collection
+        # (product_id, size) -> shard count; a hint for picking the starting shard
+        self._shard_counts: Dict[tuple, int] = {}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("product_id", 1), ("size", 1), ("shard", 1)], unique=True
+        )
+
+    async def load_shard_counts(self):
+        """Prime the shard-count hints from the inventory collection"""
+        pipeline = [{"$group": {"_id": {"product_id": "$product_id", "size": "$size"}, "shards": {"$sum": 1}}}]
+        async for row in self.collection.aggregate(pipeline):
+            self._shard_counts[(row["_id"]["product_id"], row["_id"].get("size"))] = row["shards"]
+
+    async def set_stock(self, product_id: int, size: Optional[str], quantity: int, shards: int = 1) -> Dict[str, Any]:
+        """Set the available quantity of a SKU, spread evenly over `shards` counters"""
+        shards = max(1, min(shards, MAX_SHARDS, max(quantity, 1)))
+        sku = _sku(product_id, size)
+        base, extra = divmod(quantity, shards)
+        operations = [
+            UpdateOne(
+                {**sku, "shard": shard},
+                {"$set": {"available": base + (1 if shard < extra else 0), "shards": shards}},
+                upsert=True
+            )
+            for shard in range(shards)
+        ]
+        operations.append(DeleteMany({**sku, "shard": {"$gte": shards}}))
+        await self.collection.bulk_write(operations, ordered=True)
+        self._shard_counts[(product_id, sku["size"])] = shards
+        return {"product_id": product_id, "size": sku["size"], "available": quantity, "shards": shards}
+
+    async def get_stock(self, product_id: int) -> List[Dict[str, Any]]:
+        """Available quantity per size of a product"""
+        pipeline = [
+            {"$match": {"product_id": product_id}},
+            {"$group": {"_id": "$size", "available": {"$sum": "$available"}, "shards": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ]
+        return [
+            {"product_id": product_id, "size": row["_id"], "available": row["available"], "shards": row["shards"]}
+            async for row in self.collection.aggregate(pipeline)
+        ]
+
+    async def _take(self, sku: Dict[str, Any], quantity: int, shard_filter: Dict[str, Any]) -> Optional[int]:
+        document = await self.collection.find_one_and_update(
+            {**sku, "shard": shard_filter, "available": {"$gte": quantity}},
+            {"$inc": {"available": -quantity}},
+            projection={"shard": 1, "shards": 1, "_id": 0},
+            sort=[("shard", 1)],
+            return_document=ReturnDocument.BEFORE,
+        )
+        if document is None:
+            return None
+        if "shards" in document:
+            self._shard_counts[(sku["product_id"], sku["size"])] = document["shards"]
+        return document["shard"]
+
+    async def _reserve_split(self, sku: Dict[str, Any], quantity: int) -> Optional[List[Dict[str, Any]]]:
+        """Take a quantity no single shard holds by draining several shards"""
+        taken: List[Dict[str, Any]] = []
+        remaining = quantity
+        shards = await self.collection.find(
+            {**sku, "available": {"$gt": 0}}, {"shard": 1, "available": 1, "_id": 0}
+        ).sort("available", -1).to_list(MAX_SHARDS)
+        for shard in shards:
+            if remaining <= 0:
+                break
+            amount = min(shard["available"], remaining)
+            if await self._take(sku, amount, shard["shard"]) is not None:
+                taken.append({**sku, "shard": shard["shard"], "quantity": amount})
+                remaining -= amount
+        if remaining > 0:
+            await self.release(taken)
+            return None
+        return taken
+
+    async def reserve_item(self, product_id: int, size: Optional[str], quantity: int) -> List[Dict[str, Any]]:
+        """Atomically reserve stock for one order line; returns the reservations to release later"""
+        sku = _sku(product_id, size)
+        shard_count = self._shard_counts.get((product_id, sku["size"]), 1)
+        start = random.randrange(shard_count) if shard_count > 1 else 0
+
+        shard = await self._take(sku, quantity, {"$gte": start})
+        if shard is None and start > 0:
+            shard = await self._take(sku, quantity, {"$lt": start})
+        if shard is not None:
+            return [{**sku, "shard": shard, "quantity": quantity}]
+
+        # Slow path: stock split across shards, or a SKU that is not tracked
+        if not await self.collection.count_documents(sku, limit=1):
+            if not await self.collection.count_documents({"product_id": product_id}, limit=1):
+                # The product is not stock-tracked at all
+                return []
+            if sku["size"] is None:
+                raise SizeRequiredError(product_id)
+            # A size the product is not stocked in
+            raise OutOfStockError(product_id, size, quantity)
+        reservations = await self._reserve_split(sku, quantity)
+        if reservations is None:
+            raise OutOfStockError(product_id, size, quantity)
+        return reservations
+
+    async def reserve(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Reserve every order line or none of them"""
+        reservations: List[Dict[str, Any]] = []
+        try:
+            for item in items:
+                reservations.extend(
+                    await self.reserve_item(item["product_id"], item.get("size"), item["quantity"])
+                )
+        except BaseException:
+            await self.release(reservations)
+            raise
+        return reservations
+
+    async def release(self, reservations: List[Dict[str, Any]]):
+        """Return reserved stock to the shards it was taken from"""
+        if not reservations:
+            return
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"product_id": r["product_id"], "size": r["size"], "shard": r["shard"]},
+                {"$inc": {"available": r["quantity"]}}
+            )
+            for r in reservations
+        ], ordered=False)
+        logger.info(f"Released {len(reservations)} stock reservations")
+
+# Global inventory service instance
+inventory_service = InventoryService(inventory_collection)
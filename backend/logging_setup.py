@@ -0,0 +1,177 @@
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+# Logging that never blocks the event loop.
+#
+# Loggers only put records on a bounded in-memory queue. A QueueListener thread
+# formats them as JSON lines and writes them to stdout. When the queue is full
+# the record is dropped and counted rather than waiting for the writer, so a
+# slow stdout costs log lines instead of request latency. High-volume loggers
+# can be sampled, e.g. LOG_SAMPLING="httpx=0.1,outbox=0.5" keeps 10% and 50% of
+# their records below WARNING.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json or text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLING = os.environ.get('LOG_SAMPLING', '')
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING from the configured loggers"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+
+    def _rate(self, name: str) -> Optional[float]:
+        # The most specific configured logger wins, e.g. "uvicorn.access" over "uvicorn"
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve what cannot cross threads; JSON formatting happens on the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Parse "name=rate,name=rate" into a mapping, ignoring malformed entries"""
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_sampling_filter: Optional[SamplingFilter] = None
+
+
+def _stdout_handler(log_format: str) -> logging.Handler:
+    output = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return output
+
+
+def configure_worker_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Plain stdout logging for pool worker processes, which have no event loop to keep unblocked"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_stdout_handler(log_format))
+    root.setLevel(level)
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT,
+                      queue_size: int = LOG_QUEUE_SIZE, sampling: str = LOG_SAMPLING):
+    """Route all logging through the bounded queue; safe to call more than once"""
+    global _listener, _queue_handler, _sampling_filter
+    if _listener is not None:
+        return
+
+    output = _stdout_handler(log_format)
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _sampling_filter = SamplingFilter(parse_sampling(sampling))
+    _queue_handler.addFilter(_sampling_filter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    # Let uvicorn's loggers go through the queue as well
+    for name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+
+    _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def logging_stats() -> Dict[str, int]:
+    return {
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampled_out": _sampling_filter.sampled_out if _sampling_filter else 0,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+    }
+
+
+def shutdown_logging():
+    """Flush the queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        stats = logging_stats()
+        if stats["dropped"]:
+            sys.stderr.write(f"Logging dropped {stats['dropped']} records\n")
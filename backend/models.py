@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, field_validator
 from typing import List, Optional
 from datetime import datetime
 import uuid
@@ -11,6 +11,7 @@ class Product(BaseModel):
     price: float
     image: str
     description: str
+    sku: Optional[str] = None
 
 class ProductCreate(BaseModel):
     category: str
@@ -18,14 +19,58 @@ class ProductCreate(BaseModel):
     price: float
     image: str
     description: str
+    sku: Optional[str] = None
+
+class ProductUpdate(BaseModel):
+    category: Optional[str] = None
+    name: Optional[str] = None
+    price: Optional[float] = None
+    image: Optional[str] = None
+    description: Optional[str] = None
+    sku: Optional[str] = None  # null clears the sku
+
+    @field_validator("category", "name", "price", "image", "description")
+    @classmethod
+    def not_null(cls, value):
+        # Omit a field to leave it unchanged; these are required on a product
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
+class ProductUpsert(ProductCreate):
+    # Existing products are matched by sku, else by id; anything else is new
+    id: Optional[int] = None
+
+class CatalogBulkResult(BaseModel):
+    inserted: int
+    updated: int
+    version: int
+
+class CatalogVersion(BaseModel):
+    version: int
+
+class StorefrontCategory(BaseModel):
+    name: str
+    count: int
+    min_price: float
+    max_price: float
+    products: List[Product]
+
+class Storefront(BaseModel):
+    catalog_version: int
+    product_count: int
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    categories: List[StorefrontCategory]
 
 # Order Models
 class OrderItem(BaseModel):
     product_id: int
     name: str
     price: float
-    quantity: int
+    quantity: int = Field(gt=0)
     image: str
+    size: Optional[str] = None
 
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -40,6 +85,47 @@ class OrderCreate(BaseModel):
     total: float
     customer_email: EmailStr
 
+# Cart Models
+class CartItemAdd(BaseModel):
+    product_id: int
+    size: Optional[str] = Field(default=None, max_length=16, pattern=r"^[A-Za-z0-9 _-]+$")
+    quantity: int = Field(default=1, gt=0)
+
+class CartItemUpdate(BaseModel):
+    quantity: int = Field(ge=0)
+
+class CartItem(BaseModel):
+    product_id: int
+    size: Optional[str] = None
+    name: str
+    price: float
+    image: str
+    quantity: int
+
+class Cart(BaseModel):
+    id: str
+    items: List[CartItem] = []
+    total: float = 0
+    updated_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+class CartValidation(BaseModel):
+    valid: bool
+    issues: List[str]
+    cart: Cart
+
+# Inventory Models
+class InventoryUpdate(BaseModel):
+    size: Optional[str] = None
+    quantity: int = Field(ge=0)
+    shards: int = Field(default=1, ge=1, le=64)  # >1 spreads a hot SKU over several counters
+
+class InventoryLevel(BaseModel):
+    product_id: int
+    size: Optional[str] = None
+    available: int
+    shards: int
+
 # Custom Order Models
 class CustomOrder(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -47,6 +133,9 @@ class CustomOrder(BaseModel):
     custom_text: Optional[str] = None
     description: Optional[str] = None
     file_name: Optional[str] = None
+    file_sha256: Optional[str] = None
+    file_size: Optional[int] = None
+    file_content_type: Optional[str] = None
     status: str = "pending"
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -65,6 +154,46 @@ class NewsletterSubscriber(BaseModel):
 class NewsletterSubscribe(BaseModel):
     email: EmailStr
 
+class NewsletterImportReport(BaseModel):
+    inserted: int
+    duplicates: int
+    invalid: int
+
+# Campaign Models
+class CampaignCreate(BaseModel):
+    subject: str
+    body_template: str  # string.Template syntax, e.g. "Hi $email"
+
+class Campaign(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    subject: str
+    body_template: str
+    status: str = "pending"  # pending, running, completed, failed
+    sent: int = 0
+    failed: int = 0
+    sends_per_second: float = 0.0
+    checkpoint: Optional[str] = None  # last subscriber _id whose delivery is settled
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class OrderSummary(BaseModel):
+    id: str
+    status: str
+    total: float
+    item_count: int
+    created_at: datetime
+
+class OrderHistoryPage(BaseModel):
+    orders: List[OrderSummary]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page
+
+# Profiling Models
+class SavedProfile(BaseModel):
+    name: str
+    size: int
+    created_at: datetime
+
 # Response Models
 class MessageResponse(BaseModel):
     message: str
\ No newline at end of file
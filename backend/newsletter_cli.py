@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Newsletter subscriber import/export
+
+    python newsletter_cli.py import subscribers.csv
+    python newsletter_cli.py import subscribers.ndjson --batch-size 10000
+    python newsletter_cli.py export backup.ndjson --format ndjson
+"""
+
+import asyncio
+import time
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from database import newsletter_collection, init_indexes
+from newsletter_io import IMPORT_BATCH_SIZE, detect_format, import_subscribers, export_subscribers
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+app = typer.Typer(help="Bulk import and export newsletter subscribers")
+
+
+async def _read_chunks(path: Path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+@app.command("import")
+def import_command(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON file"),
+    format: Optional[str] = typer.Option(None, help="csv or ndjson (default: from file extension)"),
+    batch_size: int = typer.Option(IMPORT_BATCH_SIZE, help="Subscribers per insert_many"),
+):
+    """Import subscribers, skipping duplicates and invalid addresses"""
+    fmt = detect_format(format, filename=path.name)
+
+    async def run():
+        await init_indexes()
+        return await import_subscribers(newsletter_collection, _read_chunks(path), fmt, batch_size)
+
+    started = time.perf_counter()
+    report = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    typer.echo(
+        f"inserted={report['inserted']} duplicates={report['duplicates']} "
+        f"invalid={report['invalid']} in {elapsed:.2f}s"
+    )
+
+
+@app.command("export")
+def export_command(
+    path: Path = typer.Argument(..., dir_okay=False, help="Output file"),
+    format: Optional[str] = typer.Option(None, help="csv or ndjson (default: from file extension)"),
+):
+    """Export all subscribers"""
+    fmt = detect_format(format, filename=path.name)
+
+    async def run():
+        with open(path, "wb") as f:
+            async for chunk in export_subscribers(newsletter_collection, fmt):
+                await asyncio.to_thread(f.write, chunk)
+
+    asyncio.run(run())
+    typer.echo(f"Exported subscribers to {path}")
+
+
+if __name__ == "__main__":
+    app()
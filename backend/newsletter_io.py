@@ -0,0 +1,218 @@
+from pydantic.networks import validate_email
+from pymongo.errors import BulkWriteError
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import codecs
+import csv
+import io
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Streaming bulk import/export of newsletter subscribers.
+#
+# Uploads are consumed chunk by chunk, validated a batch at a time in a worker
+# thread and written with unordered insert_many against the unique email index,
+# with the next batch being parsed while the previous one is written. Memory use
+# is bounded by the batch size, not the size of the list. CSV goes through the csv
+# module both ways, so quoted fields, including ones spanning lines, round-trip.
+
+IMPORT_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 5000
+EXPORT_CHUNK_BYTES = 64 * 1024
+FORMATS = ("csv", "ndjson")
+DUPLICATE_KEY_ERROR = 11000
+
+
+def detect_format(explicit: Optional[str], content_type: Optional[str] = None, filename: Optional[str] = None) -> str:
+    """Pick csv or ndjson from an explicit value, a content type or a file name"""
+    if explicit:
+        fmt = explicit.lower()
+    elif content_type and ("ndjson" in content_type or "jsonlines" in content_type):
+        fmt = "ndjson"
+    elif filename and filename.lower().endswith((".ndjson", ".jsonl")):
+        fmt = "ndjson"
+    else:
+        fmt = "csv"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    return fmt
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into text lines without holding more than one chunk"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    remainder = ""
+    async for chunk in chunks:
+        text = remainder + decoder.decode(chunk)
+        lines = text.split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    remainder += decoder.decode(b"", final=True)
+    if remainder:
+        yield remainder.rstrip("\r")
+
+
+class _LineFeed:
+    """The lines csv.reader pulls from, topped up one complete record at a time"""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Optional[List[str]]]:
+    """Parse CSV with csv.reader, one record at a time; None for a record left unterminated"""
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    record: List[str] = []
+    quotes = 0
+    async for line in lines:
+        if not record and not line.strip():
+            continue
+        record.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2:
+            # Inside a quoted field that continues on the next line
+            continue
+        feed.lines.extend(record)
+        record, quotes = [], 0
+        try:
+            yield next(reader, None)
+        except csv.Error:
+            yield None
+    if record:
+        yield None
+
+
+async def iter_emails(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Optional[str]]:
+    """Yield the raw email of every record; None for records that cannot be parsed"""
+    if fmt == "ndjson":
+        async for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record.get("email") if isinstance(record, dict) else None
+            except ValueError:
+                yield None
+        return
+
+    email_column = None
+    first = True
+    async for row in iter_csv_rows(lines):
+        if row is None:
+            yield None
+            continue
+        if first:
+            first = False
+            header = [cell.strip().lower() for cell in row]
+            if "email" in header:
+                email_column = header.index("email")
+                continue
+            email_column = 0
+        yield row[email_column].strip() if len(row) > email_column else None
+
+
+def _validate_batch(emails: List[Optional[str]]) -> List[Optional[str]]:
+    """Normalize emails the same way EmailStr does; None marks an invalid entry"""
+    valid = []
+    for email in emails:
+        if not email:
+            valid.append(None)
+            continue
+        try:
+            valid.append(validate_email(email)[1])
+        except Exception:
+            valid.append(None)
+    return valid
+
+
+async def _insert_batch(collection, emails: List[Optional[str]], report: Dict[str, int]):
+    normalized = await asyncio.to_thread(_validate_batch, emails)
+    now = datetime.utcnow()
+    documents = [
+        {"id": str(uuid.uuid4()), "email": email, "subscribed_at": now}
+        for email in normalized if email is not None
+    ]
+    report["invalid"] += len(normalized) - len(documents)
+    if not documents:
+        return
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        report["inserted"] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        duplicates = sum(1 for error in errors if error.get("code") == DUPLICATE_KEY_ERROR)
+        report["inserted"] += e.details.get("nInserted", 0)
+        report["duplicates"] += duplicates
+        if duplicates != len(errors):
+            raise
+
+
+async def import_subscribers(collection, chunks: AsyncIterator[bytes], fmt: str,
+                             batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """Import subscribers from a CSV or NDJSON byte stream"""
+    report = {"inserted": 0, "duplicates": 0, "invalid": 0}
+    batch: List[Optional[str]] = []
+    in_flight: Optional[asyncio.Task] = None
+
+    async for email in iter_emails(iter_lines(chunks), fmt):
+        batch.append(email)
+        if len(batch) >= batch_size:
+            # Keep one write in flight while the next batch is parsed
+            if in_flight is not None:
+                await in_flight
+            in_flight = asyncio.create_task(_insert_batch(collection, batch, report))
+            batch = []
+
+    if in_flight is not None:
+        await in_flight
+    if batch:
+        await _insert_batch(collection, batch, report)
+
+    logger.info(f"Imported newsletter subscribers: {report}")
+    return report
+
+
+async def export_subscribers(collection, fmt: str) -> AsyncIterator[bytes]:
+    """Stream every subscriber as CSV or NDJSON in ~64KB chunks"""
+    cursor = collection.find(
+        {}, {"_id": 0, "id": 1, "email": 1, "subscribed_at": 1}
+    ).batch_size(EXPORT_BATCH_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if fmt == "csv":
+        writer.writerow(["id", "email", "subscribed_at"])
+
+    async for subscriber in cursor:
+        subscribed_at = subscriber.get("subscribed_at")
+        subscribed_at = subscribed_at.isoformat() if subscribed_at else ""
+        if fmt == "csv":
+            writer.writerow([subscriber.get("id", ""), subscriber["email"], subscribed_at])
+        else:
+            buffer.write(json.dumps({
+                "id": subscriber.get("id"),
+                "email": subscriber["email"],
+                "subscribed_at": subscribed_at,
+            }) + "\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import logging
+import os
+
+from outbox import outbox, outbox_event
+from payment_state import transition_order
+
+logger = logging.getLogger(__name__)
+
+ORDER_ABANDON_SECONDS = float(os.environ.get('ORDER_ABANDON_SECONDS', 2 * 60 * 60))
+ORDER_EXPIRY_INTERVAL_SECONDS = float(os.environ.get('ORDER_EXPIRY_INTERVAL_SECONDS', 300))
+ORDER_EXPIRY_BATCH_SIZE = int(os.environ.get('ORDER_EXPIRY_BATCH_SIZE', 200))
+
+
+class AbandonedOrderSweeper:
+    """
+    Expires pending orders that never reached checkout, releasing their stock.
+
+    Stock is reserved when an order is created. Orders that go on to checkout are
+    settled by the payment flow, which expires them with their checkout session.
+    Orders that never start a checkout would hold their reservations forever. An
+    order still pending `abandon_after_seconds` after creation, with no checkout
+    started, is moved to "expired" together with an order.expired outbox event,
+    whose handler releases the stock. Starting a checkout marks the order with
+    checkout_started_at, and the guarded transition excludes marked orders, so an
+    order is either expired here or paid for, never both.
+    """
+
+    def __init__(self, orders_collection, abandon_after_seconds: float = ORDER_ABANDON_SECONDS,
+                 interval_seconds: float = ORDER_EXPIRY_INTERVAL_SECONDS,
+                 batch_size: int = ORDER_EXPIRY_BATCH_SIZE):
+        self.orders = orders_collection
+        self.abandon_after_seconds = abandon_after_seconds
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await self.orders.create_index([("status", 1), ("created_at", 1)])
+
+    async def _expire(self, order_id: str) -> bool:
+        async def apply(session) -> bool:
+            result = await transition_order(
+                self.orders, order_id, "expired", session=session,
+                where={"checkout_started_at": None}, expired_reason="abandoned"
+            )
+            if not result.applied:
+                return False
+            await outbox.enqueue([outbox_event("order.expired", {
+                "order_id": order_id,
+                "reservations": result.document.get("reservations") or [],
+            })], session=session)
+            return True
+
+        return await outbox.transaction(apply)
+
+    async def sweep_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Expire every abandoned order created before the cutoff"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.abandon_after_seconds)
+        stats = {"checked": 0, "expired": 0}
+        query = {"status": "pending", "created_at": {"$lt": cutoff}, "checkout_started_at": None}
+        while True:
+            batch = await self.orders.find(query, {"_id": 0, "id": 1}).sort("created_at", 1).limit(
+                self.batch_size
+            ).to_list(self.batch_size)
+            expired = 0
+            for order in batch:
+                if await self._expire(order["id"]):
+                    expired += 1
+            stats["checked"] += len(batch)
+            stats["expired"] += expired
+            # Expired orders drop out of the query; stop if a batch made no progress
+            if len(batch) < self.batch_size or not expired:
+                break
+
+        if stats["expired"]:
+            logger.info(f"Abandoned order sweep finished: {stats}")
+        return stats
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Abandoned order sweep failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Schedule the sweeper on the running event loop"""
+        if self.interval_seconds <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
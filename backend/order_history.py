@@ -0,0 +1,75 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import heapq
+import itertools
+import json
+
+# Customer order history.
+#
+# Pages are read in (created_at, id) order, newest first, from the
+# (customer_email, created_at, id) index. The cursor holds the sort key of the
+# last order returned, and the next page starts right after it. Every page
+# costs one index range scan however deep the customer's history goes; there
+# is no skip(). Only the summary fields are projected, so item details are
+# never read into the response. Orders moved to the archive are read from it with
+# the same query, and the two pages are merged.
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+HISTORY_INDEX = [("customer_email", 1), ("created_at", -1), ("id", -1)]
+
+
+def encode_cursor(created_at: datetime, order_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), order_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError for a cursor that was not produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(order_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def list_customer_orders(collection, customer_email: str, status: Optional[str] = None,
+                               cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                               archive_collection=None) -> Dict[str, Any]:
+    """One page of a customer's orders, newest first, with the cursor for the next page"""
+    match: Dict[str, Any] = {"customer_email": customer_email}
+    if status:
+        match["status"] = status
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        match["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": order_id}},
+        ]
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "id": -1}},
+        # One extra to tell whether there is a next page
+        {"$limit": limit + 1},
+        {"$project": {
+            "_id": 0, "id": 1, "status": 1, "total": 1, "created_at": 1,
+            "item_count": {"$size": {"$ifNull": ["$items", []]}},
+        }},
+    ]
+    sources = [collection] + ([archive_collection] if archive_collection is not None else [])
+    pages = await asyncio.gather(*[source.aggregate(pipeline).to_list(limit + 1) for source in sources])
+    orders: List[Dict[str, Any]] = heapq.merge(
+        *pages, key=lambda order: (order["created_at"], order["id"]), reverse=True
+    )
+    orders = list(itertools.islice(orders, limit + 1))
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1]["created_at"], orders[-1]["id"])
+    return {"orders": orders, "next_cursor": next_cursor}
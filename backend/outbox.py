@@ -0,0 +1,226 @@
+from pymongo.errors import OperationFailure, ConfigurationError
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import uuid
+from database import client, outbox_collection
+
+logger = logging.getLogger(__name__)
+
+# Transactional outbox for side effects of order and payment state changes.
+#
+# A state change and the events describing it are written in the same MongoDB
+# transaction, so either both happen or neither does. OutboxDispatcher claims
+# pending events in batches under a lease, runs the handlers registered for each
+# event type and marks them done. Delivery is at-least-once: a crashed consumer's
+# lease expires and the batch is retried. Each handler that succeeds is recorded
+# on the event, so a redelivered event only re-runs the handlers that have not
+# completed yet.
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 200))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 1.0))
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', 60))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETENTION_SECONDS = int(os.environ.get('OUTBOX_RETENTION_SECONDS', 7 * 24 * 60 * 60))
+
+# "Transaction numbers are only allowed on a replica set member or mongos"
+ILLEGAL_OPERATION = 20
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def outbox_event(event_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    return {
+        "_id": str(uuid.uuid4()),
+        "type": event_type,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "handled": [],
+        "created_at": now,
+        "available_at": now,
+    }
+
+
+class Outbox:
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+        self._transactions_supported: Optional[bool] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("available_at", 1)])
+        await self.collection.create_index("done_at", expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+
+    def on_enqueue(self, listener: Callable[[], None]):
+        """Register a callback run after events are committed, e.g. to wake a dispatcher"""
+        self._listeners.append(listener)
+
+    async def transaction(self, callback: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        Run callback(session) in a transaction and return its result.
+
+        On a standalone server, which has no transactions, the callback runs with
+        session=None and its writes are applied one after another.
+        """
+        if self._transactions_supported is not False:
+            try:
+                async with await self.client.start_session() as session:
+                    result = await session.with_transaction(callback)
+                self._transactions_supported = True
+                self._notify()
+                return result
+            except (OperationFailure, ConfigurationError) as e:
+                unsupported = isinstance(e, ConfigurationError) or e.code == ILLEGAL_OPERATION
+                if not unsupported or self._transactions_supported:
+                    raise
+                self._transactions_supported = False
+                logger.warning("MongoDB transactions are unavailable; outbox writes are not atomic")
+        result = await callback(None)
+        self._notify()
+        return result
+
+    async def enqueue(self, events: List[Dict[str, Any]], session=None):
+        """Write events; pass the transaction session to commit them with the state change"""
+        if events:
+            await self.collection.insert_many(events, session=session)
+
+    def _notify(self):
+        for listener in self._listeners:
+            listener()
+
+
+class OutboxDispatcher:
+    def __init__(self, collection, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_seconds: float = OUTBOX_POLL_SECONDS, lease_seconds: float = OUTBOX_LEASE_SECONDS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stats = {"dispatched": 0, "retried": 0, "failed": 0}
+        self._handlers: Dict[str, List[tuple]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, event_type: str, handler: Handler, name: Optional[str] = None):
+        """Add a handler for an event type; the name identifies it in the dedupe record"""
+        self._handlers.setdefault(event_type, []).append((name or handler.__name__, handler))
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        claimable = {"$or": [
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"status": "processing", "locked_until": {"$lt": now}},
+        ]}
+        candidates = await self.collection.find(claimable, {"_id": 1}).sort(
+            "available_at", 1
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        lease = str(uuid.uuid4())
+        await self.collection.update_many(
+            {"_id": {"$in": [c["_id"] for c in candidates]}, **claimable},
+            {"$set": {
+                "status": "processing",
+                "lease": lease,
+                "locked_until": now + timedelta(seconds=self.lease_seconds),
+            }, "$inc": {"attempts": 1}}
+        )
+        # Other dispatchers may have won some of the candidates
+        return await self.collection.find({"lease": lease, "status": "processing"}).to_list(self.batch_size)
+
+    async def _dispatch(self, event: Dict[str, Any]) -> Optional[str]:
+        """Run the event's outstanding handlers; returns an error message if any failed"""
+        pending = [
+            (name, handler) for name, handler in self._handlers.get(event["type"], [])
+            if name not in event.get("handled", [])
+        ]
+        for index, (name, handler) in enumerate(pending):
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.warning(f"Outbox handler {name} failed for event {event['_id']}: {str(e)}")
+                return f"{name}: {str(e)}"
+            # The last handler is covered by marking the whole event done
+            if index < len(pending) - 1:
+                await self.collection.update_one(
+                    {"_id": event["_id"], "lease": event["lease"]}, {"$addToSet": {"handled": name}}
+                )
+        return None
+
+    async def run_once(self) -> int:
+        """Claim and dispatch one batch; returns the number of events processed"""
+        events = await self._claim()
+        if not events:
+            return 0
+
+        errors = await asyncio.gather(*[self._dispatch(event) for event in events])
+        now = datetime.utcnow()
+        done = [event["_id"] for event, error in zip(events, errors) if error is None]
+        if done:
+            await self.collection.update_many(
+                {"_id": {"$in": done}},
+                {"$set": {"status": "done", "done_at": now}, "$unset": {"lease": "", "locked_until": ""}}
+            )
+            self.stats["dispatched"] += len(done)
+
+        for event, error in zip(events, errors):
+            if error is None:
+                continue
+            if event["attempts"] >= self.max_attempts:
+                update = {"status": "failed", "last_error": error}
+                self.stats["failed"] += 1
+            else:
+                # Exponential backoff, capped at ten minutes
+                delay = min(2 ** event["attempts"], 600)
+                update = {"status": "pending", "last_error": error, "available_at": now + timedelta(seconds=delay)}
+                self.stats["retried"] += 1
+            await self.collection.update_one(
+                {"_id": event["_id"]}, {"$set": update, "$unset": {"lease": "", "locked_until": ""}}
+            )
+        return len(events)
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {str(e)}")
+                processed = 0
+            if processed >= self.batch_size:
+                continue
+            # Tailing poll, cut short when new events are committed in this process
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+# Global outbox instance
+outbox = Outbox(client, outbox_collection)
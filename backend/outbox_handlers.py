@@ -0,0 +1,77 @@
+from pymongo.errors import DuplicateKeyError
+from database import analytics_collection, analytics_events_collection, orders_collection
+from email_service import send_custom_order_notification, send_order_confirmation
+from inventory import inventory_service
+from outbox import outbox, OutboxDispatcher, OUTBOX_RETENTION_SECONDS
+from datetime import datetime
+from typing import Any, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Side effects of order and payment state changes, run by the outbox dispatcher.
+# Delivery is at-least-once, so a handler may see the same event more than once.
+# Handlers that change state record the event first and skip a redelivery.
+
+
+async def ensure_indexes():
+    # Processed event ids only need to outlive redelivery, which stops once the
+    # outbox has dropped the event
+    await analytics_events_collection.create_index(
+        "processed_at", expireAfterSeconds=OUTBOX_RETENTION_SECONDS
+    )
+
+
+async def send_order_confirmation_email(event: Dict[str, Any]):
+    if not await send_order_confirmation(event["payload"]):
+        raise RuntimeError("Order confirmation email was not sent")
+
+
+async def send_custom_order_email(event: Dict[str, Any]):
+    if not await send_custom_order_notification(event["payload"]):
+        raise RuntimeError("Custom order notification was not sent")
+
+
+async def record_paid_order(event: Dict[str, Any]):
+    """Roll a paid order into the daily sales figures"""
+    order = event["payload"]
+    day = event["created_at"].strftime("%Y-%m-%d")
+
+    async def record(session):
+        # The event id is recorded first; a redelivery fails here and counts nothing
+        await analytics_events_collection.insert_one(
+            {"_id": event["_id"], "day": day, "processed_at": datetime.utcnow()}, session=session
+        )
+        await analytics_collection.update_one(
+            {"_id": day},
+            {"$inc": {"paid_orders": 1, "revenue": order.get("total", 0)}},
+            upsert=True, session=session
+        )
+
+    try:
+        await outbox.transaction(record)
+    except DuplicateKeyError:
+        pass
+
+
+async def release_expired_stock(event: Dict[str, Any]):
+    """Hand the stock reserved by an expired order back to inventory"""
+    order_id = event["payload"]["order_id"]
+    # Flagged before the release, so that a redelivery never returns the stock twice;
+    # a crash in between leaves the stock held rather than oversold
+    claimed = await orders_collection.find_one_and_update(
+        {"id": order_id, "stock_released": {"$ne": True}},
+        {"$set": {"stock_released": True}},
+        projection={"_id": 1}
+    )
+    if claimed is None:
+        return
+    await inventory_service.release(event["payload"].get("reservations") or [])
+    logger.info(f"Order {order_id} expired; released its stock reservations")
+
+
+def register_handlers(dispatcher: OutboxDispatcher):
+    dispatcher.register("order.created", send_order_confirmation_email)
+    dispatcher.register("custom_order.created", send_custom_order_email)
+    dispatcher.register("order.paid", record_paid_order)
+    dispatcher.register("order.expired", release_expired_stock)
@@ -23,4 +23,30 @@ class CheckoutRequest(BaseModel):
     origin_url: str
 
 class CheckoutStatusRequest(BaseModel):
-    session_id: str
\ No newline at end of file
+    session_id: str
+
+# Payment Provider Models
+class CheckoutSessionParams(BaseModel):
+    amount: float
+    currency: str = "usd"
+    success_url: str
+    cancel_url: str
+    metadata: Optional[Dict[str, str]] = None
+
+class CheckoutSession(BaseModel):
+    session_id: str
+    url: str
+
+class CheckoutStatus(BaseModel):
+    status: str  # open, complete, expired
+    payment_status: str  # unpaid, paid, no_payment_required
+    amount_total: int  # in the smallest currency unit
+    currency: str
+    metadata: Dict[str, str] = Field(default_factory=dict)
+
+class WebhookEvent(BaseModel):
+    event_type: str
+    event_id: str
+    session_id: Optional[str] = None
+    payment_status: Optional[str] = None
+    metadata: Dict[str, str] = Field(default_factory=dict)
@@ -0,0 +1,230 @@
+from abc import ABC, abstractmethod
+from payment_models import CheckoutSessionParams, CheckoutSession, CheckoutStatus, WebhookEvent
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentProviderError(Exception):
+    """Raised when the payment provider rejects or fails a request"""
+
+
+class PaymentProvider(ABC):
+    """Interface between StripePaymentService and the hosted checkout backend"""
+
+    @abstractmethod
+    async def create_checkout_session(self, params: CheckoutSessionParams, webhook_url: str) -> CheckoutSession:
+        """Create a hosted checkout session"""
+
+    @abstractmethod
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        """Fetch the current state of a checkout session"""
+
+    @abstractmethod
+    async def handle_webhook(self, request_body: bytes, signature: str) -> WebhookEvent:
+        """Verify and parse a webhook delivery"""
+
+
+class StripeProvider(PaymentProvider):
+    """Stripe Checkout through emergentintegrations"""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.environ.get('STRIPE_API_KEY')
+        if not self.api_key:
+            raise ValueError("STRIPE_API_KEY environment variable is required")
+
+    def _get_stripe_checkout(self, webhook_url: str = ""):
+        """Initialize Stripe checkout with webhook URL"""
+        from emergentintegrations.payments.stripe.checkout import StripeCheckout
+        return StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+
+    async def create_checkout_session(self, params: CheckoutSessionParams, webhook_url: str) -> CheckoutSession:
+        from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+        stripe_checkout = self._get_stripe_checkout(webhook_url)
+        session = await stripe_checkout.create_checkout_session(CheckoutSessionRequest(**params.model_dump()))
+        return CheckoutSession(session_id=session.session_id, url=session.url)
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        stripe_checkout = self._get_stripe_checkout()
+        status = await stripe_checkout.get_checkout_status(session_id)
+        return CheckoutStatus(
+            status=status.status,
+            payment_status=status.payment_status,
+            amount_total=status.amount_total,
+            currency=status.currency,
+            metadata=status.metadata or {}
+        )
+
+    async def handle_webhook(self, request_body: bytes, signature: str) -> WebhookEvent:
+        stripe_checkout = self._get_stripe_checkout()
+        event = await stripe_checkout.handle_webhook(request_body, signature)
+        return WebhookEvent(
+            event_type=event.event_type,
+            event_id=getattr(event, 'event_id', '') or '',
+            session_id=getattr(event, 'session_id', None),
+            payment_status=getattr(event, 'payment_status', None),
+            metadata=getattr(event, 'metadata', None) or {}
+        )
+
+
+class FakePaymentProvider(PaymentProvider):
+    """
+    In-process checkout backend for offline development and load testing.
+
+    Every call waits `latency_seconds` (plus up to `latency_jitter_seconds`)
+    and fails with probability `failure_rate`. Sessions complete with
+    `outcome` ("paid" or "expired") after `complete_after_seconds`; when
+    `webhook_sink` is set, a signed checkout.session.* event is delivered to
+    it at that point, the way Stripe would call the webhook endpoint.
+
+    Sessions live in `sessions_collection` when one is given, so that a status
+    poll or webhook served by another worker of a multi-process server finds
+    them; without one they are kept in this process only.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, latency_jitter_seconds: float = 0.0,
+                 failure_rate: float = 0.0, complete_after_seconds: Optional[float] = 0.0,
+                 outcome: str = "paid", webhook_secret: str = "whsec_fake",
+                 webhook_sink: Optional[Callable[[bytes, str], Awaitable[Any]]] = None,
+                 seed: Optional[int] = None, sessions_collection=None):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.failure_rate = failure_rate
+        self.complete_after_seconds = complete_after_seconds
+        self.outcome = outcome
+        self.webhook_secret = webhook_secret
+        self.webhook_sink = webhook_sink
+        self.sessions_collection = sessions_collection
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"created": 0, "status_checks": 0, "failures": 0, "webhooks_sent": 0}
+        self._random = random.Random(seed)
+        self._tasks: set = set()
+
+    @classmethod
+    def from_env(cls, sessions_collection=None) -> "FakePaymentProvider":
+        return cls(
+            latency_seconds=float(os.environ.get('FAKE_PAYMENT_LATENCY_MS', 0)) / 1000,
+            latency_jitter_seconds=float(os.environ.get('FAKE_PAYMENT_JITTER_MS', 0)) / 1000,
+            failure_rate=float(os.environ.get('FAKE_PAYMENT_FAILURE_RATE', 0)),
+            complete_after_seconds=float(os.environ.get('FAKE_PAYMENT_COMPLETE_AFTER_MS', 0)) / 1000,
+            outcome=os.environ.get('FAKE_PAYMENT_OUTCOME', 'paid'),
+            sessions_collection=sessions_collection,
+        )
+
+    async def _simulate_call(self):
+        delay = self.latency_seconds
+        if self.latency_jitter_seconds:
+            delay += self._random.uniform(0, self.latency_jitter_seconds)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.stats["failures"] += 1
+            raise PaymentProviderError("Simulated payment provider failure")
+
+    async def _load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.sessions_collection is None:
+            return self.sessions.get(session_id)
+        return await self.sessions_collection.find_one({"_id": session_id}, {"_id": 0})
+
+    async def _save_session(self, session_id: str, session: Dict[str, Any]):
+        if self.sessions_collection is None:
+            self.sessions[session_id] = session
+        else:
+            await self.sessions_collection.replace_one({"_id": session_id}, session, upsert=True)
+
+    def sign(self, payload: bytes) -> str:
+        return hmac.new(self.webhook_secret.encode('utf-8'), payload, hashlib.sha256).hexdigest()
+
+    async def create_checkout_session(self, params: CheckoutSessionParams, webhook_url: str) -> CheckoutSession:
+        await self._simulate_call()
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        await self._save_session(session_id, {
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(params.amount * 100)),
+            "currency": params.currency,
+            "metadata": dict(params.metadata or {}),
+        })
+        self.stats["created"] += 1
+        if self.complete_after_seconds is not None:
+            task = asyncio.create_task(self._complete_later(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return CheckoutSession(
+            session_id=session_id,
+            url=params.success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        )
+
+    async def complete_session(self, session_id: str, outcome: Optional[str] = None) -> Dict[str, Any]:
+        """Move a session to its final state, as if the customer finished or abandoned checkout"""
+        session = await self._load_session(session_id)
+        if session is None:
+            raise PaymentProviderError(f"No such checkout session: {session_id}")
+        if (outcome or self.outcome) == "paid":
+            session.update(status="complete", payment_status="paid")
+        else:
+            session.update(status="expired", payment_status="unpaid")
+        await self._save_session(session_id, session)
+        return session
+
+    async def _complete_later(self, session_id: str):
+        if self.complete_after_seconds:
+            await asyncio.sleep(self.complete_after_seconds)
+        try:
+            session = await self.complete_session(session_id)
+        except Exception as e:
+            logger.warning(f"Fake completion of {session_id} failed: {str(e)}")
+            return
+        if self.webhook_sink is None:
+            return
+        payload = json.dumps({
+            "id": f"evt_fake_{uuid.uuid4().hex}",
+            "type": "checkout.session.completed" if session["payment_status"] == "paid" else "checkout.session.expired",
+            "session_id": session_id,
+            "payment_status": session["payment_status"],
+            "metadata": session["metadata"],
+        }).encode('utf-8')
+        try:
+            await self.webhook_sink(payload, self.sign(payload))
+            self.stats["webhooks_sent"] += 1
+        except Exception as e:
+            logger.warning(f"Fake webhook delivery for {session_id} failed: {str(e)}")
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        await self._simulate_call()
+        self.stats["status_checks"] += 1
+        session = await self._load_session(session_id)
+        if session is None:
+            raise PaymentProviderError(f"No such checkout session: {session_id}")
+        return CheckoutStatus(**session)
+
+    async def handle_webhook(self, request_body: bytes, signature: str) -> WebhookEvent:
+        if not hmac.compare_digest(self.sign(request_body), signature or ""):
+            raise PaymentProviderError("Invalid webhook signature")
+        event = json.loads(request_body)
+        return WebhookEvent(
+            event_type=event["type"],
+            event_id=event["id"],
+            session_id=event.get("session_id"),
+            payment_status=event.get("payment_status"),
+            metadata=event.get("metadata") or {}
+        )
+
+
+def provider_from_env(fake_sessions_collection=None) -> PaymentProvider:
+    """Build the provider selected by PAYMENT_PROVIDER (stripe or fake)"""
+    name = os.environ.get('PAYMENT_PROVIDER', 'stripe').lower()
+    if name == 'fake':
+        logger.warning("Using the fake payment provider")
+        return FakePaymentProvider.from_env(fake_sessions_collection)
+    if name == 'stripe':
+        return StripeProvider()
+    raise ValueError(f"Unknown PAYMENT_PROVIDER: {name}")
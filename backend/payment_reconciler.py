@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_SWEEP_INTERVAL_SECONDS = float(os.environ.get('PAYMENT_SWEEP_INTERVAL_SECONDS', 300))
+PAYMENT_SWEEP_STALE_SECONDS = float(os.environ.get('PAYMENT_SWEEP_STALE_SECONDS', 30 * 60))
+PAYMENT_SWEEP_BATCH_SIZE = int(os.environ.get('PAYMENT_SWEEP_BATCH_SIZE', 100))
+PAYMENT_SWEEP_CONCURRENCY = int(os.environ.get('PAYMENT_SWEEP_CONCURRENCY', 8))
+
+
+class PaymentReconciler:
+    """
+    Periodically drives stale pending payment transactions to a terminal state.
+
+    Transactions still pending after `stale_after_seconds` are read in
+    created_at order (served by the (status, created_at) index), checked with
+    the payment provider in bounded-concurrency batches, and moved on with a
+    conditional update so that concurrent polls and webhooks are never undone.
+
+    `payment_service` only needs an async `reconcile_transaction(transaction)`
+    method, which makes the sweeper easy to drive against a fake backend.
+    """
+
+    def __init__(self, payment_service, collection, pending_statuses,
+                 stale_after_seconds: float = PAYMENT_SWEEP_STALE_SECONDS,
+                 interval_seconds: float = PAYMENT_SWEEP_INTERVAL_SECONDS,
+                 batch_size: int = PAYMENT_SWEEP_BATCH_SIZE,
+                 concurrency: int = PAYMENT_SWEEP_CONCURRENCY):
+        self.payment_service = payment_service
+        self.collection = collection
+        self.pending_statuses = list(pending_statuses)
+        self.stale_after_seconds = stale_after_seconds
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        """Create the index used to find stale pending transactions"""
+        await self.collection.create_index([("status", 1), ("created_at", 1)])
+
+    async def _reconcile_one(self, semaphore: asyncio.Semaphore, transaction: Dict[str, Any], stats: Dict[str, int]):
+        async with semaphore:
+            try:
+                outcome = await self.payment_service.reconcile_transaction(transaction)
+            except Exception as e:
+                stats["errors"] += 1
+                logger.warning(f"Failed to reconcile payment session {transaction.get('session_id')}: {str(e)}")
+                return
+        if outcome:
+            stats[outcome] = stats.get(outcome, 0) + 1
+        else:
+            stats["unchanged"] += 1
+
+    async def sweep_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Reconcile every transaction that has been pending longer than the threshold"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.stale_after_seconds)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stats = {"checked": 0, "unchanged": 0, "errors": 0}
+
+        # Keyset pagination over created_at so still-pending rows do not stall the sweep
+        last_created_at = None
+        last_id = None
+        while True:
+            query: Dict[str, Any] = {
+                "status": {"$in": self.pending_statuses},
+                "created_at": {"$lt": cutoff},
+            }
+            if last_created_at is not None:
+                query["$or"] = [
+                    {"created_at": {"$gt": last_created_at}},
+                    {"created_at": last_created_at, "_id": {"$gt": last_id}},
+                ]
+            batch = await self.collection.find(
+                query, {"session_id": 1, "status": 1, "metadata": 1, "created_at": 1}
+            ).sort([("created_at", 1), ("_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+
+            stats["checked"] += len(batch)
+            await asyncio.gather(*[self._reconcile_one(semaphore, t, stats) for t in batch])
+
+            last_created_at = batch[-1]["created_at"]
+            last_id = batch[-1]["_id"]
+            if len(batch) < self.batch_size:
+                break
+
+        if stats["checked"]:
+            logger.info(f"Payment reconciliation sweep finished: {stats}")
+        return stats
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Payment reconciliation sweep failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Schedule the sweeper on the running event loop"""
+        if self.interval_seconds <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
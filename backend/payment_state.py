@@ -0,0 +1,75 @@
+from pymongo import ReturnDocument
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from payment_models import CheckoutStatus
+
+# Payment and order status changes are guarded state-machine transitions: a single
+# find_one_and_update filtered on the allowed prior states. Whoever's update matches
+# performed the transition and is the only caller that may fire its side effects.
+
+# Transaction states that have not reached an outcome yet
+PENDING_TRANSACTION_STATUSES = ["initiated", "open"]
+
+# target transaction status -> statuses it may be entered from
+PAYMENT_TRANSITIONS: Dict[str, List[str]] = {
+    "open": ["initiated"],
+    "completed": ["initiated", "open"],
+    "expired": ["initiated", "open"],
+}
+
+# target order status -> statuses it may be entered from
+ORDER_TRANSITIONS: Dict[str, List[str]] = {
+    "paid": ["pending"],
+    "expired": ["pending"],
+}
+
+
+class TransitionResult(NamedTuple):
+    applied: bool
+    document: Optional[Dict[str, Any]]
+
+
+def payment_target(checkout_status: CheckoutStatus) -> Optional[Tuple[str, str]]:
+    """Map a provider checkout status to the (status, payment_status) a transaction should move to"""
+    if checkout_status.payment_status == "paid":
+        return "completed", "paid"
+    if checkout_status.status == "expired":
+        return "expired", "expired"
+    if checkout_status.status == "complete":
+        if checkout_status.payment_status == "unpaid":
+            # Delayed payment methods complete the session before the money arrives;
+            # the transaction stays pending so that the later "paid" can still apply
+            return "open", "unpaid"
+        return "completed", checkout_status.payment_status
+    if checkout_status.status == "open":
+        return "open", checkout_status.payment_status
+    return None
+
+
+async def _transition(collection, query: Dict[str, Any], status: str,
+                      allowed_from: List[str], fields: Dict[str, Any], session=None) -> TransitionResult:
+    document = await collection.find_one_and_update(
+        {**query, "status": {"$in": allowed_from}},
+        {"$set": {**fields, "status": status}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    return TransitionResult(applied=document is not None, document=document)
+
+
+async def transition_payment(collection, session_id: str, status: str,
+                             payment_status: str, session=None, **fields) -> TransitionResult:
+    """Move a payment transaction to `status` if it is still in an allowed prior state"""
+    fields.update(payment_status=payment_status, updated_at=datetime.utcnow())
+    return await _transition(
+        collection, {"session_id": session_id}, status, PAYMENT_TRANSITIONS[status], fields, session
+    )
+
+
+async def transition_order(collection, order_id: str, status: str, session=None,
+                           where: Optional[Dict[str, Any]] = None, **fields) -> TransitionResult:
+    """Move an order to `status` if it is still in an allowed prior state (and matches `where`)"""
+    return await _transition(
+        collection, {**(where or {}), "id": order_id}, status, ORDER_TRANSITIONS[status], fields, session
+    )
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+# Design previews for custom orders.
+#
+# Compositing runs in a process pool so that CPU-bound Pillow work never blocks
+# the event loop. Rendered PNGs are cached in a byte-bounded LRU keyed by a hash
+# of every render input, and concurrent requests for the same preview share one
+# render. Pillow is only imported in the worker processes that render.
+#
+# Workers are started by a forkserver, not forked from the API process: a fork
+# would copy the logging and MongoDB threads' locks in whatever state they were,
+# and the log queue without the thread that drains it. Workers log to stdout
+# themselves. A pool broken by a crashed worker is replaced on the next render.
+
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+PREVIEW_CACHE_BYTES = int(os.environ.get('PREVIEW_CACHE_BYTES', 64 * 1024 * 1024))
+PREVIEW_SIZE = 600
+# Bump when the rendering changes so cached previews are not reused
+RENDER_VERSION = "2"
+
+TEMPLATES_DIR = Path(__file__).parent / 'assets' / 'shirt_templates'
+# template name -> (shirt colour, ink colour)
+SHIRT_TEMPLATES: Dict[str, Tuple[Tuple[int, int, int], Tuple[int, int, int]]] = {
+    "white": ((244, 244, 244), (20, 20, 20)),
+    "black": ((28, 28, 28), (240, 240, 240)),
+    "heather": ((168, 168, 170), (25, 25, 25)),
+    "navy": ((32, 42, 78), (240, 240, 240)),
+}
+
+
+def _shirt_base(template: str, size: int) -> "Image.Image":
+    """Load the template photo if one is installed, else draw a flat shirt silhouette"""
+    from PIL import Image, ImageDraw
+    photo = TEMPLATES_DIR / f"{template}.png"
+    if photo.exists():
+        return Image.open(photo).convert("RGB").resize((size, size))
+
+    shirt_colour, _ = SHIRT_TEMPLATES[template]
+    image = Image.new("RGB", (size, size), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    s = size / 100
+    outline = [
+        (30, 8), (40, 5), (45, 10), (55, 10), (60, 5), (70, 8),     # collar
+        (95, 25), (85, 40), (76, 34),                                # right sleeve
+        (76, 95), (24, 95),                                          # body
+        (24, 34), (15, 40), (5, 25),                                 # left sleeve
+    ]
+    draw.polygon([(x * s, y * s) for x, y in outline], fill=shirt_colour, outline=(120, 120, 120))
+    return image
+
+
+def _load_font(size: int) -> "ImageFont.ImageFont":
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("DejaVuSans-Bold.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+def render_preview(template: str, custom_text: Optional[str], design_path: Optional[str],
+                   size: int = PREVIEW_SIZE) -> bytes:
+    """Composite artwork and text onto a shirt template and return PNG bytes (runs in a worker process)"""
+    from PIL import Image, ImageDraw, UnidentifiedImageError
+    image = _shirt_base(template, size)
+    _, ink_colour = SHIRT_TEMPLATES[template]
+    # Print area on the chest
+    left, top, right, bottom = int(size * 0.32), int(size * 0.25), int(size * 0.68), int(size * 0.70)
+
+    if design_path:
+        try:
+            with Image.open(design_path) as artwork:
+                text_space = (bottom - top) // 5 if custom_text else 0
+                box = (right - left, bottom - top - text_space)
+                # Scaled down before any conversion: a JPEG is decoded at a reduced
+                # scale, and only the print-sized image is converted to RGBA
+                artwork.draft("RGB", box)
+                if artwork.mode in ("1", "P", "PA"):
+                    # Palette images cannot be resampled, only thinned out
+                    artwork = artwork.convert("RGBA")
+                artwork.thumbnail(box)
+                artwork = artwork.convert("RGBA")
+                x = left + (right - left - artwork.width) // 2
+                image.paste(artwork, (x, top), artwork)
+                top += artwork.height + size // 50
+        except (UnidentifiedImageError, OSError) as e:
+            # e.g. SVG artwork, which Pillow cannot rasterize
+            logger.warning(f"Skipping unreadable design {design_path}: {str(e)}")
+
+    if custom_text:
+        draw = ImageDraw.Draw(image)
+        font_size = size // 14
+        font = _load_font(font_size)
+        # Shrink until the text fits the print area width
+        while font_size > 10 and draw.textlength(custom_text, font=font) > right - left:
+            font_size -= 2
+            font = _load_font(font_size)
+        width = draw.textlength(custom_text, font=font)
+        draw.text((left + (right - left - width) / 2, top), custom_text, fill=ink_colour, font=font)
+
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=False)
+    return output.getvalue()
+
+
+def _init_worker():
+    from logging_setup import configure_worker_logging
+    configure_worker_logging()
+
+
+def preview_key(template: str, custom_text: Optional[str], design_sha256: Optional[str]) -> str:
+    """Hash of every input that affects the rendered preview"""
+    parts = [RENDER_VERSION, template, custom_text or "", design_sha256 or ""]
+    return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+
+class LRUBytesCache:
+    """LRU cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class PreviewRenderer:
+    def __init__(self, workers: int = PREVIEW_WORKERS, cache_bytes: int = PREVIEW_CACHE_BYTES):
+        self.workers = workers
+        self.cache = LRUBytesCache(cache_bytes)
+        self.stats = {"hits": 0, "renders": 0}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Started on first use so that worker processes are only spawned when previews are requested
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    def _discard_executor(self, broken: ProcessPoolExecutor):
+        if self._executor is broken:
+            self._executor = None
+            broken.shutdown(wait=False, cancel_futures=True)
+            logger.warning("Preview render pool broke; starting a new one")
+
+    def _submit(self, *args) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            future = loop.run_in_executor(executor, render_preview, *args)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            future = loop.run_in_executor(executor, render_preview, *args)
+
+        def check(done: asyncio.Future):
+            if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                self._discard_executor(executor)
+
+        future.add_done_callback(check)
+        return future
+
+    async def get_preview(self, template: str, custom_text: Optional[str],
+                          design_sha256: Optional[str], design_path: Optional[str]) -> Tuple[str, bytes]:
+        """Return (cache key, PNG bytes), rendering only on a cache miss"""
+        if template not in SHIRT_TEMPLATES:
+            raise ValueError(f"Unknown shirt template: {template}")
+        key = preview_key(template, custom_text, design_sha256)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return key, cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["hits"] += 1
+            return key, await asyncio.shield(inflight)
+
+        future = self._submit(template, custom_text, design_path)
+        self._inflight[key] = future
+        # Cache from a callback so the result is kept even if the first requester goes away
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return key, await asyncio.shield(future)
+
+    def _finish(self, key: str, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.stats["renders"] += 1
+        self.cache.put(key, future.result())
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,288 @@
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Sampling profiler for a running worker.
+#
+# A background thread wakes every interval and reads the event loop thread's
+# current Python stack with sys._current_frames(). Nothing is instrumented, and the
+# profiled code runs at full speed between samples; the cost is one stack walk per
+# interval. Every request handler, and every coroutine it awaits in server.py,
+# stripe_service.py or database.py, runs on that thread, so its frames appear in
+# the stacks while it holds the CPU.
+#
+# Two modes:
+#   cpu   only samples where the loop was running Python code; idle samples,
+#         with the loop waiting in its selector, are dropped
+#   wall  also records, for every task that is suspended, the chain of awaits it
+#         is blocked on (task -> coroutine -> awaited coroutine ...). This shows
+#         where requests spend their time waiting on MongoDB or Stripe. Weights
+#         are then task-time, not elapsed time.
+#
+# Output is either collapsed stacks ("frame;frame;frame count", for flamegraph.pl,
+# inferno or speedscope) or a speedscope JSON file.
+#
+# A slow request can also start a capture by itself. SlowRequestTrigger watches the
+# listed paths and profiles the next PROFILE_TRIGGER_SECONDS of the worker after
+# one of them takes longer than PROFILE_TRIGGER_MS. The speedscope file is written
+# to PROFILE_DIR.
+
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 10))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+PROFILE_TRIGGER_MS = float(os.environ.get('PROFILE_TRIGGER_MS', 0))  # 0 disables the trigger
+PROFILE_TRIGGER_SECONDS = float(os.environ.get('PROFILE_TRIGGER_SECONDS', 10))
+PROFILE_TRIGGER_COOLDOWN = float(os.environ.get('PROFILE_TRIGGER_COOLDOWN', 300))
+PROFILE_TRIGGER_PATHS = [
+    path.strip() for path in os.environ.get('PROFILE_TRIGGER_PATHS', '/api/checkout/create-session').split(',')
+    if path.strip()
+]
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'urban-profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+
+PROFILE_MODES = ("cpu", "wall")
+PROFILE_NAME = re.compile(r"^profile-[0-9T\-]+-[a-z0-9\-]+\.speedscope\.json$")
+
+# Where the event loop waits for I/O: a sample whose innermost frame is here is idle
+IDLE_FILES = ("selectors.py", os.path.join("asyncio", "runners.py"))
+
+
+class ProfilerBusy(Exception):
+    """Only one profile runs at a time"""
+    pass
+
+
+def _label(code, labels: Dict[Any, str]) -> str:
+    label = labels.get(code)
+    if label is None:
+        # Keyed by the function's first line, so that a function is one frame
+        # however many of its lines were sampled
+        name = getattr(code, "co_qualname", code.co_name)
+        label = labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+    return label
+
+
+def _thread_stack(frame, labels: Dict[Any, str]) -> Tuple[str, ...]:
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code, labels))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _await_stack(task: asyncio.Task, labels: Dict[Any, str]) -> Tuple[str, ...]:
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            # A future, or another awaitable implemented in C
+            stack.append(f"<{type(awaitable).__name__}>")
+            break
+        stack.append(_label(frame.f_code, labels))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return tuple(["<task>"] + stack)
+
+
+class Profile:
+    def __init__(self, mode: str, interval: float):
+        self.mode = mode
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at = datetime.utcnow()
+        self.duration = 0.0
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        frames: List[Dict[str, Any]] = []
+        index: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    function, _, location = label.partition(" (")
+                    file, _, line = location.rstrip(")").rpartition(":")
+                    frame: Dict[str, Any] = {"name": function}
+                    if file:
+                        frame.update(file=file, line=int(line))
+                    frames.append(frame)
+            samples.append([index[label] for label in stack])
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "urban-threads-api",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{name} ({self.mode}, {self.sample_count} samples)",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+class SamplingProfiler:
+    def __init__(self, default_interval_ms: float = PROFILE_INTERVAL_MS, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.default_interval = default_interval_ms / 1000
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, seconds: float, mode: str = "cpu", interval_ms: Optional[float] = None) -> Profile:
+        """Sample the calling event loop for `seconds`; raises ProfilerBusy if a profile is running"""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            interval = interval_ms / 1000 if interval_ms else self.default_interval
+            profile = Profile(mode, interval)
+            loop = asyncio.get_running_loop()
+            # The task waiting for the profile is left out of its own wall-clock samples
+            sampling = loop.run_in_executor(
+                None, self._sample, profile, min(seconds, self.max_seconds),
+                threading.get_ident(), loop, asyncio.current_task()
+            )
+        except BaseException:
+            self._lock.release()
+            raise
+        await sampling
+        return profile
+
+    def _sample(self, profile: Profile, seconds: float, thread_id: int, loop, waiting: asyncio.Task):
+        # Releases the lock itself: if the caller goes away, sampling still runs to the end
+        try:
+            self._sample_until(profile, seconds, thread_id, loop, waiting)
+        finally:
+            self._lock.release()
+
+    def _sample_until(self, profile: Profile, seconds: float, thread_id: int, loop, waiting: asyncio.Task):
+        labels: Dict[Any, str] = {}
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_at = started
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                idle = frame.f_code.co_filename.endswith(IDLE_FILES)
+                if not idle:
+                    profile.samples[_thread_stack(frame, labels)] += 1
+                elif profile.mode == "wall":
+                    profile.samples[("<idle>",)] += 1
+            del frame
+            if profile.mode == "wall":
+                running = asyncio.current_task(loop)
+                try:
+                    tasks = asyncio.all_tasks(loop)
+                except RuntimeError:
+                    # The task set changed under us too often; skip this sample
+                    tasks = set()
+                for task in tasks:
+                    if task is not running and task is not waiting:
+                        profile.samples[_await_stack(task, labels)] += 1
+            profile.sample_count += 1
+            next_at += profile.interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        profile.duration = time.perf_counter() - started
+
+
+def save_profile(profile: Profile, reason: str, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP) -> str:
+    """Write a speedscope file, keeping only the newest `keep`; returns its name"""
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r"[^a-z0-9]+", "-", reason.lower()).strip("-") or "manual"
+    name = f"profile-{profile.started_at.strftime('%Y%m%dT%H%M%S')}-{slug}.speedscope.json"
+    with open(os.path.join(directory, name), "wb") as output:
+        output.write(orjson.dumps(profile.speedscope(reason)))
+    saved = sorted(
+        (entry for entry in os.scandir(directory) if PROFILE_NAME.match(entry.name)),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in saved[:-keep]:
+        os.unlink(entry.path)
+    return name
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if PROFILE_NAME.match(entry.name):
+            stat = entry.stat()
+            profiles.append({
+                "name": entry.name, "size": stat.st_size,
+                "created_at": datetime.utcfromtimestamp(stat.st_mtime)
+            })
+    return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
+
+
+class SlowRequestTrigger:
+    """ASGI middleware that starts a wall-clock profile after a slow request to a watched path"""
+
+    def __init__(self, app, profiler: SamplingProfiler, paths: List[str] = PROFILE_TRIGGER_PATHS,
+                 threshold_ms: float = PROFILE_TRIGGER_MS, seconds: float = PROFILE_TRIGGER_SECONDS,
+                 cooldown: float = PROFILE_TRIGGER_COOLDOWN):
+        self.app = app
+        self.profiler = profiler
+        self.paths = paths
+        self.threshold_ms = threshold_ms
+        self.seconds = seconds
+        self.cooldown = cooldown
+        self._last_triggered = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    async def __call__(self, scope, receive, send):
+        if self.threshold_ms <= 0 or scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= self.threshold_ms:
+                self._trigger(scope["path"], elapsed_ms)
+
+    def _trigger(self, path: str, elapsed_ms: float):
+        now = time.monotonic()
+        if self.profiler.busy or now - self._last_triggered < self.cooldown:
+            return
+        self._last_triggered = now
+        logger.warning(f"{path} took {elapsed_ms:.0f} ms; profiling the next {self.seconds:g}s")
+        self._task = asyncio.get_running_loop().create_task(self._capture(path))
+
+    async def _capture(self, path: str):
+        try:
+            profile = await self.profiler.run(self.seconds, "wall")
+            name = await asyncio.to_thread(save_profile, profile, f"slow {path}")
+            logger.warning(f"Saved profile {name} ({profile.sample_count} samples)")
+        except ProfilerBusy:
+            pass
+        except Exception as e:
+            logger.error(f"Triggered profile failed: {str(e)}")
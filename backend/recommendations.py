@@ -0,0 +1,300 @@
+from pymongo.errors import DuplicateKeyError
+from outbox import OUTBOX_RETENTION_SECONDS
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Related products from co-purchases.
+#
+# The co-purchase matrix C is products x products, where C[i, j] counts the
+# paid orders that contain both i and j. A full build streams the product ids
+# of every paid order, in the orders collection and in its archive, into a sparse order x product incidence matrix B and
+# takes C = B.T @ B. After that, each newly paid order adds its pairs to a
+# pending batch. The batch is merged into C as one sparse addition, and only
+# the rows it touched have their top-k lists recomputed.
+#
+# Reads only look up precomputed lists and the in-memory catalog. A product with
+# too little co-purchase data is padded with products from its own category.
+#
+# Each worker keeps its own matrix, but an order.paid event is handled by only
+# one worker. The periodic full rebuild brings the other workers up to date.
+# Delivery is at-least-once, so the handler records each event id first and
+# skips an event it has already counted.
+# Under serve.py only worker 0 rebuilds. It saves the matrix next to the catalog
+# snapshot, and the other workers load it when it changes. Product data is then
+# read from the shared snapshot, so every worker sees catalog changes made in any
+# of them, and none keeps a copy of the catalog of its own.
+#
+# NumPy and SciPy are imported by the first build, which runs in a worker thread,
+# so they add nothing to import or startup time.
+
+RECS_TOP_K = int(os.environ.get('RECS_TOP_K', 8))
+RECS_MERGE_SECONDS = float(os.environ.get('RECS_MERGE_SECONDS', 5))
+RECS_REBUILD_SECONDS = float(os.environ.get('RECS_REBUILD_SECONDS', 60 * 60))
+RECS_RELOAD_SECONDS = float(os.environ.get('RECS_RELOAD_SECONDS', 30))
+RECS_MATRIX_FILE = "co-purchase.npz"
+
+
+def top_k_lists(matrix: "sparse.csr_matrix", rows: Iterable[int], k: int) -> Dict[int, "np.ndarray"]:
+    """Column indices of the k largest entries of each row, highest count first"""
+    import numpy as np
+    lists = {}
+    for row in rows:
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        counts = matrix.data[start:end]
+        columns = matrix.indices[start:end]
+        if len(counts) > k:
+            best = np.argpartition(-counts, k)[:k]
+            counts, columns = counts[best], columns[best]
+        # Ties are broken by column for a stable order
+        lists[row] = columns[np.lexsort((columns, -counts))]
+    return lists
+
+
+def co_purchase_matrix(baskets: List[List[int]], size: int) -> "sparse.csr_matrix":
+    """Co-occurrence counts of product indices across baskets, without the diagonal"""
+    import numpy as np
+    from scipy import sparse
+    rows = np.repeat(np.arange(len(baskets)), [len(b) for b in baskets])
+    columns = np.fromiter((c for basket in baskets for c in basket), dtype=np.int64, count=len(rows))
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(len(baskets), size)
+    )
+    matrix = (incidence.T @ incidence).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+class CoPurchaseRecommender:
+    def __init__(self, orders_collection, products_collection, archive_collection=None, events_collection=None,
+                 top_k: int = RECS_TOP_K, merge_seconds: float = RECS_MERGE_SECONDS,
+                 rebuild_seconds: float = RECS_REBUILD_SECONDS, snapshot_store=None, builder: bool = True):
+        self.orders = orders_collection
+        self.archive = archive_collection
+        self.events = events_collection
+        self.products_collection = products_collection
+        self.top_k = top_k
+        self.merge_seconds = merge_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.snapshot_store = snapshot_store
+        # Without a snapshot store every worker builds its own matrix
+        self.share_path = os.path.join(snapshot_store.directory, RECS_MATRIX_FILE) if snapshot_store else None
+        self.builder = builder or self.share_path is None
+        self._loaded_mtime: Optional[float] = None
+        self.stats = {"orders": 0, "merges": 0}
+        # product id <-> matrix row
+        self._index: Dict[int, int] = {}
+        self._ids: List[int] = []
+        self._matrix = None
+        self._related: Dict[int, List[int]] = {}
+        self._products: Dict[int, Dict[str, Any]] = {}
+        self._by_category: Dict[str, List[int]] = {}
+        self._pending: List[List[int]] = []
+        self._merge_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        if self.events is not None:
+            # Recorded event ids only need to outlive redelivery
+            await self.events.create_index("processed_at", expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+
+    def _row(self, product_id: int) -> int:
+        row = self._index.get(product_id)
+        if row is None:
+            row = self._index[product_id] = len(self._ids)
+            self._ids.append(product_id)
+        return row
+
+    async def load_catalog(self):
+        """Refresh the in-memory products used to answer requests; unused with a snapshot store"""
+        if self.snapshot_store is not None:
+            return
+        products = {p["id"]: p async for p in self.products_collection.find({}, {"_id": 0})}
+        by_category: Dict[str, List[int]] = {}
+        for product_id in sorted(products):
+            by_category.setdefault(products[product_id]["category"], []).append(product_id)
+        self._products, self._by_category = products, by_category
+
+    def catalog_changed(self, version: int):
+        """Catalog change listener; reloads the products in the background"""
+        asyncio.get_running_loop().create_task(self.load_catalog())
+
+    async def rebuild(self):
+        """Recompute the whole matrix from paid orders, archived ones included"""
+        await self.load_catalog()
+        index: Dict[int, int] = {}
+        ids: List[int] = []
+        baskets: List[List[int]] = []
+        projection = {"_id": 0, "id": 1, "items.product_id": 1}
+
+        def add(order: Dict[str, Any]):
+            basket = set()
+            for item in order.get("items", []):
+                row = index.get(item["product_id"])
+                if row is None:
+                    row = index[item["product_id"]] = len(ids)
+                    ids.append(item["product_id"])
+                basket.add(row)
+            if len(basket) > 1:
+                baskets.append(sorted(basket))
+
+        # An order being archived can be in both collections for a moment; the
+        # hot collection is the small one, so its ids are the ones remembered
+        recent = set()
+        async for order in self.orders.find({"status": "paid"}, projection):
+            recent.add(order.get("id"))
+            add(order)
+        if self.archive is not None:
+            async for order in self.archive.find({"status": "paid"}, projection):
+                if order.get("id") not in recent:
+                    add(order)
+
+        def compute() -> Tuple["sparse.csr_matrix", Dict[int, "np.ndarray"]]:
+            matrix = co_purchase_matrix(baskets, len(ids))
+            return matrix, top_k_lists(matrix, range(len(ids)), self.top_k)
+
+        matrix, lists = await asyncio.to_thread(compute)
+        self._install(index, ids, matrix, lists)
+        logger.info(f"Built co-purchase matrix: {len(ids)} products from {len(baskets)} orders, {matrix.nnz} pairs")
+        if self.share_path is not None:
+            await asyncio.to_thread(self._save, ids, matrix)
+
+    def _install(self, index: Dict[int, int], ids: List[int], matrix, lists: Dict[int, "np.ndarray"]):
+        self._index, self._ids, self._matrix = index, ids, matrix
+        self._related = {ids[row]: [ids[c] for c in columns] for row, columns in lists.items()}
+        # Orders paid during the rebuild may or may not be in it; dropping them
+        # risks undercounting rather than double counting
+        self._pending = []
+
+    def _save(self, ids: List[int], matrix):
+        import numpy as np
+        tmp_path = f"{self.share_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as output:
+            np.savez(output, ids=np.asarray(ids, dtype=np.int64), data=matrix.data,
+                     indices=matrix.indices, indptr=matrix.indptr, shape=np.asarray(matrix.shape))
+        os.replace(tmp_path, self.share_path)
+
+    async def reload(self):
+        """Load the matrix saved by the building worker, if it changed since the last load"""
+        try:
+            mtime = os.stat(self.share_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        def load():
+            import numpy as np
+            from scipy import sparse
+            with np.load(self.share_path) as saved:
+                ids = [int(product_id) for product_id in saved["ids"]]
+                matrix = sparse.csr_matrix(
+                    (saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"])
+                )
+            return ids, matrix, top_k_lists(matrix, range(len(ids)), self.top_k)
+
+        await self.load_catalog()
+        ids, matrix, lists = await asyncio.to_thread(load)
+        self._install({product_id: row for row, product_id in enumerate(ids)}, ids, matrix, lists)
+        self._loaded_mtime = mtime
+
+    async def record_order(self, event: Dict[str, Any]):
+        """order.paid outbox handler: queue the order's product pairs for the next merge"""
+        items = event["payload"].get("items", [])
+        if len({item["product_id"] for item in items}) < 2:
+            return
+        if self.events is not None:
+            try:
+                await self.events.insert_one({"_id": event["_id"], "processed_at": datetime.utcnow()})
+            except DuplicateKeyError:
+                return
+        basket = sorted({self._row(item["product_id"]) for item in items})
+        self._pending.append(basket)
+        self.stats["orders"] += 1
+        if self._merge_task is None or self._merge_task.done():
+            self._merge_task = asyncio.create_task(self._merge_later())
+
+    async def _merge_later(self):
+        await asyncio.sleep(self.merge_seconds)
+        self.merge()
+
+    def merge(self):
+        """Add the pending orders to the matrix and refresh the rows they touched"""
+        if self._matrix is None:
+            # Not built yet; the first build reads these orders itself
+            return
+        baskets, self._pending = self._pending, []
+        if not baskets:
+            return
+        size = len(self._ids)
+        matrix = self._matrix.copy()
+        matrix.resize((size, size))
+        matrix = matrix + co_purchase_matrix(baskets, size)
+        touched = {row for basket in baskets for row in basket}
+        lists = top_k_lists(matrix, touched, self.top_k)
+        self._matrix = matrix
+        for row, columns in lists.items():
+            self._related[self._ids[row]] = [self._ids[c] for c in columns]
+        self.stats["merges"] += 1
+
+    def related(self, product_id: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Related products, padded from the same category; None for an unknown product"""
+        view = self.snapshot_store.view() if self.snapshot_store is not None else None
+        lookup = view.get if view is not None else self._products.get
+        product = lookup(product_id)
+        if product is None:
+            return None
+        chosen: List[Dict[str, Any]] = []
+        seen = {product_id}
+        for candidate in self._related.get(product_id, []):
+            if len(chosen) >= limit:
+                break
+            # Skips products removed from the catalog since the last rebuild
+            related = lookup(candidate) if candidate not in seen else None
+            if related is not None:
+                chosen.append(related)
+                seen.add(candidate)
+        if len(chosen) < limit:
+            # At most the product itself and the ones already chosen are skipped
+            if view is not None:
+                padding = view.category(product["category"], limit + 1)
+            else:
+                padding = [self._products[p] for p in self._by_category.get(product["category"], [])[:limit + 1]]
+            for related in padding:
+                if len(chosen) >= limit:
+                    break
+                if related["id"] not in seen:
+                    chosen.append(related)
+                    seen.add(related["id"])
+        return chosen
+
+    async def _run(self):
+        while True:
+            try:
+                if self.builder:
+                    await self.rebuild()
+                else:
+                    await self.reload()
+            except Exception as e:
+                logger.error(f"Co-purchase {'rebuild' if self.builder else 'reload'} failed: {str(e)}")
+            await asyncio.sleep(self.rebuild_seconds if self.builder else RECS_RELOAD_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._merge_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._merge_task = None
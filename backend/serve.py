@@ -0,0 +1,124 @@
+"""
+Production entry point: pre-forks uvicorn workers that share one listening socket
+and one shared-memory catalog snapshot.
+
+    python serve.py --workers 4 --port 8001
+
+The parent only binds the socket, forks the workers and restarts any that die.
+It never opens a database connection, so nothing that is unsafe to fork is
+created before the workers exist. Every worker publishes the catalog at startup
+and after each catalog change, and all of them read the current snapshot.
+
+Each worker gets a WORKER_INDEX. Jobs that must run once per deployment (seeding,
+campaign delivery, payment reconciliation, archiving, the co-purchase rebuild)
+run only in worker 0. A restarted worker takes over the index of the one it
+replaces.
+
+X-Forwarded-For is only honoured from the proxies in FORWARDED_ALLOW_IPS
+(uvicorn's setting, 127.0.0.1 by default). Behind an ingress, set it to the
+ingress addresses; never to "*", which lets any client pick its own address.
+"""
+from pathlib import Path
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import uvicorn
+
+ROOT_DIR = Path(__file__).parent
+
+
+def _snapshot_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.mkdtemp(prefix="urban-catalog-", dir=base)
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, args: argparse.Namespace, index: int):
+    # Imports server (and with it the MongoDB client) only in the child
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.environ['WORKER_INDEX'] = str(index)
+    sys.path.insert(0, str(ROOT_DIR))
+    config = uvicorn.Config("server:app", proxy_headers=True, forwarded_allow_ips=args.forwarded_allow_ips,
+                            log_config=None, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(sock: socket.socket, args: argparse.Namespace, index: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(sock, args, index)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked workers")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', 8001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+                        help="comma-separated proxy addresses whose X-Forwarded-For is trusted")
+    args = parser.parse_args()
+
+    owns_snapshot_dir = not os.environ.get('CATALOG_SNAPSHOT_DIR')
+    snapshot_dir = os.environ.get('CATALOG_SNAPSHOT_DIR') or _snapshot_dir()
+    os.environ['CATALOG_SNAPSHOT_DIR'] = snapshot_dir
+    sock = _bind(args.host, args.port)
+    # pid -> worker index
+    workers = {_spawn(sock, args, index): index for index in range(args.workers)}
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers (catalog snapshot in {snapshot_dir})")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = workers.pop(pid, None)
+            if not stopping and index is not None:
+                print(f"Worker {pid} exited with status {status}; restarting")
+                time.sleep(1)  # don't spin if workers die at startup
+                workers[_spawn(sock, args, index)] = index
+    finally:
+        sock.close()
+        if owns_snapshot_dir:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,109 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request, Header, Query, Path as PathParam
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse, FileResponse, PlainTextResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 import os
 import logging
-from pathlib import Path
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 # Import models and database
 from models import *
 from database import *
-from email_service import send_custom_order_notification, send_order_confirmation
+import database
 from payment_models import CheckoutRequest, CheckoutStatusRequest
-from stripe_service import stripe_service
+from stripe_service import stripe_service, PENDING_TRANSACTION_STATUSES
+from idempotency import IdempotencyStore
+from payment_reconciler import PaymentReconciler
+from order_expiry import AbandonedOrderSweeper
+from write_buffer import InsertBuffer
+from newsletter_io import detect_format, import_subscribers, export_subscribers
+from campaigns import CampaignRunner
+from design_storage import ContentAddressedStore, receive_multipart
+from preview_renderer import PreviewRenderer
+from inventory import inventory_service, OutOfStockError, SizeRequiredError
+from cart import CartService
+from admission import AdmissionControlMiddleware, RouteLimit
+from catalog_snapshot import store_from_env
+from static_catalog import publisher_from_env
+from fieldsets import parse_fields, projection, select, sparse_response
+from logging_setup import configure_logging, shutdown_logging
+from recommendations import CoPurchaseRecommender, RECS_TOP_K
+from archive import ArchiveJob, ArchiveTier
+from order_history import list_customer_orders, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from catalog import CatalogService
+from storefront import StorefrontService, STOREFRONT_PER_CATEGORY, STOREFRONT_MAX_PER_CATEGORY
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from outbox import outbox, outbox_event, OutboxDispatcher
+from outbox_handlers import register_handlers, ensure_indexes as ensure_handler_indexes
+from admin_auth import require_admin
+from profiling import (
+    SamplingProfiler, SlowRequestTrigger, ProfilerBusy, PROFILE_DIR, PROFILE_MAX_SECONDS, PROFILE_NAME,
+    list_profiles
+)
+import asyncio
+import itertools
+import uuid
+
+idempotency_store = IdempotencyStore(idempotency_collection)
+newsletter_buffer = InsertBuffer(newsletter_collection)
+campaign_runner = CampaignRunner(campaigns_collection, newsletter_collection)
+design_store = ContentAddressedStore()
+preview_renderer = PreviewRenderer()
+cart_service = CartService(carts_collection, products_collection)
+archive_job = ArchiveJob(db, [
+    ArchiveTier("orders", orders_collection, orders_archive_collection, "id", ["paid", "expired"],
+                indexes=([("customer_email", 1), ("created_at", -1), ("id", -1)],)),
+    ArchiveTier("payment_transactions", db.payment_transactions, payment_transactions_archive_collection,
+                "session_id", ["completed", "expired"]),
+])
+# serve.py numbers its workers; jobs that must run once per deployment only run in
+# worker 0, which is also the only process when the app is run without serve.py
+PRIMARY_WORKER = os.environ.get('WORKER_INDEX', '0') == '0'
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+catalog_service = CatalogService(products_collection, counters_collection, meta_collection)
+# Shared-memory catalog, only when running under serve.py
+catalog_snapshot = store_from_env()
+if catalog_snapshot is not None:
+    catalog_service.publish_on_change(catalog_snapshot)
+# Versioned static JSON for CDN hosting, only when STATIC_CATALOG_DIR is set
+static_catalog = publisher_from_env()
+if static_catalog is not None:
+    catalog_service.publish_on_change(static_catalog)
+storefront_service = StorefrontService(products_collection, catalog_service, catalog_snapshot)
+recommender = CoPurchaseRecommender(
+    orders_collection, products_collection, orders_archive_collection, recommendation_events_collection,
+    snapshot_store=catalog_snapshot, builder=PRIMARY_WORKER
+)
+catalog_service.on_change(recommender.catalog_changed)
+outbox_dispatcher = OutboxDispatcher(outbox_collection)
+register_handlers(outbox_dispatcher)
+outbox_dispatcher.register("order.paid", recommender.record_order, name="update_recommendations")
+outbox.on_enqueue(outbox_dispatcher.wake)
+payment_reconciler = PaymentReconciler(
+    stripe_service, db.payment_transactions, PENDING_TRANSACTION_STATUSES
+)
+abandoned_orders = AbandonedOrderSweeper(orders_collection)
+profiler = SamplingProfiler()
 
 # Create the main app without a prefix
-app = FastAPI(title="Urban Threads API", version="1.0.0")
+app = FastAPI(title="Urban Threads API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Starts a profile when a watched request is slower than PROFILE_TRIGGER_MS (off by default)
+app.add_middleware(SlowRequestTrigger, profiler=profiler)
+
+# Admission control for write endpoints; added before CORS so that rejections still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware, limits=[
+    RouteLimit("POST", "/api/orders", max_concurrent=32, max_queue=64),
+    RouteLimit("POST", "/api/checkout/create-session", max_concurrent=32, max_queue=64),
+    RouteLimit("POST", "/api/custom-orders", max_concurrent=8, max_queue=16, rate=0.5, burst=3),
+    RouteLimit("POST", "/api/newsletter/subscribe", max_concurrent=32, max_queue=64, rate=1, burst=5),
+])
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,31 +116,103 @@ app.add_middleware(
 # Initialize database with products on startup
 @app.on_event("startup")
 async def startup_event():
-    await init_products()
+    # Independent steps run concurrently, so a cold start costs roughly one
+    # round of index checks rather than the sum of them
+    async def prepare_catalog():
+        if PRIMARY_WORKER:
+            await catalog_service.apply_seed()
+        await catalog_service.ensure_indexes()
+        await recommender.load_catalog()
+        if catalog_snapshot is not None:
+            await catalog_service.publish_snapshot(catalog_snapshot, await catalog_service.get_version())
+        if static_catalog is not None and PRIMARY_WORKER:
+            await catalog_service.publish_snapshot(static_catalog, await catalog_service.get_version())
+
+    async def prepare_campaigns():
+        await campaign_runner.ensure_indexes()
+        if PRIMARY_WORKER:
+            # Delivering from two workers would email subscribers twice
+            await campaign_runner.resume_interrupted()
+
+    async def prepare_inventory():
+        await inventory_service.ensure_indexes()
+        await inventory_service.load_shard_counts()
+
+    await asyncio.gather(
+        prepare_catalog(),
+        prepare_campaigns(),
+        prepare_inventory(),
+        init_indexes(),
+        idempotency_store.ensure_indexes(),
+        payment_reconciler.ensure_indexes(),
+        abandoned_orders.ensure_indexes(),
+        cart_service.ensure_indexes(),
+        outbox.ensure_indexes(),
+        ensure_handler_indexes(),
+        recommender.ensure_indexes(),
+        archive_job.ensure_indexes(),
+    )
+    if PRIMARY_WORKER:
+        payment_reconciler.start()
+        abandoned_orders.start()
+        archive_job.start()
+    # Builds (or, in other workers, loads) the co-purchase matrix in the background;
+    # related products fall back to the same category until it is ready
+    recommender.start()
+    outbox_dispatcher.start()
 
 # Health check
 @api_router.get("/")
 async def root():
     return {"message": "Urban Threads API is running"}
 
+# Comma-separated subset of fields to return, e.g. fields=id,name,price,image
+FIELDS_QUERY = Query(None, max_length=256, description="Comma-separated fields to include")
+
+# Read endpoints project exactly the response model's fields and hand the
+# documents straight to orjson, skipping a pydantic validation pass
+PRODUCT_PROJECTION = projection(frozenset(Product.model_fields))
+ORDER_PROJECTION = projection(frozenset(Order.model_fields))
+
+def _product_list_response(products: List[dict], fields):
+    if fields is None:
+        return ORJSONResponse(products)
+    return sparse_response(Product, fields, products)
+
 # Products endpoints
 @api_router.get("/products", response_model=List[Product])
-async def get_all_products():
+async def get_all_products(fields: Optional[str] = FIELDS_QUERY):
     """Get all products"""
+    field_set = parse_fields(fields, Product)
     try:
-        products = await products_collection.find({}, {"_id": 0}).to_list(1000)
-        return products
+        view = catalog_snapshot.view() if catalog_snapshot else None
+        if view is not None:
+            products = list(itertools.islice(view.products(), 1000))
+            if field_set is not None:
+                products = [select(product, field_set) for product in products]
+        else:
+            products = await products_collection.find(
+                {}, projection(field_set) if field_set else PRODUCT_PROJECTION
+            ).to_list(1000)
+        return _product_list_response(products, field_set)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/products/category/{category}", response_model=List[Product])
-async def get_products_by_category(category: str):
+async def get_products_by_category(category: str, fields: Optional[str] = FIELDS_QUERY):
     """Get products by category"""
+    field_set = parse_fields(fields, Product)
     try:
-        products = await products_collection.find(
-            {"category": category}, {"_id": 0}
-        ).to_list(1000)
-        return products
+        view = catalog_snapshot.view() if catalog_snapshot else None
+        if view is not None:
+            products = view.category(category)[:1000]
+            if field_set is not None:
+                products = [select(product, field_set) for product in products]
+        else:
+            products = await products_collection.find(
+                {"category": category}, projection(field_set) if field_set else PRODUCT_PROJECTION
+            ).to_list(1000)
+        return _product_list_response(products, field_set)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -67,55 +220,202 @@ async def get_products_by_category(category: str):
 async def get_product(product_id: int):
     """Get single product by ID"""
     try:
-        product = await products_collection.find_one(
-            {"id": product_id}, {"_id": 0}
-        )
+        view = catalog_snapshot.view() if catalog_snapshot else None
+        if view is not None:
+            product = view.get(product_id)
+        else:
+            product = await products_collection.find_one(
+                {"id": product_id}, PRODUCT_PROJECTION
+            )
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
-        return product
+        return ORJSONResponse(product)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(product_id: int, limit: int = Query(RECS_TOP_K, ge=1, le=50)):
+    """Get products often bought together with this one"""
+    related = recommender.related(product_id, limit)
+    if related is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return ORJSONResponse(related)
+
+@api_router.post("/products", response_model=Product, status_code=201, dependencies=[Depends(require_admin)])
+async def create_product(product_data: ProductCreate):
+    """Add a product to the catalog (admin endpoint)"""
+    try:
+        return await catalog_service.create(product_data.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A product with this SKU already exists")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/products/bulk", response_model=CatalogBulkResult, dependencies=[Depends(require_admin)])
+async def bulk_upsert_products(products: List[ProductUpsert]):
+    """Insert or update many products at once, e.g. from a supplier feed (admin endpoint)"""
+    try:
+        return await catalog_service.bulk_upsert([product.model_dump() for product in products])
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        raise HTTPException(
+            status_code=409,
+            detail=f"{len(errors)} products were rejected; the rest were saved. First error: {errors[0]['errmsg'] if errors else ''}"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.put("/products/{product_id}", response_model=Product, dependencies=[Depends(require_admin)])
+async def update_product(product_id: int, product_data: ProductUpdate):
+    """Update some fields of a product (admin endpoint)"""
+    try:
+        product = await catalog_service.update(product_id, product_data.model_dump(exclude_unset=True))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A product with this SKU already exists")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+@api_router.delete("/products/{product_id}", dependencies=[Depends(require_admin)])
+async def delete_product(product_id: int):
+    """Remove a product from the catalog (admin endpoint)"""
+    try:
+        deleted = await catalog_service.delete(product_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return MessageResponse(message="Product deleted")
+
+@api_router.get("/catalog/version", response_model=CatalogVersion)
+async def get_catalog_version():
+    """Current catalog version; it changes whenever a product is added, changed or removed"""
+    try:
+        return {"version": await catalog_service.get_version()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/storefront", response_model=Storefront)
+async def get_storefront(
+    request: Request,
+    per_category: int = Query(STOREFRONT_PER_CATEGORY, ge=1, le=STOREFRONT_MAX_PER_CATEGORY)
+):
+    """Home page bundle: the first products of every category, category counts and price bounds"""
+    try:
+        version, body = await storefront_service.get(per_category)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Revalidated on every load; unchanged until the catalog version moves
+    headers = {"ETag": f'"storefront-{version}-{per_category}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Orders endpoints
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate):
+async def create_order(
+    order_data: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Create a new order"""
+    return ORJSONResponse(await idempotency_store.run(
+        "orders", idempotency_key, order_data, lambda: _create_order(order_data)
+    ))
+
+async def _create_order(order_data: OrderCreate) -> dict:
+    # The validated items are passed through as models rather than dumped and re-validated
+    order = Order(**dict(order_data))
+    order_dict = order.model_dump()
+    response = dict(order_dict)
+
+    # Reserve stock for every line before the order exists; released if the payment expires
     try:
-        order = Order(**order_data.dict())
-        order_dict = order.dict()
-        
-        # Store in database
-        await orders_collection.insert_one(order_dict)
-        
-        # Send confirmation email
-        await send_order_confirmation(order_dict)
-        
-        return order
+        order_dict["reservations"] = await inventory_service.reserve(order_dict["items"])
+    except OutOfStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except SizeRequiredError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        # Store the order together with the event that sends its confirmation email
+        event = outbox_event("order.created", dict(order_dict))
+
+        async def store(session):
+            await orders_collection.insert_one(order_dict, session=session)
+            await outbox.enqueue([event], session=session)
+
+        try:
+            await outbox.transaction(store)
+        except Exception:
+            await inventory_service.release(order_dict["reservations"])
+            raise
+
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/orders", response_model=OrderHistoryPage, dependencies=[Depends(require_admin)])
+async def get_customer_orders(
+    customer_email: str = Query(..., min_length=3, max_length=254),
+    status: Optional[str] = Query(None, max_length=32),
+    cursor: Optional[str] = Query(None, max_length=512),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Get a customer's orders, newest first, one page at a time (support endpoint)"""
+    try:
+        return ORJSONResponse(await list_customer_orders(
+            orders_collection, customer_email, status, cursor, limit, orders_archive_collection
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/orders/{order_id}", response_model=Order)
-async def get_order(order_id: str):
+async def get_order(order_id: str, fields: Optional[str] = FIELDS_QUERY):
     """Get order by ID"""
+    field_set = parse_fields(fields, Order)
     try:
+        order_projection = projection(field_set) if field_set else ORDER_PROJECTION
         order = await orders_collection.find_one(
-            {"id": order_id}, {"_id": 0}
+            {"id": order_id}, order_projection
         )
+        if not order:
+            # Old finished orders are moved to the archive
+            order = await orders_archive_collection.find_one({"id": order_id}, order_projection)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
-        return order
+        if field_set is not None:
+            return sparse_response(Order, field_set, order)
+        return ORJSONResponse(order)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Stripe Checkout endpoints
 @api_router.post("/checkout/create-session")
-async def create_checkout_session(request: Request, checkout_data: CheckoutRequest):
+async def create_checkout_session(
+    request: Request,
+    checkout_data: CheckoutRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Create Stripe checkout session"""
     base_url = str(request.base_url)
-    return await stripe_service.create_checkout_session(
-        order_id=checkout_data.order_id,
-        customer_email=checkout_data.customer_email,
-        origin_url=checkout_data.origin_url
+    return await idempotency_store.run(
+        "checkout", idempotency_key, checkout_data,
+        lambda: stripe_service.create_checkout_session(
+            order_id=checkout_data.order_id,
+            customer_email=checkout_data.customer_email,
+            origin_url=checkout_data.origin_url
+        )
     )
 
 @api_router.get("/checkout/status/{session_id}")
@@ -137,22 +437,137 @@ async def stripe_webhook(request: Request):
     
     return await stripe_service.handle_webhook(body, stripe_signature, base_url)
 
+# Cart endpoints
+CART_ID_PATTERN = r"^[A-Za-z0-9-]{8,64}$"
+CART_SIZE_PATTERN = r"^[A-Za-z0-9 _-]+$"
+
+@api_router.post("/cart", response_model=Cart)
+async def create_cart():
+    """Allocate a new cart id; the cart is stored when the first item is added"""
+    return Cart(id=str(uuid.uuid4()))
+
+@api_router.get("/cart/{cart_id}", response_model=Cart)
+async def get_cart(cart_id: str = PathParam(..., pattern=CART_ID_PATTERN)):
+    """Get a cart"""
+    cart = await cart_service.get(cart_id)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return cart
+
+@api_router.post("/cart/{cart_id}/items", response_model=Cart)
+async def add_cart_item(item: CartItemAdd, cart_id: str = PathParam(..., pattern=CART_ID_PATTERN)):
+    """Add an item to a cart, creating the cart if needed"""
+    try:
+        cart = await cart_service.add_item(cart_id, item.product_id, item.size, item.quantity)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not cart:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return cart
+
+@api_router.put("/cart/{cart_id}/items/{product_id}", response_model=Cart)
+async def update_cart_item(
+    product_id: int,
+    update: CartItemUpdate,
+    cart_id: str = PathParam(..., pattern=CART_ID_PATTERN),
+    size: Optional[str] = Query(None, max_length=16, pattern=CART_SIZE_PATTERN)
+):
+    """Set the quantity of a cart item; zero removes it"""
+    cart = await cart_service.set_quantity(cart_id, product_id, size, update.quantity)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart item not found")
+    return cart
+
+@api_router.delete("/cart/{cart_id}/items/{product_id}", response_model=Cart)
+async def remove_cart_item(
+    product_id: int,
+    cart_id: str = PathParam(..., pattern=CART_ID_PATTERN),
+    size: Optional[str] = Query(None, max_length=16, pattern=CART_SIZE_PATTERN)
+):
+    """Remove an item from a cart"""
+    cart = await cart_service.remove_item(cart_id, product_id, size)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return cart
+
+@api_router.delete("/cart/{cart_id}", response_model=MessageResponse)
+async def delete_cart(cart_id: str = PathParam(..., pattern=CART_ID_PATTERN)):
+    """Delete a cart"""
+    if not await cart_service.delete(cart_id):
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return MessageResponse(message="Cart deleted")
+
+@api_router.post("/cart/{cart_id}/validate", response_model=CartValidation)
+async def validate_cart(cart_id: str = PathParam(..., pattern=CART_ID_PATTERN)):
+    """Re-price a cart against the catalog before checkout"""
+    result = await cart_service.validate(cart_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return result
+
+# Inventory endpoints
+@api_router.get("/inventory/{product_id}", response_model=List[InventoryLevel])
+async def get_inventory(product_id: int):
+    """Get available stock per size for a product"""
+    try:
+        return await inventory_service.get_stock(product_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.put("/inventory/{product_id}", response_model=InventoryLevel, dependencies=[Depends(require_admin)])
+async def set_inventory(product_id: int, update: InventoryUpdate):
+    """Set available stock for a product size (admin endpoint)"""
+    try:
+        return await inventory_service.set_stock(product_id, update.size, update.quantity, update.shards)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Custom orders endpoints
+async def discard_design(stored_file):
+    """Remove the design file of a custom order that was not saved"""
+    if stored_file is not None:
+        await asyncio.to_thread(design_store.discard, stored_file)
+
 @api_router.post("/custom-orders", response_model=CustomOrder)
-async def create_custom_order(custom_order_data: CustomOrderCreate):
-    """Submit a custom t-shirt design order"""
+async def create_custom_order(request: Request):
+    """Submit a custom t-shirt design order as JSON or as multipart/form-data with a design file"""
+    stored_file = None
     try:
-        custom_order = CustomOrder(**custom_order_data.dict())
-        custom_order_dict = custom_order.dict()
-        
-        # Store in database
-        await custom_orders_collection.insert_one(custom_order_dict)
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            fields, stored_file = await receive_multipart(request, design_store)
+        elif request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+            fields = dict(await request.form())
+        else:
+            fields = await request.json()
+        custom_order_data = CustomOrderCreate(**fields)
+    except ValidationError as e:
+        await discard_design(stored_file)
+        raise RequestValidationError(e.errors())
+    except (ValueError, TypeError):
+        await discard_design(stored_file)
+        raise HTTPException(status_code=400, detail="Invalid request body")
+
+    try:
+        custom_order = CustomOrder(**dict(custom_order_data))
+        if stored_file is not None:
+            custom_order.file_name = custom_order.file_name or stored_file.filename
+            custom_order.file_sha256 = stored_file.sha256
+            custom_order.file_size = stored_file.size
+            custom_order.file_content_type = stored_file.content_type
+        custom_order_dict = custom_order.model_dump()
         
-        # Send email notification
-        await send_custom_order_notification(custom_order_dict)
+        # Store the order together with the event that sends its notification email
+        event = outbox_event("custom_order.created", dict(custom_order_dict))
+
+        async def store(session):
+            await custom_orders_collection.insert_one(custom_order_dict, session=session)
+            await outbox.enqueue([event], session=session)
+
+        await outbox.transaction(store)
         
         return custom_order
     except Exception as e:
+        await discard_design(stored_file)
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/custom-orders", response_model=List[CustomOrder])
@@ -164,19 +579,45 @@ async def get_custom_orders():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/custom-orders/{order_id}/preview")
+async def get_custom_order_preview(request: Request, order_id: str, template: str = Query("white")):
+    """Render the custom design onto a shirt template as a PNG preview"""
+    custom_order = await custom_orders_collection.find_one(
+        {"id": order_id}, {"_id": 0, "custom_text": 1, "file_sha256": 1}
+    )
+    if not custom_order:
+        raise HTTPException(status_code=404, detail="Custom order not found")
+
+    design_sha256 = custom_order.get("file_sha256")
+    design_path = str(design_store.path_for(design_sha256)) if design_sha256 else None
+    try:
+        key, png = await preview_renderer.get_preview(
+            template, custom_order.get("custom_text"), design_sha256, design_path
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render preview: {str(e)}")
+
+    headers = {"ETag": f'"{key}"', "Cache-Control": "private, max-age=86400"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=png, media_type="image/png", headers=headers)
+
 # Newsletter endpoints
 @api_router.post("/newsletter/subscribe", response_model=MessageResponse)
 async def subscribe_newsletter(subscriber: NewsletterSubscribe):
     """Subscribe to newsletter"""
     try:
-        # Check if email already exists
-        existing = await newsletter_collection.find_one({"email": subscriber.email})
-        if existing:
-            raise HTTPException(status_code=400, detail="Email already subscribed")
-        
-        # Create new subscriber
+        # Create new subscriber; inserts are batched and the unique email index rejects duplicates
         new_subscriber = NewsletterSubscriber(email=subscriber.email)
-        await newsletter_collection.insert_one(new_subscriber.dict())
+        if not database.newsletter_email_unique and await newsletter_collection.find_one(
+            {"email": new_subscriber.email}, {"_id": 1}
+        ):
+            raise HTTPException(status_code=400, detail="Email already subscribed")
+        inserted = await newsletter_buffer.submit(new_subscriber.model_dump())
+        if not inserted:
+            raise HTTPException(status_code=400, detail="Email already subscribed")
         
         return MessageResponse(message="Successfully subscribed to newsletter")
     except HTTPException:
@@ -193,16 +634,115 @@ async def get_newsletter_subscribers():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/newsletter/import", response_model=NewsletterImportReport, dependencies=[Depends(require_admin)])
+async def import_newsletter_subscribers(request: Request, format: Optional[str] = Query(None)):
+    """Bulk import subscribers from a streamed CSV or NDJSON request body (admin endpoint)"""
+    try:
+        fmt = detect_format(format, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        report = await import_subscribers(newsletter_collection, request.stream(), fmt)
+        return NewsletterImportReport(**report)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/newsletter/export", dependencies=[Depends(require_admin)])
+async def export_newsletter_subscribers(format: str = Query("csv")):
+    """Stream all subscribers as CSV or NDJSON (admin endpoint)"""
+    try:
+        fmt = detect_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_subscribers(newsletter_collection, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="newsletter_subscribers.{fmt}"'}
+    )
+
+# Newsletter campaign endpoints
+@api_router.post("/campaigns", response_model=Campaign, dependencies=[Depends(require_admin)])
+async def create_campaign(campaign_data: CampaignCreate):
+    """Create a newsletter campaign and start delivering it (admin endpoint)"""
+    try:
+        campaign = Campaign(**dict(campaign_data))
+        await campaigns_collection.insert_one(campaign.model_dump())
+        campaign_runner.start(campaign.id)
+        return campaign
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/campaigns/{campaign_id}", response_model=Campaign)
+async def get_campaign(campaign_id: str):
+    """Get campaign delivery progress (admin endpoint)"""
+    campaign = await campaigns_collection.find_one({"id": campaign_id}, {"_id": 0})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
+
+@api_router.post("/campaigns/{campaign_id}/resume", response_model=MessageResponse, dependencies=[Depends(require_admin)])
+async def resume_campaign(campaign_id: str):
+    """Resume a failed or interrupted campaign from its checkpoint (admin endpoint)"""
+    campaign = await campaigns_collection.find_one({"id": campaign_id}, {"status": 1})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if campaign["status"] == "completed":
+        raise HTTPException(status_code=400, detail="Campaign already completed")
+    if not campaign_runner.start(campaign_id):
+        return MessageResponse(message="Campaign is already running")
+    return MessageResponse(message="Campaign resumed")
+
+# Profiling endpoints
+@api_router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def run_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    mode: str = Query("cpu", pattern="^(cpu|wall)$"),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$"),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000)
+):
+    """Sample this worker for `seconds` and return collapsed stacks or a speedscope file (admin endpoint)"""
+    try:
+        profile = await profiler.run(seconds, mode, interval_ms)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    filename = f"profile-{profile.started_at.strftime('%Y%m%dT%H%M%S')}-{mode}.speedscope.json"
+    return ORJSONResponse(
+        profile.speedscope(f"{mode} profile"),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/admin/profiles", response_model=List[SavedProfile], dependencies=[Depends(require_admin)])
+async def get_saved_profiles():
+    """Profiles captured after slow requests, newest first (admin endpoint)"""
+    return await asyncio.to_thread(list_profiles)
+
+@api_router.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def download_saved_profile(name: str):
+    """Download a captured speedscope file (admin endpoint)"""
+    path = os.path.join(PROFILE_DIR, name)
+    if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
+
 # Include the router in the main app
 app.include_router(api_router)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging; records are written by a background thread
+configure_logging()
 logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await payment_reconciler.stop()
+    await abandoned_orders.stop()
+    await outbox_dispatcher.stop()
+    await recommender.stop()
+    await archive_job.stop()
+    await newsletter_buffer.close()
+    await campaign_runner.stop()
+    preview_renderer.shutdown()
+    client.close()
+    shutdown_logging()
\ No newline at end of file
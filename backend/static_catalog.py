@@ -0,0 +1,202 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import fcntl
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+import orjson
+
+from models import Product
+
+# Static catalog published as files, for serving from a CDN or static host.
+#
+# After every catalog change the whole catalog is written to a new directory
+# named after the catalog version:
+#
+#   v<version>/products.json               every product, in id order
+#   v<version>/categories/<slug>.json      the products of one category
+#   v<version>/products/<id>.json          one product
+#
+# Each file also gets a gzip twin (.json.gz) for hosts that serve precompressed
+# files. The directory is built under a temporary name and renamed into place,
+# so it is complete or absent. Then manifest.json, the only mutable file, is
+# replaced atomically to point at it. Clients fetch the manifest (no-cache) and
+# then versioned files that never change (cached forever). A client therefore
+# sees either the old catalog or the new one, never a mix. Older versions are
+# kept for a while for clients still holding the previous manifest.
+#
+# Most changes touch a few products, so a product file whose content is unchanged
+# since the previous version is hard-linked from it instead of being written and
+# compressed again. Each version directory records a digest per product file in
+# .digests.json for that comparison.
+#
+# Category names that reduce to the same slug ("T-Shirts", "t shirts") get a
+# numbered suffix in the order of their names; the manifest maps each name to
+# its file.
+#
+# Every worker publishes after its own catalog changes. A lock and a version check
+# on the manifest keep an older version from replacing a newer one.
+
+STATIC_CATALOG_DIR = os.environ.get('STATIC_CATALOG_DIR')
+STATIC_CATALOG_KEEP = int(os.environ.get('STATIC_CATALOG_KEEP', 3))
+
+MANIFEST = "manifest.json"
+DIGESTS = ".digests.json"
+VERSION_DIR = re.compile(r"^v(\d+)$")
+# Cache rules for Netlify and Cloudflare Pages when the directory is deployed as is
+HEADERS = (
+    "/manifest.json\n"
+    "  Cache-Control: public, max-age=0, must-revalidate\n"
+    "/v*\n"
+    "  Cache-Control: public, max-age=31536000, immutable\n"
+)
+
+
+def category_slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "uncategorized"
+
+
+class StaticCatalogPublisher:
+    """Publishes the catalog as versioned static JSON behind an atomically swapped manifest"""
+
+    def __init__(self, directory: str, keep: int = STATIC_CATALOG_KEEP):
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self._manifest_path = os.path.join(directory, MANIFEST)
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._manifest_path, "rb") as manifest:
+                return orjson.loads(manifest.read())
+        except FileNotFoundError:
+            return None
+
+    def published_version(self) -> int:
+        manifest = self.manifest()
+        return manifest["version"] if manifest else 0
+
+    def _digests(self, version_dir: str) -> Dict[str, str]:
+        try:
+            with open(os.path.join(version_dir, DIGESTS), "rb") as digests:
+                return orjson.loads(digests.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return {}
+
+    def _link(self, source_root: str, root: str, relative: str) -> bool:
+        """Hard-link a file and its gzip twin from another version directory"""
+        try:
+            for suffix in ("", ".gz"):
+                os.link(os.path.join(source_root, relative + suffix), os.path.join(root, relative + suffix))
+        except OSError:
+            # Missing in the previous version, or no hard links on this filesystem
+            for suffix in ("", ".gz"):
+                try:
+                    os.unlink(os.path.join(root, relative + suffix))
+                except FileNotFoundError:
+                    pass
+            return False
+        return True
+
+    def _write(self, root: str, relative: str, data: bytes):
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as output:
+            output.write(data)
+        # mtime=0 keeps the compressed bytes identical across workers and republishes
+        with open(path + ".gz", "wb") as output:
+            output.write(gzip.compress(data, 9, mtime=0))
+
+    def _build(self, products: List[Dict[str, Any]], version: int,
+               previous: Optional[int] = None) -> Dict[str, Any]:
+        """Write the version directory in place; returns the manifest that points at it"""
+        fields = list(Product.model_fields)
+        products = sorted(
+            ({name: product[name] for name in fields if name in product} for product in products),
+            key=lambda product: product["id"]
+        )
+        previous_dir = os.path.join(self.directory, f"v{previous}") if previous is not None else None
+        previous_digests = self._digests(previous_dir) if previous_dir else {}
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=f".v{version}-")
+        try:
+            os.makedirs(os.path.join(staging, "products"))
+            by_category: Dict[str, List[Dict[str, Any]]] = {}
+            digests: Dict[str, str] = {}
+            for product in products:
+                by_category.setdefault(product["category"], []).append(product)
+                path = f"products/{product['id']}.json"
+                data = orjson.dumps(product)
+                digest = digests[path] = hashlib.blake2b(data, digest_size=16).hexdigest()
+                if previous_digests.get(path) != digest or not self._link(previous_dir, staging, path):
+                    self._write(staging, path, data)
+            with open(os.path.join(staging, DIGESTS), "wb") as output:
+                output.write(orjson.dumps(digests))
+            self._write(staging, "products.json", orjson.dumps(products))
+            categories = {}
+            slugs = set()
+            for name in sorted(by_category):
+                slug = base = category_slug(name)
+                suffix = 1
+                while slug in slugs:
+                    suffix += 1
+                    slug = f"{base}-{suffix}"
+                slugs.add(slug)
+                path = f"categories/{slug}.json"
+                self._write(staging, path, orjson.dumps(by_category[name]))
+                categories[name] = {"path": f"v{version}/{path}", "count": len(by_category[name])}
+            os.chmod(staging, 0o755)
+            try:
+                os.rename(staging, os.path.join(self.directory, f"v{version}"))
+            except OSError:
+                # Another worker already published this version
+                shutil.rmtree(staging, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return {
+            "version": version,
+            "published_at": datetime.utcnow().isoformat(),
+            "product_count": len(products),
+            "products": f"v{version}/products.json",
+            "product": f"v{version}/products/{{id}}.json",
+            "categories": categories,
+        }
+
+    def publish(self, products: List[Dict[str, Any]], catalog_version: int) -> bool:
+        """Write a catalog version and point the manifest at it unless a newer one is already published"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            # Serializes publishers in different workers
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = self.manifest()
+            if current is not None and current["version"] >= catalog_version:
+                return False
+            manifest = self._build(products, catalog_version, current["version"] if current else None)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".manifest-")
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self._manifest_path)
+
+            headers_path = os.path.join(self.directory, "_headers")
+            if not os.path.exists(headers_path):
+                with open(headers_path, "w") as headers:
+                    headers.write(HEADERS)
+            self._prune(catalog_version)
+        return True
+
+    def _prune(self, current: int):
+        versions = sorted(
+            int(match.group(1)) for match in map(VERSION_DIR.match, os.listdir(self.directory)) if match
+        )
+        for version in versions[:-self.keep]:
+            if version != current:
+                shutil.rmtree(os.path.join(self.directory, f"v{version}"), ignore_errors=True)
+
+
+def publisher_from_env() -> Optional[StaticCatalogPublisher]:
+    """The static publisher when STATIC_CATALOG_DIR is set, else None"""
+    return StaticCatalogPublisher(STATIC_CATALOG_DIR) if STATIC_CATALOG_DIR else None
@@ -0,0 +1,101 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+import orjson
+
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+# Storefront bundle: everything the home page shows, in one response.
+#
+# A single $facet aggregation over the products returns, for each category, the
+# first products in catalog (id) order, its product count and price bounds, and
+# the count and price bounds of the whole catalog. The result is serialized once
+# and cached under the catalog version it was built from. Every product change
+# bumps that version, so a cached bundle is never served after the catalog has
+# moved on. A request only has to read the current version: from the shared
+# snapshot when serve.py runs the workers (an 8-byte read), else from the meta
+# collection.
+#
+# Concurrent misses for the same bundle share one aggregation.
+
+STOREFRONT_PER_CATEGORY = int(os.environ.get('STOREFRONT_PER_CATEGORY', 8))
+STOREFRONT_MAX_PER_CATEGORY = int(os.environ.get('STOREFRONT_MAX_PER_CATEGORY', 24))
+
+PRODUCT_FIELDS = {name: f"${name}" for name in Product.model_fields}
+PRICE_BOUNDS = {"min_price": {"$min": "$price"}, "max_price": {"$max": "$price"}}
+
+
+def storefront_pipeline(per_category: int) -> List[Dict[str, Any]]:
+    return [
+        # $firstN keeps this order, so each category's list holds its lowest ids
+        {"$sort": {"id": 1}},
+        {"$facet": {
+            "categories": [
+                # Only per_category products are ever held per group (MongoDB 5.2+)
+                {"$group": {"_id": "$category", "count": {"$sum": 1}, **PRICE_BOUNDS,
+                            "products": {"$firstN": {"n": per_category, "input": PRODUCT_FIELDS}}}},
+                {"$project": {"_id": 0, "name": "$_id", "count": 1, "min_price": 1, "max_price": 1,
+                              "products": 1}},
+                {"$sort": {"name": 1}},
+            ],
+            "totals": [
+                {"$group": {"_id": None, "count": {"$sum": 1}, **PRICE_BOUNDS}},
+            ],
+        }},
+    ]
+
+
+class StorefrontService:
+    def __init__(self, products_collection, catalog_service, snapshot_store=None):
+        self.products = products_collection
+        self.catalog = catalog_service
+        self.snapshot_store = snapshot_store
+        self.stats = {"hits": 0, "builds": 0}
+        self._cache: Dict[Tuple[int, int], bytes] = {}
+        self._building: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    async def current_version(self) -> int:
+        if self.snapshot_store is not None:
+            return self.snapshot_store.published_version()
+        return await self.catalog.get_version()
+
+    async def build(self, per_category: int, version: int) -> bytes:
+        """Run the aggregation and serialize the bundle"""
+        result = await self.products.aggregate(storefront_pipeline(per_category)).to_list(1)
+        facets = result[0] if result else {"categories": [], "totals": []}
+        totals: Dict[str, Optional[float]] = facets["totals"][0] if facets["totals"] else {}
+        self.stats["builds"] += 1
+        return orjson.dumps({
+            "catalog_version": version,
+            "product_count": totals.get("count", 0),
+            "min_price": totals.get("min_price"),
+            "max_price": totals.get("max_price"),
+            "categories": facets["categories"],
+        })
+
+    async def get(self, per_category: int) -> Tuple[int, bytes]:
+        """The catalog version and the serialized bundle for it"""
+        # The version is read before the aggregation runs, so a bundle is never
+        # older than its version; at worst it is rebuilt once more than needed
+        version = await self.current_version()
+        key = (version, per_category)
+        body = self._cache.get(key)
+        if body is not None:
+            self.stats["hits"] += 1
+            return version, body
+
+        building = self._building.get(key)
+        if building is None:
+            building = self._building[key] = asyncio.ensure_future(self.build(per_category, version))
+            building.add_done_callback(lambda _: self._building.pop(key, None))
+        # Shielded so that a client going away does not cancel the others' build
+        body = await asyncio.shield(building)
+        if key not in self._cache:
+            for stale in [k for k in self._cache if k[0] < version]:
+                del self._cache[stale]
+            self._cache[key] = body
+        return version, body
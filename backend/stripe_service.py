@@ -1,45 +1,61 @@
 from fastapi import HTTPException, Request
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
-import os
 from datetime import datetime
 from database import db, orders_collection
-from payment_models import PaymentTransaction
-from typing import Dict, Any
+from payment_models import PaymentTransaction, CheckoutSessionParams, CheckoutSession, CheckoutStatus
+from outbox import outbox, outbox_event
+from payment_providers import PaymentProvider, FakePaymentProvider, provider_from_env
+from payment_state import (
+    PENDING_TRANSACTION_STATUSES, TransitionResult, payment_target, transition_payment, transition_order
+)
+from typing import Dict, Any, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 class StripePaymentService:
-    def __init__(self):
-        self.api_key = os.environ.get('STRIPE_API_KEY')
-        if not self.api_key:
-            raise ValueError("STRIPE_API_KEY environment variable is required")
+    def __init__(self, provider: Optional[PaymentProvider] = None):
+        # The provider is resolved on first use so that importing this module
+        # never requires payment credentials
+        self._provider = provider
 
-    def _get_stripe_checkout(self, base_url: str) -> StripeCheckout:
-        """Initialize Stripe checkout with webhook URL"""
-        webhook_url = f"{base_url}api/webhook/stripe"
-        return StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+    @property
+    def provider(self) -> PaymentProvider:
+        if self._provider is None:
+            # Fake sessions are shared through Mongo so that every worker can poll them
+            self._provider = provider_from_env(db.fake_payment_sessions)
+            if isinstance(self._provider, FakePaymentProvider) and self._provider.webhook_sink is None:
+                # Deliver fake webhooks straight into our own handler
+                self._provider.webhook_sink = lambda body, signature: self.handle_webhook(body, signature, "")
+        return self._provider
 
-    async def create_checkout_session(self, order_id: str, customer_email: str, origin_url: str) -> CheckoutSessionResponse:
+    @staticmethod
+    def _webhook_url(base_url: str) -> str:
+        return f"{base_url}api/webhook/stripe"
+
+    async def create_checkout_session(self, order_id: str, customer_email: str, origin_url: str) -> CheckoutSession:
         """Create Stripe checkout session for an order"""
         try:
-            # Get order from database
-            order = await orders_collection.find_one({"id": order_id}, {"_id": 0})
+            # Marks the order so that it is no longer expired as abandoned; only
+            # one of this and the expiry sweep can match a pending order
+            order = await orders_collection.find_one_and_update(
+                {"id": order_id, "status": "pending"},
+                {"$set": {"checkout_started_at": datetime.utcnow()}},
+                projection={"_id": 0}
+            )
             if not order:
+                if await orders_collection.count_documents({"id": order_id}, limit=1):
+                    raise HTTPException(status_code=409, detail="Order is no longer awaiting payment")
                 raise HTTPException(status_code=404, detail="Order not found")
 
             # Security: Get amount from server-side order, not from frontend
             total_amount = float(order['total'])
             
-            # Initialize Stripe checkout
-            stripe_checkout = self._get_stripe_checkout(origin_url)
-            
             # Build success and cancel URLs using frontend origin
             success_url = f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
             cancel_url = f"{origin_url}/cart"
             
             # Create checkout session request
-            checkout_request = CheckoutSessionRequest(
+            checkout_request = CheckoutSessionParams(
                 amount=total_amount,
                 currency="usd",
                 success_url=success_url,
@@ -52,8 +68,17 @@ class StripePaymentService:
             )
             
             # Create Stripe checkout session
-            session = await stripe_checkout.create_checkout_session(checkout_request)
+            session = await self.provider.create_checkout_session(
+                checkout_request, self._webhook_url(origin_url)
+            )
             
+            # An order can have several sessions (a retry, or checking out again after
+            # cancelling); only the latest one may expire it
+            await orders_collection.update_one(
+                {"id": order_id, "status": "pending"},
+                {"$set": {"checkout_session_id": session.session_id}}
+            )
+
             # Create payment transaction record BEFORE redirecting to Stripe
             payment_transaction = PaymentTransaction(
                 session_id=session.session_id,
@@ -69,55 +94,76 @@ class StripePaymentService:
             )
             
             # Store payment transaction in database
-            await db.payment_transactions.insert_one(payment_transaction.dict())
+            await db.payment_transactions.insert_one(payment_transaction.model_dump())
             
             logger.info(f"Created Stripe checkout session {session.session_id} for order {order_id}")
             return session
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error creating checkout session: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
+    async def apply_checkout_status(self, session_id: str, checkout_status: CheckoutStatus) -> Optional[TransitionResult]:
+        """Transition the payment transaction, and its order once paid, to match the provider state"""
+        target = payment_target(checkout_status)
+        if target is None:
+            return None
+        status, payment_status = target
+
+        # Moving to "open" has no side effects and needs no transaction
+        if payment_status != "paid" and status != "expired":
+            return await transition_payment(db.payment_transactions, session_id, status, payment_status)
+
+        async def apply(session) -> TransitionResult:
+            result = await transition_payment(
+                db.payment_transactions, session_id, status, payment_status, session=session
+            )
+            order_id = ((result.document or {}).get('metadata') or {}).get('order_id')
+            # Only the caller that performed the transition fires its side effects
+            if not result.applied or not order_id:
+                return result
+
+            if payment_status == "paid":
+                order_result = await transition_order(
+                    orders_collection, order_id, "paid", session=session, payment_session_id=session_id
+                )
+                event = outbox_event("order.paid", order_result.document) if order_result.applied else None
+                if not order_result.applied:
+                    # e.g. the order expired with another session; needs a refund or manual fulfilment
+                    logger.error(f"Session {session_id} was paid but order {order_id} could not be marked paid")
+                    await db.payment_transactions.update_one(
+                        {"session_id": session_id}, {"$set": {"order_not_paid": True}}, session=session
+                    )
+            else:
+                # Orders from before sessions were recorded on them have no checkout_session_id
+                order_result = await transition_order(
+                    orders_collection, order_id, "expired", session=session,
+                    where={"checkout_session_id": {"$in": [session_id, None]}}
+                )
+                event = outbox_event("order.expired", {
+                    "order_id": order_id,
+                    "reservations": order_result.document.get('reservations') or [],
+                }) if order_result.applied else None
+
+            if event is not None:
+                # Committed with the status change; the dispatcher runs the side effects
+                await outbox.enqueue([event], session=session)
+                logger.info(f"Updated order {order_id} status to {order_result.document['status']}")
+            return result
+
+        return await outbox.transaction(apply)
+
     async def get_checkout_status(self, session_id: str, base_url: str) -> Dict[str, Any]:
         """Get checkout session status and update payment transaction"""
         try:
-            # Initialize Stripe checkout
-            stripe_checkout = self._get_stripe_checkout(base_url)
-            
             # Get status from Stripe
-            checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-            
-            # Find existing payment transaction
-            payment_transaction = await db.payment_transactions.find_one(
-                {"session_id": session_id}, {"_id": 0}
-            )
-            
-            if not payment_transaction:
-                raise HTTPException(status_code=404, detail="Payment transaction not found")
-            
-            # Update payment transaction status (only if not already processed)
-            if payment_transaction['payment_status'] != 'paid' or payment_transaction['status'] != 'completed':
-                update_data = {
-                    "payment_status": checkout_status.payment_status,
-                    "status": "completed" if checkout_status.payment_status == "paid" else checkout_status.status,
-                    "updated_at": datetime.utcnow()
-                }
-                
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {"$set": update_data}
-                )
-                
-                # If payment is successful, update order status
-                if checkout_status.payment_status == "paid":
-                    order_id = payment_transaction['metadata'].get('order_id')
-                    if order_id:
-                        await orders_collection.update_one(
-                            {"id": order_id},
-                            {"$set": {"status": "paid", "payment_session_id": session_id}}
-                        )
-                        logger.info(f"Updated order {order_id} status to paid")
-            
+            checkout_status: CheckoutStatus = await self.provider.get_checkout_status(session_id)
+
+            # Single guarded update; a no-op when the transaction is already past this state
+            await self.apply_checkout_status(session_id, checkout_status)
+
             return {
                 "session_id": session_id,
                 "status": checkout_status.status,
@@ -131,17 +177,26 @@ class StripePaymentService:
             logger.error(f"Error getting checkout status: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to get checkout status: {str(e)}")
 
+    async def reconcile_transaction(self, payment_transaction: Dict[str, Any]) -> Optional[str]:
+        """Query Stripe for a pending transaction and apply its terminal state, if any"""
+        session_id = payment_transaction['session_id']
+        checkout_status: CheckoutStatus = await self.provider.get_checkout_status(session_id)
+
+        target = payment_target(checkout_status)
+        if target is None or target[0] in PENDING_TRANSACTION_STATUSES:
+            return None
+
+        result = await self.apply_checkout_status(session_id, checkout_status)
+        return result.document['status'] if result.applied else None
+
     async def handle_webhook(self, request_body: bytes, stripe_signature: str, base_url: str):
         """Handle Stripe webhook events"""
         try:
-            # Initialize Stripe checkout
-            stripe_checkout = self._get_stripe_checkout(base_url)
-            
-            # Handle webhook
-            webhook_response = await stripe_checkout.handle_webhook(request_body, stripe_signature)
+            # Verify and parse the webhook
+            webhook_response = await self.provider.handle_webhook(request_body, stripe_signature)
             
             # Update payment transaction based on webhook event
-            if hasattr(webhook_response, 'session_id') and webhook_response.session_id:
+            if webhook_response.session_id:
                 await self.get_checkout_status(webhook_response.session_id, base_url)
             
             logger.info(f"Processed webhook event: {webhook_response.event_type}")
@@ -151,5 +206,5 @@ class StripePaymentService:
             logger.error(f"Error handling webhook: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Webhook processing failed: {str(e)}")
 
-# Global stripe service instance
+# Global stripe service instance; the payment provider is chosen from PAYMENT_PROVIDER on first use
 stripe_service = StripePaymentService()
\ No newline at end of file
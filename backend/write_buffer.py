@@ -0,0 +1,98 @@
+from pymongo.errors import BulkWriteError, WriteError
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_DELAY_MS = float(os.environ.get('WRITE_BUFFER_DELAY_MS', 5))
+WRITE_BUFFER_MAX_BATCH = int(os.environ.get('WRITE_BUFFER_MAX_BATCH', 500))
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class InsertBuffer:
+    """
+    Coalesces single-document inserts from concurrent requests.
+
+    Documents submitted within `max_delay_seconds` of each other are written
+    with one unordered insert_many. Each caller gets its own outcome back:
+    True when its document was inserted, False when it hit a unique index,
+    or the write error raised for its document.
+    """
+
+    def __init__(self, collection, max_delay_seconds: float = WRITE_BUFFER_DELAY_MS / 1000,
+                 max_batch_size: int = WRITE_BUFFER_MAX_BATCH):
+        self.collection = collection
+        self.max_delay_seconds = max_delay_seconds
+        self.max_batch_size = max_batch_size
+        self.stats = {"submitted": 0, "flushes": 0, "duplicates": 0}
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+    async def submit(self, document: Dict[str, Any]) -> bool:
+        """Queue a document for insertion and wait for the batch it lands in"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((document, future))
+        self.stats["submitted"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay_seconds, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+        # The waiting request may have been cancelled in the meantime
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        self.stats["flushes"] += 1
+        try:
+            await self.collection.insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            for index, (_, future) in enumerate(batch):
+                error = errors.get(index)
+                if error is None:
+                    self._resolve(future, True)
+                elif error.get("code") == DUPLICATE_KEY_ERROR:
+                    self.stats["duplicates"] += 1
+                    self._resolve(future, False)
+                else:
+                    self._resolve(future, error=WriteError(error.get("errmsg"), error.get("code"), error))
+            return
+        except Exception as e:
+            logger.error(f"Buffered insert of {len(batch)} documents failed: {str(e)}")
+            for _, future in batch:
+                self._resolve(future, error=e)
+            return
+
+        for _, future in batch:
+            self._resolve(future, True)
+
+    async def close(self):
+        """Flush whatever is still queued and wait for in-flight batches"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -7,17 +7,24 @@ import { Link } from 'react-router-dom';
 import { useToast } from '../hooks/use-toast';
 import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// crypto.randomUUID is only available in secure contexts
+const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() ||
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+
 const Cart = () => {
   const { items, updateQuantity, removeFromCart, clearCart, getTotalPrice } = useCart();
   const { toast } = useToast();
   const [customerEmail, setCustomerEmail] = useState('');
   const [isProcessing, setIsProcessing] = useState(false);
+  // One Idempotency-Key per checkout attempt, reused when the same attempt is retried
+  const checkoutAttempt = useRef(null);
 
   const handleStripeCheckout = async () => {
     if (items.length === 0) return;
@@ -47,7 +54,13 @@ const Cart = () => {
         customer_email: customerEmail
       };
 
-      const orderResponse = await axios.post(`${API}/orders`, orderData);
+      const attemptPayload = JSON.stringify(orderData);
+      if (!checkoutAttempt.current || checkoutAttempt.current.payload !== attemptPayload) {
+        checkoutAttempt.current = { key: newIdempotencyKey(), payload: attemptPayload };
+      }
+      const headers = { 'Idempotency-Key': checkoutAttempt.current.key };
+
+      const orderResponse = await axios.post(`${API}/orders`, orderData, { headers });
       const orderId = orderResponse.data.id;
       
       // Create Stripe checkout session
@@ -57,11 +70,12 @@ const Cart = () => {
         origin_url: window.location.origin
       };
 
-      const checkoutResponse = await axios.post(`${API}/checkout/create-session`, checkoutData);
+      const checkoutResponse = await axios.post(`${API}/checkout/create-session`, checkoutData, { headers });
       
       // Redirect to Stripe Checkout
       if (checkoutResponse.data.url) {
         // Clear cart before redirecting to Stripe
+        checkoutAttempt.current = null;
         clearCart();
         setCustomerEmail('');
         
@@ -78,13 +78,16 @@ const CustomDesign = () => {
     setIsSubmitting(true);
 
     try {
-      const customOrderData = {
-        email: formData.email,
-        custom_text: formData.customText || null,
-        description: formData.description || null,
-        file_name: formData.selectedFile?.name || null
-      };
+      const customOrderData = new FormData();
+      customOrderData.append('email', formData.email);
+      if (formData.customText) customOrderData.append('custom_text', formData.customText);
+      if (formData.description) customOrderData.append('description', formData.description);
+      if (formData.selectedFile) {
+        customOrderData.append('file_name', formData.selectedFile.name);
+        customOrderData.append('file', formData.selectedFile);
+      }
 
+      // The browser sets the multipart boundary; the design file is streamed to the backend
       const response = await axios.post(`${API}/custom-orders`, customOrderData);
 
       toast({
@@ -26,13 +26,12 @@ const Home = () => {
 useEffect(() => {
   const fetchProducts = async () => {
     try {
-      const response = await axios.get('/.netlify/functions/products');
-
-      console.log("Fetched products:", response.data);
+      // One small bundle instead of the whole product list
+      const response = await axios.get(`${API}/storefront`, { params: { per_category: 2 } });
 
       // ✅ Safe handling of data
-      const data = Array.isArray(response.data) ? response.data : [];
-      setFeaturedProducts(data.slice(0, 8));
+      const sections = Array.isArray(response.data?.categories) ? response.data.categories : [];
+      setFeaturedProducts(sections.flatMap((section) => section.products).slice(0, 8));
 
       setLoading(false);
     } catch (error) {
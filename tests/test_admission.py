@@ -0,0 +1,39 @@
+from admission import TokenBuckets, client_address
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    buckets = TokenBuckets(rate=2, burst=3)
+    assert [buckets.take("a", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a", now=0.0) == 0.5
+    # Half a second buys one token back
+    assert buckets.take("a", now=0.5) == 0.0
+    assert buckets.take("a", now=0.5) > 0
+    # Refills never exceed the burst
+    assert [buckets.take("a", now=100.0) for _ in range(4)][-1] > 0
+
+
+def test_clients_have_separate_buckets_and_old_ones_are_dropped():
+    buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+    assert buckets.take("a", now=0.0) == 0.0
+    assert buckets.take("b", now=0.0) == 0.0
+    assert buckets.take("a", now=0.0) > 0
+    buckets.take("c", now=0.0)
+    # "b" was the least recently seen and starts over with a full bucket
+    assert buckets.take("b", now=0.0) == 0.0
+
+
+def forwarded(peer: str, header: str = None):
+    scope = {"client": (peer, 1234), "headers": []}
+    if header is not None:
+        scope["headers"].append((b"x-forwarded-for", header.encode()))
+    return scope
+
+
+def test_client_address_only_follows_trusted_proxies():
+    trusted = {"10.0.0.5"}
+    assert client_address(forwarded("1.1.1.1"), trusted) == "1.1.1.1"
+    assert client_address(forwarded("10.0.0.5", "9.9.9.9, 2.2.2.2"), trusted) == "2.2.2.2"
+    # Already rewritten by uvicorn's proxy middleware
+    assert client_address(forwarded("2.2.2.2", "9.9.9.9, 2.2.2.2"), trusted) == "2.2.2.2"
+    # Forwarded by a proxy that is not trusted: the client cannot be identified
+    assert client_address(forwarded("10.0.0.9", "2.2.2.2"), trusted) is None
@@ -0,0 +1,42 @@
+from catalog_snapshot import CatalogSnapshotStore, CatalogView, encode_snapshot
+
+PRODUCTS = [
+    {"id": 12, "name": "Oversized Hoodie", "category": "Hoodies", "price": 64.5,
+     "image": "https://example.com/h.jpg", "description": "Heavyweight fleece", "sku": "HD-1"},
+    {"id": 3, "name": "Urban Essential Tee", "category": "T-Shirts", "price": 28.0,
+     "image": "https://example.com/t.jpg", "description": "Ünïcode cotton", "sku": None},
+    {"id": 7, "name": "Box Logo Tee", "category": "T-Shirts", "price": 32.0,
+     "image": "https://example.com/b.jpg", "description": "Boxy fit", "sku": "TS-7"},
+]
+
+
+def test_view_round_trip(tmp_path):
+    store = CatalogSnapshotStore(str(tmp_path))
+    assert store.view() is None
+    assert store.publish(PRODUCTS, 4)
+
+    view = store.view()
+    assert isinstance(view, CatalogView)
+    assert view.version == 4
+    assert [product["id"] for product in view.products()] == [3, 7, 12]
+    for product in PRODUCTS:
+        assert view.get(product["id"]) == product
+    assert view.get(5) is None
+    assert [product["id"] for product in view.category("T-Shirts")] == [3, 7]
+    assert [product["id"] for product in view.category("T-Shirts", limit=1)] == [3]
+    assert view.category("Hats") == []
+
+
+def test_older_version_does_not_replace_newer(tmp_path):
+    store = CatalogSnapshotStore(str(tmp_path))
+    assert store.publish(PRODUCTS, 5)
+    assert not store.publish(PRODUCTS[:1], 4)
+    assert store.published_version() == 5
+
+    assert store.publish(PRODUCTS[:1], 6)
+    # A second store on the same directory, as another worker, sees the new snapshot
+    assert [product["id"] for product in CatalogSnapshotStore(str(tmp_path)).view().products()] == [12]
+
+
+def test_encoding_is_deterministic():
+    assert encode_snapshot(PRODUCTS, 1) == encode_snapshot(list(reversed(PRODUCTS)), 1)
@@ -0,0 +1,63 @@
+import asyncio
+
+from newsletter_io import export_subscribers, iter_csv_rows, iter_emails, iter_lines
+
+
+async def chunked(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def rows(data: bytes):
+    async def collect():
+        return [row async for row in iter_csv_rows(iter_lines(chunked(data)))]
+    return asyncio.run(collect())
+
+
+def test_plain_rows_and_blank_lines():
+    assert rows(b"email,name\r\na@example.com,Ann\n\nb@example.com,Bo\n") == [
+        ["email", "name"], ["a@example.com", "Ann"], ["b@example.com", "Bo"],
+    ]
+
+
+def test_quoted_fields_with_commas_quotes_and_newlines():
+    data = b'"Doe, Jane",jane@example.com\n"two\nlines",m@example.com\n"say ""hi""",q@example.com\n'
+    assert rows(data) == [
+        ["Doe, Jane", "jane@example.com"],
+        ["two\nlines", "m@example.com"],
+        ['say "hi"', "q@example.com"],
+    ]
+
+
+def test_unterminated_quote_at_end_is_reported():
+    assert rows(b'a@example.com\n"open,z@example.com\n') == [["a@example.com"], None]
+
+
+def test_email_column_from_header():
+    async def collect():
+        data = b"name,email\nAnn,a@example.com\n"
+        return [email async for email in iter_emails(iter_lines(chunked(data)), "csv")]
+    assert asyncio.run(collect()) == ["a@example.com"]
+
+
+def test_export_round_trips_through_import():
+    class Cursor:
+        def __init__(self, documents):
+            self.documents = documents
+
+        def batch_size(self, size):
+            return self
+
+        async def __aiter__(self):
+            for document in self.documents:
+                yield document
+
+    class Collection:
+        def find(self, *args):
+            return Cursor([{"id": "1", "email": 'odd,"name"@example.com'}, {"id": "2", "email": "b@example.com"}])
+
+    async def round_trip():
+        exported = b"".join([chunk async for chunk in export_subscribers(Collection(), "csv")])
+        return [email async for email in iter_emails(iter_lines(chunked(exported)), "csv")]
+
+    assert asyncio.run(round_trip()) == ['odd,"name"@example.com', "b@example.com"]
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from payment_models import CheckoutSessionParams
+from payment_providers import FakePaymentProvider, PaymentProviderError
+
+PARAMS = CheckoutSessionParams(
+    amount=56.0, currency="usd", success_url="https://shop.test/success?session_id={CHECKOUT_SESSION_ID}",
+    cancel_url="https://shop.test/cart", metadata={"order_id": "o-1"},
+)
+
+
+def test_fake_sessions_are_visible_to_every_worker():
+    async def run():
+        sessions = mongomock_motor.AsyncMongoMockClient().shop.fake_payment_sessions
+        # Two providers on one collection, as in two server worker processes
+        creator = FakePaymentProvider(complete_after_seconds=None, sessions_collection=sessions)
+        poller = FakePaymentProvider(complete_after_seconds=None, sessions_collection=sessions)
+
+        session = await creator.create_checkout_session(PARAMS, webhook_url="")
+        before = await poller.get_checkout_status(session.session_id)
+        await poller.complete_session(session.session_id, "paid")
+        after = await creator.get_checkout_status(session.session_id)
+        return session, before, after
+
+    session, before, after = asyncio.run(run())
+    assert session.url == f"https://shop.test/success?session_id={session.session_id}"
+    assert (before.status, before.payment_status) == ("open", "unpaid")
+    assert (after.status, after.payment_status) == ("complete", "paid")
+    assert after.amount_total == 5600
+    assert after.metadata == {"order_id": "o-1"}
+
+
+def test_unknown_session_is_a_provider_error():
+    provider = FakePaymentProvider(
+        sessions_collection=mongomock_motor.AsyncMongoMockClient().shop.fake_payment_sessions
+    )
+    with pytest.raises(PaymentProviderError):
+        asyncio.run(provider.get_checkout_status("cs_fake_missing"))
@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from payment_models import CheckoutSessionParams
+from payment_providers import FakePaymentProvider
+from payment_reconciler import PaymentReconciler
+from payment_state import PENDING_TRANSACTION_STATUSES, payment_target, transition_payment
+
+NOW = datetime(2026, 1, 1, 12, 0)
+STALE = NOW - timedelta(hours=2)
+
+
+class FakePaymentService:
+    """The reconcile step of StripePaymentService, without orders or the outbox"""
+
+    def __init__(self, provider, collection):
+        self.provider = provider
+        self.collection = collection
+
+    async def reconcile_transaction(self, transaction):
+        checkout_status = await self.provider.get_checkout_status(transaction["session_id"])
+        target = payment_target(checkout_status)
+        if target is None or target[0] in PENDING_TRANSACTION_STATUSES:
+            return None
+        result = await transition_payment(self.collection, transaction["session_id"], *target)
+        return result.document["status"] if result.applied else None
+
+
+class TransactionCollection:
+    """
+    mongomock re-reads a find_one_and_update(AFTER) result with the original
+    filter unless the projection keeps _id, which misses guarded transitions
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def find_one_and_update(self, query, update, projection=None, **kwargs):
+        document = await self.collection.find_one_and_update(query, update, **kwargs)
+        if document is not None and projection == {"_id": 0}:
+            document.pop("_id")
+        return document
+
+
+def transactions():
+    return TransactionCollection(mongomock_motor.AsyncMongoMockClient().shop.payment_transactions)
+
+
+async def start_checkout(provider, collection, created_at, status="initiated"):
+    session = await provider.create_checkout_session(CheckoutSessionParams(
+        amount=56.0, currency="usd", success_url="https://shop.test/success?session_id={CHECKOUT_SESSION_ID}",
+        cancel_url="https://shop.test/cart", metadata={},
+    ), webhook_url="")
+    await collection.insert_one({
+        "session_id": session.session_id, "status": status, "payment_status": "unpaid", "created_at": created_at,
+    })
+    return session.session_id
+
+
+async def statuses(collection):
+    return {t["session_id"]: t["status"] async for t in collection.find()}
+
+
+def test_sweep_moves_stale_sessions_to_their_final_state():
+    async def run():
+        collection = transactions()
+        provider = FakePaymentProvider(complete_after_seconds=None)
+        reconciler = PaymentReconciler(
+            FakePaymentService(provider, collection), collection, PENDING_TRANSACTION_STATUSES,
+            stale_after_seconds=30 * 60, batch_size=2, concurrency=2,
+        )
+
+        paid = await start_checkout(provider, collection, STALE)
+        expired = await start_checkout(provider, collection, STALE + timedelta(seconds=1), status="open")
+        abandoned = await start_checkout(provider, collection, STALE + timedelta(seconds=2))
+        fresh = await start_checkout(provider, collection, NOW - timedelta(minutes=5))
+        for session_id in (paid, fresh):
+            await provider.complete_session(session_id, "paid")
+        await provider.complete_session(expired, "expired")
+
+        first = await reconciler.sweep_once(NOW)
+        after_first = await statuses(collection)
+        second = await reconciler.sweep_once(NOW)
+        return first, second, after_first, await statuses(collection), (paid, expired, abandoned, fresh)
+
+    first, second, after_first, after_second, (paid, expired, abandoned, fresh) = asyncio.run(run())
+    assert first == {"checked": 3, "unchanged": 1, "errors": 0, "completed": 1, "expired": 1}
+    assert after_first == {paid: "completed", expired: "expired", abandoned: "initiated", fresh: "initiated"}
+    # Only the still-open session is looked at again
+    assert second == {"checked": 1, "unchanged": 1, "errors": 0}
+    assert after_second == after_first
+
+
+def test_provider_failures_are_counted_and_retried_next_sweep():
+    async def run():
+        collection = transactions()
+        provider = FakePaymentProvider(complete_after_seconds=None)
+        reconciler = PaymentReconciler(
+            FakePaymentService(provider, collection), collection, PENDING_TRANSACTION_STATUSES,
+            stale_after_seconds=30 * 60,
+        )
+        session_id = await start_checkout(provider, collection, STALE)
+        await provider.complete_session(session_id, "paid")
+
+        provider.failure_rate = 1.0
+        failed = await reconciler.sweep_once(NOW)
+        provider.failure_rate = 0.0
+        retried = await reconciler.sweep_once(NOW)
+        return failed, retried, await statuses(collection)
+
+    failed, retried, final = asyncio.run(run())
+    assert failed == {"checked": 1, "unchanged": 0, "errors": 1}
+    assert retried == {"checked": 1, "unchanged": 0, "errors": 0, "completed": 1}
+    assert list(final.values()) == ["completed"]
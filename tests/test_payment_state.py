@@ -0,0 +1,28 @@
+import pytest
+
+from payment_models import CheckoutStatus
+from payment_state import PENDING_TRANSACTION_STATUSES, payment_target
+
+
+def status(status: str, payment_status: str) -> CheckoutStatus:
+    return CheckoutStatus(status=status, payment_status=payment_status, amount_total=5600, currency="usd")
+
+
+@pytest.mark.parametrize("checkout_status, expected", [
+    (status("complete", "paid"), ("completed", "paid")),
+    # Paid wins even if the session is reported in another state
+    (status("open", "paid"), ("completed", "paid")),
+    (status("expired", "unpaid"), ("expired", "expired")),
+    (status("complete", "no_payment_required"), ("completed", "no_payment_required")),
+    (status("open", "unpaid"), ("open", "unpaid")),
+    (status("unknown", "unpaid"), None),
+])
+def test_payment_target(checkout_status, expected):
+    assert payment_target(checkout_status) == expected
+
+
+def test_complete_but_unpaid_stays_pending():
+    # Delayed payment methods: the later "paid" must still be able to apply
+    target = payment_target(status("complete", "unpaid"))
+    assert target == ("open", "unpaid")
+    assert target[0] in PENDING_TRANSACTION_STATUSES
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError, WriteError
+
+from write_buffer import DUPLICATE_KEY_ERROR, InsertBuffer
+
+
+class FakeCollection:
+    """Rejects documents whose email was seen before, or that are marked bad"""
+
+    def __init__(self):
+        self.emails = set()
+        self.batches = []
+
+    async def insert_many(self, documents, ordered=True):
+        self.batches.append(len(documents))
+        errors = []
+        for index, document in enumerate(documents):
+            if document.get("bad"):
+                errors.append({"index": index, "code": 121, "errmsg": "Document failed validation"})
+            elif document["email"] in self.emails:
+                errors.append({"index": index, "code": DUPLICATE_KEY_ERROR, "errmsg": "E11000 duplicate key"})
+            else:
+                self.emails.add(document["email"])
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+def test_batch_outcomes_are_mapped_to_each_caller():
+    async def run():
+        collection = FakeCollection()
+        buffer = InsertBuffer(collection, max_delay_seconds=0.01)
+        results = await asyncio.gather(
+            buffer.submit({"email": "a@example.com"}),
+            buffer.submit({"email": "b@example.com"}),
+            buffer.submit({"email": "a@example.com"}),
+            buffer.submit({"email": "c@example.com", "bad": True}),
+            return_exceptions=True,
+        )
+        return collection, buffer, results
+
+    collection, buffer, results = asyncio.run(run())
+    assert collection.batches == [4]
+    assert results[:3] == [True, True, False]
+    assert isinstance(results[3], WriteError)
+    assert results[3].code == 121
+    assert buffer.stats["duplicates"] == 1
+
+
+def test_full_batch_flushes_without_waiting():
+    async def run():
+        collection = FakeCollection()
+        buffer = InsertBuffer(collection, max_delay_seconds=60, max_batch_size=2)
+        results = await asyncio.wait_for(asyncio.gather(
+            buffer.submit({"email": "a@example.com"}),
+            buffer.submit({"email": "b@example.com"}),
+        ), timeout=1)
+        return collection, results
+
+    collection, results = asyncio.run(run())
+    assert results == [True, True]
+    assert collection.batches == [2]
+
+
+def test_other_failures_reach_every_caller():
+    class Down:
+        async def insert_many(self, documents, ordered=True):
+            raise ConnectionError("no primary")
+
+    async def run():
+        buffer = InsertBuffer(Down(), max_delay_seconds=0)
+        return await asyncio.gather(
+            buffer.submit({"email": "a@example.com"}), buffer.submit({"email": "b@example.com"}),
+            return_exceptions=True,
+        )
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(run()))